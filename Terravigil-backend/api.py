@@ -1,30 +1,70 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.multipart import MultipartMiddleware
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 import json
 import os
+import tempfile
 import asyncio
 import uuid
 import time
 from threading import Lock
-import tempfile
-import urllib.request
 
 import geopandas as gpd
 
-from detection import detect_mining
-from boundary_check import check_boundary
-from volume_estimation import estimate_volume
-from utils.geo_utils import save_upload_file_tmp
+from detection import (detect_mining, detect_mining_frame, detection_result, NDVI_THRESHOLD, BRIGHTNESS_THRESHOLD, MORPHOLOGY_RADIUS,
+                       MIN_COMPONENT_PIXELS, SIMPLIFY_TOLERANCE)
+from boundary_check import check_boundary, get_boundary_registry, AREA_METHODS
+from volume_estimation import estimate_volume, estimate_zonal_volumes
+from pipeline import run_pipeline
+from timeseries import run_time_series
+from utils.geo_utils import save_upload_file_tmp, stream_upload_to_tmp, scratch_dir, UploadTooLargeError, MAX_UPLOAD_BYTES
+from utils.result_cache import ResultCache, result_cache_from_env, hash_geojson
+from utils.geojson_io import RawJSON, dumps, loads
+from utils.output_formats import (OUTPUT_FORMATS, MEDIA_TYPES, FILE_EXTENSIONS, detection_frame, iter_ndjson,
+                                  read_feature_collection, write_flatgeobuf, write_mask_cog, result_layers)
+from utils.vector_tiles import vector_tile_cache_from_env, MVT_MEDIA_TYPE
+from utils.dem_tiles import dem_tile_store_from_env, check_demtype
+from utils.mask_store import mask_store_from_env
+from utils.task_store import task_store_from_env
+from utils.metrics import MetricsRegistry, StageMetrics, collect, run_measured, peak_rss_bytes
+from utils.job_queue import (job_scheduler_from_env, QueueFullError, SchedulerClosedError, JobCancelledError,
+                             PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
 
 
 app = FastAPI(title="TerraVigil Backend", description="AI-Powered Mining Activity Detection & Monitoring Tool", version="1.0.0")
 
-# --- Global task storage for progress tracking ---
-task_storage: Dict[str, Dict[str, Any]] = {}
-task_lock = Lock()
+# --- Task store for progress tracking (TTL expiry, optional SQLite persistence, result spill-to-disk) ---
+task_store = task_store_from_env()
+
+# --- Live task event subscribers for /task_events (event loop + queue per SSE client) ---
+task_subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+subscribers_lock = Lock()
+TERMINAL_TASK_STATUSES = ("completed", "failed", "cancelled")
+
+# --- Result cache keyed by input content hash + parameters (memory LRU + disk) ---
+result_cache = result_cache_from_env()
+
+# --- Persistent OpenTopography DEM tile store for /auto_volume_estimation ---
+dem_tile_store = dem_tile_store_from_env()
+
+# --- Vector tiles of finished task results for /tiles (each tile encoded on its first request) ---
+vector_tile_cache = vector_tile_cache_from_env()
+
+# --- Per-date detection masks of monitored AOIs for /timeseries (each new date is diffed against the last) ---
+mask_store = mask_store_from_env()
+
+# --- Per-stage histograms of finished requests and jobs for /metrics ---
+metrics_registry = MetricsRegistry()
+
+# --- Job scheduler: priority queue drained by a bounded process pool ---
+job_scheduler = job_scheduler_from_env()
+JOB_PRIORITIES = {"boundary": PRIORITY_HIGH, "volume": PRIORITY_NORMAL, "detection": PRIORITY_LOW,
+                  "pipeline": PRIORITY_LOW, "timeseries": PRIORITY_LOW}
+# Kinds whose pipelines accept a JobContext (progress reports + cancellation checkpoints)
+CANCELLABLE_KINDS = ("detection", "volume", "pipeline", "timeseries")
 
 # --- CORS Middleware Configuration ---
 # This allows your React frontend to communicate with this backend
@@ -41,98 +81,324 @@ app.add_middleware(
 )
 
 # Increase multipart upload limits to allow large GeoTIFF/DEM files (e.g., up to 1 GB)
-app.add_middleware(MultipartMiddleware, max_file_size=1024 * 1024 * 1024)
+app.add_middleware(MultipartMiddleware, max_file_size=MAX_UPLOAD_BYTES)
 
 
-def update_task_status(task_id: str, status: str, progress: int = 0, result: Any = None, error: str = None):
-    """Update task status in global storage"""
-    with task_lock:
-        if task_id in task_storage:
-            task_storage[task_id].update({
-                "status": status,
-                "progress": progress,
-                "updated_at": time.time()
-            })
-            if result is not None:
-                task_storage[task_id]["result"] = result
-            if error is not None:
-                task_storage[task_id]["error"] = error
+def update_task_status(task_id: str, status: str, progress: int = 0, result: Any = None, error: str = None,
+                       unless_status: Tuple[str, ...] = (), **extra: Any) -> bool:
+    """Update task status in the task store; False (and no event) if the task is in one of unless_status"""
+    fields = {"status": status, "progress": progress, "updated_at": time.time(), **extra}
+    if result is not None:
+        fields["result"] = result
+    if error is not None:
+        fields["error"] = error
+    if not task_store.update(task_id, unless_status=unless_status, **fields):
+        return False
+    _publish_task_event(task_id)
+    return True
 
 
-def run_detection_task(task_id: str, file_path: str):
-    """Background task for mining detection"""
-    try:
-        update_task_status(task_id, "processing", 5)
-        
-        # Check file size and give progress updates
-        file_size = os.path.getsize(file_path)
-        update_task_status(task_id, "processing", 15)
-        
-        # Run detection with progress updates
-        update_task_status(task_id, "processing", 25)
-        result = detect_mining(file_path)
-        update_task_status(task_id, "processing", 90)
-        
-        update_task_status(task_id, "completed", 100, result)
-        
-        # Cleanup
-        try:
-            os.remove(file_path)
-        except Exception:
-            pass
-            
-    except Exception as e:
-        update_task_status(task_id, "failed", 0, error=str(e))
-        # Cleanup on error
+def _publish_task_event(task_id: str):
+    """Push the task's current metadata to any SSE subscribers (called from worker threads)"""
+    with subscribers_lock:
+        subscribers = list(task_subscribers.get(task_id, ()))
+    if not subscribers:
+        return
+    info = task_store.get(task_id, include_result=False)
+    if info is None:
+        return
+    for loop, queue in subscribers:
         try:
-            os.remove(file_path)
-        except Exception:
+            loop.call_soon_threadsafe(queue.put_nowait, info)
+        except RuntimeError:
+            # Subscriber's loop already closed
             pass
 
 
+def _detection_params() -> Dict[str, Any]:
+    return {"ndvi_threshold": NDVI_THRESHOLD, "brightness_threshold": BRIGHTNESS_THRESHOLD,
+            "morphology_radius": MORPHOLOGY_RADIUS, "min_component_pixels": MIN_COMPONENT_PIXELS,
+            "simplify_tolerance": SIMPLIFY_TOLERANCE}
+
+
+def _quicklook_options(target_resolution: Optional[float], max_pixels: Optional[int]) -> Dict[str, Any]:
+    """detect_mining quick-look arguments from the form fields; both unset reads full resolution."""
+    if target_resolution is not None and target_resolution <= 0:
+        raise ValueError("target_resolution must be positive")
+    if max_pixels is not None and max_pixels <= 0:
+        raise ValueError("max_pixels must be positive")
+    return {"target_resolution": target_resolution, "max_pixels": max_pixels}
+
+
+def _detection_cache_key(file_hash: str, quicklook: Dict[str, Any]) -> str:
+    return ResultCache.key("detect_mining", file_hash=file_hash, **_detection_params(), **quicklook)
+
+
+async def _read_boundary_upload(boundary_file: Optional[UploadFile]):
+    """Zipped shapefiles are streamed to a temp file; anything else is parsed as GeoJSON."""
+    if boundary_file is None:
+        return None, None
+    filename = boundary_file.filename or "boundary"
+    if filename.lower().endswith(".zip"):
+        return await asyncio.to_thread(save_upload_file_tmp, boundary_file), None
+    return None, json.loads((await boundary_file.read()).decode("utf-8"))
+
+
+def _area_options(area_method: str, include_geometry: Optional[bool], grid: Optional[str],
+                  pixel_size: Optional[float]) -> Dict[str, Any]:
+    """check_boundary keyword arguments from the form fields; grid is the JSON 'grid' of a detection result."""
+    if area_method not in AREA_METHODS:
+        raise ValueError(f"area_method must be one of {', '.join(AREA_METHODS)}")
+    return {"area_method": area_method, "include_geometry": include_geometry,
+            "grid": json.loads(grid) if grid else None, "pixel_size": pixel_size}
+
+
+def _boundary_cache_key(mining_geojson: Dict[str, Any], boundary_id: str, options: Dict[str, Any]) -> str:
+    """Cache key for checks against a registered boundary; a new dataset version misses the old entries."""
+    meta = get_boundary_registry().metadata(boundary_id)
+    if meta is None:
+        raise HTTPException(status_code=404, detail=f"Unknown boundary_id: {boundary_id}")
+    return ResultCache.key("illegal_mining", geojson_hash=hash_geojson(mining_geojson), boundary_id=boundary_id,
+                           boundary_version=meta["version"], boundary_hash=meta["content_hash"], **options)
+
+
+def _remove_files(*paths: Optional[str]):
+    for path in paths:
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+
+
+def _complete_from_cache(task_id: str, kind: str, filename: Optional[str], result: bytes):
+    """Register a task that is already completed with a cached result (stored as-is, never parsed)."""
+    task_store.create(task_id, {
+        "status": "completed",
+        "progress": 100,
+        "created_at": time.time(),
+        "updated_at": time.time(),
+        "filename": filename,
+        "kind": kind,
+        "cached": True,
+        "result": RawJSON(result)
+    })
+
+
+def _check_output_format(output_format: str):
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(OUTPUT_FORMATS)}")
+
+
+def _detection_section(kind: Optional[str], result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    return result.get("detection") if kind == "pipeline" else result if kind == "detection" else None
+
+
+async def _detection_export(gdf: gpd.GeoDataFrame, grid: Optional[Dict[str, Any]], output_format: str, name: str):
+    """Detected polygons as streamed NDJSON, FlatGeobuf or a mask COG (files are removed once sent)."""
+    if output_format == "cog" and not grid:
+        raise HTTPException(status_code=400, detail="Result has no mask grid; run the detection again to export a mask")
+    filename = f"{name}{FILE_EXTENSIONS[output_format]}"
+    if output_format == "ndjson":
+        return StreamingResponse(iter_ndjson(gdf), media_type=MEDIA_TYPES["ndjson"],
+                                 headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+    path = os.path.join(scratch_dir() or tempfile.gettempdir(), f"{uuid.uuid4().hex}{FILE_EXTENSIONS[output_format]}")
+    try:
+        if output_format == "fgb":
+            await asyncio.to_thread(write_flatgeobuf, gdf, path)
+        else:
+            await asyncio.to_thread(write_mask_cog, gdf, grid, path)
+    except Exception:
+        _remove_files(path)
+        raise
+    return FileResponse(path, media_type=MEDIA_TYPES[output_format], filename=filename,
+                        background=BackgroundTask(_remove_files, path))
+
+
+def _observe(operation: str, metrics: StageMetrics) -> Dict[str, Any]:
+    """Add a finished request to the /metrics histograms; returns its metrics summary."""
+    summary = metrics.summary()
+    metrics_registry.observe_summary(operation, summary)
+    return summary
+
+
+def _profiled_response(result: Dict[str, Any], summary: Dict[str, Any]) -> Response:
+    # Profiled requests skip the cache, so the metrics describe work that actually ran
+    return Response(content=dumps(dict(result, metrics=summary)), media_type="application/json")
+
+
+def _check_admission():
+    """Reject early (before reading the upload) when the job queue cannot take more work."""
+    if job_scheduler.is_full():
+        raise HTTPException(status_code=429, detail="Job queue is full, retry later", headers={"Retry-After": "30"})
+
+
+def enqueue_task(task_id: str, kind: str, fn, *args, priority: Optional[int] = None, cache_key: Optional[str] = None,
+                 cleanup_paths=(), filename: Optional[str] = None, profile: bool = False,
+                 metrics: Optional[StageMetrics] = None, **kwargs):
+    """Register a task and queue `fn(*args, **kwargs)` on the job scheduler.
+
+    The job's stage metrics (plus those of the submitting request in `metrics`, e.g. its uploads) are
+    stored with the task as 'metrics' and added to /metrics; profile=True also profiles the job.
+    Raises HTTPException 429 when the queue is full and 503 when the scheduler is shutting down;
+    the task entry and uploaded files are dropped in both cases.
+    """
+    task_store.create(task_id, {
+        "status": "queued",
+        "progress": 0,
+        "created_at": time.time(),
+        "updated_at": time.time(),
+        "filename": filename,
+        "kind": kind
+    })
+
+    def on_start():
+        if task_store.status(task_id) != "cancelled":
+            update_task_status(task_id, "processing", 5)
+
+    def on_progress(payload):
+        # Progress derived from work done (tiles processed, polygons emitted) inside the job
+        if task_store.status(task_id) == "processing":
+            task_store.update(task_id, **payload)
+            _publish_task_event(task_id)
+
+    def on_complete(outcome):
+        result, summary = outcome
+        if metrics is not None:
+            metrics.merge(summary["stages"])
+            summary["stages"] = metrics.snapshot()
+        metrics_registry.observe_summary(kind, summary)
+        detection = _detection_section(kind, result)
+        # Encode once; the cache and the task store share the bytes (metrics stay out of the cache)
+        result = RawJSON(dumps(result))
+        if cache_key is not None:
+            result_cache.put(cache_key, result)
+        if detection is not None and detection.get("geojson") is not None:
+            # Exports (?format=) read the polygons from here instead of parsing the whole result
+            geojson = detection["geojson"]
+            task_store.put_layer(task_id, "mining", geojson.data if isinstance(geojson, RawJSON) else dumps(geojson),
+                                 grid=detection.get("grid"))
+        # A job that finished between cancellation and its next checkpoint stays cancelled; the check
+        # and the write are one statement, so a cancel landing in between cannot be overwritten
+        update_task_status(task_id, "completed", 100, result, unless_status=("cancelled",), metrics=summary)
+
+    def on_error(e):
+        if isinstance(e, JobCancelledError) or task_store.status(task_id) == "cancelled":
+            update_task_status(task_id, "cancelled", (task_store.get(task_id, include_result=False) or {}).get("progress", 0))
+        else:
+            update_task_status(task_id, "failed", 0, error=str(e))
+
+    def on_finally():
+        _remove_files(*cleanup_paths)
+
+    try:
+        job_scheduler.submit(
+            task_id, run_measured, fn, *args,
+            priority=JOB_PRIORITIES.get(kind, PRIORITY_NORMAL) if priority is None else priority,
+            on_start=on_start, on_complete=on_complete, on_error=on_error, on_finally=on_finally,
+            on_progress=on_progress, with_context=kind in CANCELLABLE_KINDS, profile=profile, **kwargs
+        )
+    except (QueueFullError, SchedulerClosedError) as e:
+        task_store.delete(task_id)
+        _remove_files(*cleanup_paths)
+        status_code = 429 if isinstance(e, QueueFullError) else 503
+        raise HTTPException(status_code=status_code, detail=str(e), headers={"Retry-After": "30"})
+
+
+@app.on_event("shutdown")
+def shutdown_job_scheduler():
+    job_scheduler.shutdown()
+
+
 @app.get("/")
 async def root():
     return {"message": "TerraVigil backend running. Visit /docs for API UI."}
 
 
+def _detect_for_export(image_path: str, cache_key: str, quicklook: Dict[str, Any]) -> Tuple[gpd.GeoDataFrame, Dict[str, Any]]:
+    """Detected frame and grid, exported as they are; the result is encoded only for the cache."""
+    try:
+        gdf, grid = detect_mining_frame(image_path, **quicklook)
+    except Exception as e:
+        raise RuntimeError(f"Detection failed: {str(e)}")
+    result_cache.put(cache_key, detection_result(gdf, grid))
+    return gdf, grid
+
+
 @app.post("/detect_mining")
-async def detect_mining_endpoint(file: UploadFile = File(...)):
-    """Legacy synchronous endpoint - may timeout on large files"""
+async def detect_mining_endpoint(file: UploadFile = File(...), target_resolution: Optional[float] = Form(None),
+                                 max_pixels: Optional[int] = Form(None), profile: bool = Form(False),
+                                 output_format: str = Query("geojson", alias="format")):
+    """Legacy synchronous endpoint - may timeout on large files; quick-look fields keep it fast.
+    profile=true bypasses the cache and adds per-stage metrics and hotspots to the result."""
+    tmp_path = None
     try:
-        tmp_path = save_upload_file_tmp(file)
-        # Run the heavy AI function in a background thread to keep the server responsive
-        result = await asyncio.to_thread(detect_mining, tmp_path)
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
-        return JSONResponse(content=result)
+        _check_output_format(output_format)
+        quicklook = _quicklook_options(target_resolution, max_pixels)
+        with collect(profile) as metrics:
+            # Copying and hashing the upload is blocking file I/O; keep it off the event loop
+            tmp_path, file_hash = await asyncio.to_thread(stream_upload_to_tmp, file)
+            cache_key = _detection_cache_key(file_hash, quicklook)
+            cached = None if profile else result_cache.get_bytes(cache_key)
+            if cached is None and output_format == "geojson":
+                # Run the heavy AI function in a background thread to keep the server responsive
+                result = await asyncio.to_thread(metrics.call, detect_mining, tmp_path, **quicklook)
+                cached = result_cache.put(cache_key, result)
+            elif cached is None:
+                gdf, grid = await asyncio.to_thread(metrics.call, _detect_for_export, tmp_path, cache_key, quicklook)
+        summary = _observe("detect_mining", metrics)
+        _remove_files(tmp_path)
+        if output_format != "geojson":
+            name = os.path.splitext(os.path.basename(file.filename or ""))[0] or "mining"
+            if cached is not None:
+                detection = loads(cached)
+                gdf, grid = await asyncio.to_thread(detection_frame, detection), detection.get("grid")
+            return await _detection_export(gdf, grid, output_format, name)
+        if profile:
+            return _profiled_response(result, summary)
+        return Response(content=cached, media_type="application/json")
+    except HTTPException:
+        raise
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        _remove_files(tmp_path)
 
 
 @app.post("/detect_mining_async")
-async def detect_mining_async_endpoint(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
-    """Start mining detection as background task - returns task ID for progress tracking"""
+async def detect_mining_async_endpoint(file: UploadFile = File(...), target_resolution: Optional[float] = Form(None),
+                                       max_pixels: Optional[int] = Form(None), priority: Optional[int] = Form(None),
+                                       profile: bool = Form(False)):
+    """Queue mining detection on the job scheduler - returns task ID for progress tracking"""
+    tmp_path = None
     try:
+        _check_admission()
+        quicklook = _quicklook_options(target_resolution, max_pixels)
         # Generate unique task ID
         task_id = str(uuid.uuid4())
         
         # Save uploaded file
-        tmp_path = save_upload_file_tmp(file)
-        
-        # Initialize task in storage
-        with task_lock:
-            task_storage[task_id] = {
-                "status": "queued",
-                "progress": 0,
-                "created_at": time.time(),
-                "updated_at": time.time(),
-                "filename": file.filename
-            }
+        with collect() as metrics:
+            tmp_path, file_hash = await asyncio.to_thread(stream_upload_to_tmp, file)
+        cache_key = _detection_cache_key(file_hash, quicklook)
+
+        # Repeat submissions of the same scene complete immediately from the cache (unless profiling)
+        cached = None if profile else result_cache.get_bytes(cache_key)
+        if cached is not None:
+            _remove_files(tmp_path)
+            _complete_from_cache(task_id, "detection", file.filename, cached)
+            return JSONResponse(content={
+                "task_id": task_id,
+                "status": "completed",
+                "message": "Result served from cache. Use /task_status/{task_id} to fetch it."
+            })
         
-        # Start background task
-        background_tasks.add_task(run_detection_task, task_id, tmp_path)
+        # Queue the job; the worker pool bounds how many detections run at once
+        enqueue_task(task_id, "detection", detect_mining, tmp_path, priority=priority, cache_key=cache_key,
+                     cleanup_paths=(tmp_path,), filename=file.filename, profile=profile, metrics=metrics, **quicklook)
         
         return JSONResponse(content={
             "task_id": task_id,
@@ -140,41 +406,147 @@ async def detect_mining_async_endpoint(background_tasks: BackgroundTasks, file:
             "message": "Mining detection started. Use /task_status/{task_id} to check progress."
         })
         
+    except HTTPException:
+        # Once queued, the upload belongs to the job; before that it is ours to remove
+        _remove_files(tmp_path)
+        raise
+    except UploadTooLargeError as e:
+        _remove_files(tmp_path)
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
+        _remove_files(tmp_path)
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/task_status/{task_id}")
-async def get_task_status(task_id: str):
-    """Get status of background task"""
-    with task_lock:
-        if task_id not in task_storage:
+async def get_task_status(task_id: str, output_format: str = Query("geojson", alias="format")):
+    """Get status of background task; other formats export a finished detection's polygons"""
+    _check_output_format(output_format)
+    if output_format == "geojson":
+        task_info = task_store.get_bytes(task_id)
+        if task_info is None:
             raise HTTPException(status_code=404, detail="Task not found")
-        
-        task_info = task_storage[task_id].copy()
-    
-    return JSONResponse(content=task_info)
+        return Response(content=task_info, media_type="application/json")
+
+    task_info = task_store.get(task_id, include_result=False)
+    if task_info is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task_info["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Task is {task_info['status']}; exports need a completed task")
+    if task_info.get("kind") not in ("detection", "pipeline"):
+        raise HTTPException(status_code=400, detail="Only detection and pipeline results can be exported")
+    layer = task_store.get_layer(task_id, "mining")
+    if layer is not None:
+        # The job kept its polygons as a FeatureCollection of their own: no need to parse the whole result
+        gdf, grid = await asyncio.to_thread(read_feature_collection, layer["path"]), layer.get("grid")
+    else:
+        # Tasks served from the result cache only have the stored result
+        detection = _detection_section(task_info["kind"], (task_store.get(task_id) or {}).get("result") or {})
+        if not isinstance(detection, dict) or "geojson" not in detection:
+            raise HTTPException(status_code=400, detail="Only detection and pipeline results can be exported")
+        gdf, grid = await asyncio.to_thread(detection_frame, detection), detection.get("grid")
+    return await _detection_export(gdf, grid, output_format, task_id)
+
+
+async def _ensure_task_tiles(task_id: str):
+    """Store the task's layers for tiling on first use; tiles are then encoded one at a time as requested."""
+    # Known task ids only, so the path segment never names anything else under the tile directory
+    if task_store.status(task_id) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if vector_tile_cache.has(task_id):
+        return
+    task_info = task_store.get(task_id)
+    if task_info is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task_info["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Task is {task_info['status']}; tiles need a completed task")
+    layers = await asyncio.to_thread(result_layers, task_info.get("kind"), task_info.get("result") or {})
+    if not layers:
+        raise HTTPException(status_code=400, detail="Task result has no geometries to tile")
+    await asyncio.to_thread(vector_tile_cache.build, task_id, layers)
+
+
+@app.get("/tiles/{task_id}/tilejson.json")
+async def task_tilejson(task_id: str, request: Request):
+    """TileJSON for a finished task's vector tiles (layers 'mining', 'legal', 'illegal')"""
+    await _ensure_task_tiles(task_id)
+    tilejson = vector_tile_cache.tilejson(task_id)
+    if tilejson is None:
+        raise HTTPException(status_code=404, detail="Tiles not found")
+    tilejson["tiles"] = [f"{str(request.base_url).rstrip('/')}/tiles/{task_id}/{{z}}/{{x}}/{{y}}.mvt"]
+    return JSONResponse(content=tilejson)
+
+
+@app.get("/tiles/{task_id}/{z}/{x}/{y}.mvt")
+async def task_tile(task_id: str, z: int, x: int, y: int):
+    """Mapbox Vector Tile of a finished task result; 204 where the tile has no features"""
+    await _ensure_task_tiles(task_id)
+    data = await asyncio.to_thread(vector_tile_cache.tile, task_id, z, x, y)
+    if data is None:
+        return Response(status_code=204)
+    # Task results never change, so browsers may keep tiles
+    return Response(content=data, media_type=MVT_MEDIA_TYPE,
+                    headers={"Content-Encoding": "gzip", "Cache-Control": "public, max-age=86400"})
 
 
 @app.delete("/task/{task_id}")
 async def cancel_task(task_id: str):
     """Cancel/delete a task"""
-    with task_lock:
-        if task_id not in task_storage:
-            raise HTTPException(status_code=404, detail="Task not found")
-        
-        task_storage[task_id]["status"] = "cancelled"
+    status = task_store.status(task_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if status in TERMINAL_TASK_STATUSES:
+        return JSONResponse(content={"message": f"Task already {status}"})
     
+    update_task_status(task_id, "cancelled", (task_store.get(task_id, include_result=False) or {}).get("progress", 0))
+    # Queued jobs are dropped; running ones stop at their next checkpoint and free the worker
+    job_scheduler.cancel(task_id)
     return JSONResponse(content={"message": "Task cancelled"})
 
 
+@app.get("/task_events/{task_id}")
+async def task_events(task_id: str):
+    """Server-Sent Events stream of task status/progress until the task finishes"""
+    info = task_store.get(task_id, include_result=False)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    with subscribers_lock:
+        task_subscribers.setdefault(task_id, []).append((loop, queue))
+
+    async def event_stream():
+        try:
+            current = task_store.get(task_id, include_result=False) or info
+            while True:
+                yield f"data: {json.dumps(current)}\n\n"
+                if current.get("status") in TERMINAL_TASK_STATUSES:
+                    return
+                try:
+                    current = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Re-send the latest state as a heartbeat so proxies do not drop an idle stream
+                    current = task_store.get(task_id, include_result=False) or current
+        finally:
+            with subscribers_lock:
+                subscribers = task_subscribers.get(task_id, [])
+                if (loop, queue) in subscribers:
+                    subscribers.remove((loop, queue))
+                if not subscribers:
+                    task_subscribers.pop(task_id, None)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
 @app.get("/tasks")
-async def list_tasks():
-    """List all tasks"""
-    with task_lock:
-        tasks = task_storage.copy()
+async def list_tasks(offset: int = 0, limit: int = 50, status: Optional[str] = None):
+    """List task metadata (newest first, without results) one page at a time"""
+    limit = max(1, min(limit, 500))
+    tasks, total = task_store.list(offset=max(0, offset), limit=limit, status=status)
     
-    return JSONResponse(content=tasks)
+    return JSONResponse(content={"tasks": tasks, "total": total, "offset": offset, "limit": limit})
 
 
 @app.get("/test_sample_data")
@@ -228,8 +600,21 @@ async def health_check():
     return JSONResponse(content={"status": "healthy", "version": "1.0.0"})
 
 
-def _download_dem_from_opentopography(west: float, south: float, east: float, north: float, demtype: str = "COP30") -> str:
-    """Download a DEM GeoTIFF covering the bbox from OpenTopography GlobalDEM API and return temp file path.
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint: per-stage histograms of finished requests and jobs, plus process gauges"""
+    body = metrics_registry.render({
+        "terravigil_process_peak_rss_bytes": ("Peak resident memory of the API process", peak_rss_bytes()),
+        "terravigil_job_queue_depth": ("Jobs waiting for a worker", job_scheduler.queue_depth()),
+    })
+    return Response(content=body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _download_dem_from_opentopography(west: float, south: float, east: float, north: float, demtype: str = "COP30",
+                                      dst_crs: Any = None) -> str:
+    """Build a DEM GeoTIFF covering the bbox from OpenTopography GlobalDEM tiles and return temp file path.
+    Tiles are cached on disk per demtype, so repeat assessments of the same area download nothing.
+    dst_crs warps the mosaic to a projected CRS so volumes come out in cubic metres.
     demtype options include: COP30 (global 30m), SRTMGL1 (1 arc-sec), SRTMGL3 (3 arc-sec).
     """
     # Ensure bbox ordering and clamp
@@ -239,114 +624,458 @@ def _download_dem_from_opentopography(west: float, south: float, east: float, no
     if north < south:
         south, north = north, south
 
-    base_url = (
-        "https://portal.opentopography.org/API/globaldem?"
-        f"demtype={demtype}&west={west}&south={south}&east={east}&north={north}&outputFormat=GTiff"
-    )
-    fd, tmp_path = tempfile.mkstemp(suffix=".tif")
-    os.close(fd)
     try:
-        urllib.request.urlretrieve(base_url, tmp_path)
-        if os.path.getsize(tmp_path) == 0:
-            raise RuntimeError("Downloaded DEM is empty")
-        return tmp_path
+        return dem_tile_store.build_mosaic(west, south, east, north, demtype=demtype, directory=scratch_dir(),
+                                           dst_crs=dst_crs)
     except Exception as e:
-        try:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
-        except Exception:
-            pass
         raise HTTPException(status_code=502, detail=f"DEM download failed: {str(e)}")
 
 
 @app.post("/auto_volume_estimation")
 async def auto_volume_estimation_endpoint(
     mining_geojson_str: str = Form(...),
-    demtype: str = Form("COP30")
+    demtype: str = Form("COP30"),
+    integration_method: str = Form("simpson"),
+    profile: bool = Form(False)
 ):
     """Fetch DEM automatically for the mining area and run volume estimation.
     Accepts GeoJSON (string) describing the mining polygons.
     """
+    dem_path = None
     try:
+        check_demtype(demtype)
         geojson_data = json.loads(mining_geojson_str)
         gdf = gpd.GeoDataFrame.from_features(geojson_data.get("features", []), crs=4326)
         if gdf.empty:
             raise HTTPException(status_code=400, detail="Empty GeoJSON provided")
+
+        cache_key = ResultCache.key("auto_volume_estimation", geojson_hash=hash_geojson(geojson_data),
+                                    demtype=demtype, method=integration_method)
+        cached = None if profile else result_cache.get_bytes(cache_key)
+        if cached is not None:
+            return Response(content=cached, media_type="application/json")
         # Compute bbox in lon/lat
         minx, miny, maxx, maxy = gdf.total_bounds
 
-        # Download DEM from OpenTopography
-        dem_path = await asyncio.to_thread(_download_dem_from_opentopography, minx, miny, maxx, maxy, demtype)
+        with collect(profile) as metrics:
+            # Download DEM from OpenTopography
+            dem_path = await asyncio.to_thread(_download_dem_from_opentopography, minx, miny, maxx, maxy, demtype,
+                                               gdf.estimate_utm_crs())
 
-        # Run volume estimation
-        result = await asyncio.to_thread(estimate_volume, dem_path, geojson_data)
+            # Run volume estimation
+            result = await asyncio.to_thread(metrics.call, estimate_volume, dem_path, geojson_data,
+                                             method=integration_method)
+        summary = _observe("auto_volume_estimation", metrics)
 
-        try:
-            os.remove(dem_path)
-        except Exception:
-            pass
-
-        return JSONResponse(content=result)
+        cached = result_cache.put(cache_key, result)
+        if profile:
+            return _profiled_response(result, summary)
+        return Response(content=cached, media_type="application/json")
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        _remove_files(dem_path)
+
+
+@app.post("/boundaries")
+async def register_boundary(
+    boundary_file: UploadFile = File(...),
+    boundary_id: Optional[str] = Form(None),
+    target_crs: Optional[str] = Form(None)
+):
+    """Register a lease boundary dataset (zipped shapefile or GeoJSON) once for reuse by boundary_id"""
+    boundary_path = None
+    try:
+        boundary_path, boundary_geojson = await _read_boundary_upload(boundary_file)
+        meta = await asyncio.to_thread(get_boundary_registry().register, boundary_id or str(uuid.uuid4()),
+                                       boundary_path=boundary_path, boundary_geojson=boundary_geojson,
+                                       target_crs=target_crs)
+        return JSONResponse(content=meta)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        _remove_files(boundary_path)
+
+
+@app.get("/boundaries")
+async def list_boundaries():
+    return JSONResponse(content={"boundaries": get_boundary_registry().list()})
+
+
+@app.get("/boundaries/{boundary_id}")
+async def get_boundary(boundary_id: str):
+    try:
+        meta = get_boundary_registry().metadata(boundary_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Boundary not found")
+    return JSONResponse(content=meta)
+
+
+@app.delete("/boundaries/{boundary_id}")
+async def delete_boundary(boundary_id: str):
+    try:
+        deleted = get_boundary_registry().delete(boundary_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Boundary not found")
+    return JSONResponse(content={"message": "Boundary deleted"})
 
 
 @app.post("/illegal_mining")
 async def illegal_mining_endpoint(
     mining_geojson_file: UploadFile = File(...),
-    boundary_file: Optional[UploadFile] = File(None)
+    boundary_file: Optional[UploadFile] = File(None),
+    boundary_id: Optional[str] = Form(None),
+    area_method: str = Form("vector"),
+    include_geometry: Optional[bool] = Form(None),
+    grid: Optional[str] = Form(None),
+    pixel_size: Optional[float] = Form(None),
+    profile: bool = Form(False)
 ):
+    boundary_path = None
     try:
         mining_geojson = json.loads((await mining_geojson_file.read()).decode("utf-8"))
+        options = _area_options(area_method, include_geometry, grid, pixel_size)
 
-        boundary_path = None
-        boundary_geojson = None
-        if boundary_file is not None:
-            filename = boundary_file.filename or "boundary"
-            if filename.lower().endswith(".zip"):
-                boundary_path = save_upload_file_tmp(boundary_file)
-            else:
-                boundary_geojson = json.loads((await boundary_file.read()).decode("utf-8"))
+        if boundary_id:
+            # Registered boundary: no upload, and results are cached per dataset version
+            cache_key = _boundary_cache_key(mining_geojson, boundary_id, options)
+            cached = None if profile else result_cache.get_bytes(cache_key)
+            if cached is None:
+                with collect(profile) as metrics:
+                    result = await asyncio.to_thread(metrics.call, check_boundary, mining_geojson=mining_geojson,
+                                                     boundary_id=boundary_id, **options)
+                summary = _observe("illegal_mining", metrics)
+                cached = result_cache.put(cache_key, result)
+                if profile:
+                    return _profiled_response(result, summary)
+            return Response(content=cached, media_type="application/json")
 
-        # Run the heavy check in a background thread
-        result = await asyncio.to_thread(check_boundary, mining_geojson=mining_geojson, boundary_path=boundary_path, boundary_geojson=boundary_geojson)
+        with collect(profile) as metrics:
+            boundary_path, boundary_geojson = await _read_boundary_upload(boundary_file)
 
-        if boundary_path and os.path.exists(boundary_path):
-            try:
-                os.remove(boundary_path)
-            except Exception:
-                pass
-        return JSONResponse(content=result)
+            # Run the heavy check in a background thread
+            result = await asyncio.to_thread(metrics.call, check_boundary, mining_geojson=mining_geojson,
+                                             boundary_path=boundary_path, boundary_geojson=boundary_geojson, **options)
+        summary = _observe("illegal_mining", metrics)
+        if profile:
+            return _profiled_response(result, summary)
+        return Response(content=dumps(result), media_type="application/json")
+    except HTTPException:
+        raise
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        _remove_files(boundary_path)
 
 
 @app.post("/volume_estimation")
 async def volume_estimation_endpoint(
     dem_file: UploadFile = File(...),
     # UPDATED to correctly receive the GeoJSON string from the FormData
-    mining_geojson_str: str = Form(...)
+    mining_geojson_str: str = Form(...),
+    integration_method: str = Form("simpson"),
+    zonal: bool = Form(False),
+    profile: bool = Form(False)
 ):
+    dem_path = None
     try:
-        dem_path = save_upload_file_tmp(dem_file)
-        mask_geojson = None
-        if mining_geojson_str:
-            # Load the JSON from the string sent by the frontend
-            mask_geojson = json.loads(mining_geojson_str)
+        with collect(profile) as metrics:
+            dem_path, dem_hash = await asyncio.to_thread(stream_upload_to_tmp, dem_file)
+            mask_geojson = None
+            if mining_geojson_str:
+                # Load the JSON from the string sent by the frontend
+                mask_geojson = json.loads(mining_geojson_str)
 
-        # Run the heavy estimation in a background thread
-        result = await asyncio.to_thread(estimate_volume, dem_path, mask_geojson=mask_geojson)
+            cache_key = ResultCache.key("volume_estimation", dem_hash=dem_hash, geojson_hash=hash_geojson(mask_geojson),
+                                        method=integration_method, zonal=zonal)
+            cached = None if profile else result_cache.get_bytes(cache_key)
+            if cached is None:
+                # Run the heavy estimation in a background thread
+                if zonal:
+                    # Per-feature statistics from a single DEM pass, keyed by feature id
+                    result = await asyncio.to_thread(metrics.call, estimate_zonal_volumes, dem_path, mask_geojson or {},
+                                                     method=integration_method)
+                else:
+                    result = await asyncio.to_thread(metrics.call, estimate_volume, dem_path, mask_geojson=mask_geojson,
+                                                     method=integration_method)
+                cached = result_cache.put(cache_key, result)
+        summary = _observe("volume_estimation", metrics)
 
-        try:
-            os.remove(dem_path)
-        except Exception:
-            pass
-        return JSONResponse(content=result)
+        if profile:
+            return _profiled_response(result, summary)
+        return Response(content=cached, media_type="application/json")
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         # Return richer error context for debugging
         raise HTTPException(status_code=400, detail=f"volume_estimation failed: {type(e).__name__}: {str(e)}")
+    finally:
+        _remove_files(dem_path)
+
+
+
+@app.post("/illegal_mining_async")
+async def illegal_mining_async_endpoint(
+    mining_geojson_file: UploadFile = File(...),
+    boundary_file: Optional[UploadFile] = File(None),
+    boundary_id: Optional[str] = Form(None),
+    area_method: str = Form("vector"),
+    include_geometry: Optional[bool] = Form(None),
+    grid: Optional[str] = Form(None),
+    pixel_size: Optional[float] = Form(None),
+    priority: Optional[int] = Form(None),
+    profile: bool = Form(False)
+):
+    """Queue a legal/illegal boundary check - returns task ID for progress tracking"""
+    try:
+        _check_admission()
+        task_id = str(uuid.uuid4())
+        mining_geojson = json.loads((await mining_geojson_file.read()).decode("utf-8"))
+        options = _area_options(area_method, include_geometry, grid, pixel_size)
+
+        if boundary_id:
+            cache_key = _boundary_cache_key(mining_geojson, boundary_id, options)
+            cached = None if profile else result_cache.get_bytes(cache_key)
+            if cached is not None:
+                _complete_from_cache(task_id, "boundary", mining_geojson_file.filename, cached)
+                return JSONResponse(content={"task_id": task_id, "status": "completed"})
+            enqueue_task(task_id, "boundary", check_boundary, priority=priority, cache_key=cache_key,
+                         filename=mining_geojson_file.filename, profile=profile, mining_geojson=mining_geojson,
+                         boundary_id=boundary_id, **options)
+            return JSONResponse(content={"task_id": task_id, "status": "queued"})
+
+        with collect() as metrics:
+            boundary_path, boundary_geojson = await _read_boundary_upload(boundary_file)
+        enqueue_task(task_id, "boundary", check_boundary, priority=priority, cleanup_paths=(boundary_path,),
+                     filename=mining_geojson_file.filename, profile=profile, metrics=metrics,
+                     mining_geojson=mining_geojson, boundary_path=boundary_path, boundary_geojson=boundary_geojson,
+                     **options)
+        return JSONResponse(content={"task_id": task_id, "status": "queued"})
+    except HTTPException:
+        raise
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/volume_estimation_async")
+async def volume_estimation_async_endpoint(
+    dem_file: UploadFile = File(...),
+    mining_geojson_str: str = Form(...),
+    integration_method: str = Form("simpson"),
+    zonal: bool = Form(False),
+    priority: Optional[int] = Form(None),
+    profile: bool = Form(False)
+):
+    """Queue volume estimation - returns task ID for progress tracking"""
+    dem_path = None
+    try:
+        _check_admission()
+        task_id = str(uuid.uuid4())
+        with collect() as metrics:
+            dem_path, dem_hash = await asyncio.to_thread(stream_upload_to_tmp, dem_file)
+        mask_geojson = json.loads(mining_geojson_str) if mining_geojson_str else None
+        cache_key = ResultCache.key("volume_estimation", dem_hash=dem_hash, geojson_hash=hash_geojson(mask_geojson),
+                                    method=integration_method, zonal=zonal)
+
+        if zonal:
+            fn, args, kwargs = estimate_zonal_volumes, (dem_path, mask_geojson or {}), {"method": integration_method}
+        else:
+            fn, args, kwargs = estimate_volume, (dem_path,), {"mask_geojson": mask_geojson, "method": integration_method}
+        enqueue_task(task_id, "volume", fn, *args, priority=priority, cache_key=cache_key,
+                     cleanup_paths=(dem_path,), filename=dem_file.filename, profile=profile, metrics=metrics, **kwargs)
+        return JSONResponse(content={"task_id": task_id, "status": "queued"})
+    except HTTPException:
+        _remove_files(dem_path)
+        raise
+    except UploadTooLargeError as e:
+        _remove_files(dem_path)
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        _remove_files(dem_path)
+        raise HTTPException(status_code=400, detail=f"volume_estimation failed: {type(e).__name__}: {str(e)}")
+
+
+@app.post("/pipeline_async")
+async def pipeline_async_endpoint(
+    file: UploadFile = File(...),
+    dem_file: Optional[UploadFile] = File(None),
+    boundary_file: Optional[UploadFile] = File(None),
+    boundary_id: Optional[str] = Form(None),
+    demtype: Optional[str] = Form(None),
+    area_method: str = Form("vector"),
+    include_geometry: Optional[bool] = Form(None),
+    integration_method: str = Form("simpson"),
+    target_resolution: Optional[float] = Form(None),
+    max_pixels: Optional[int] = Form(None),
+    priority: Optional[int] = Form(None),
+    profile: bool = Form(False)
+):
+    """Queue detection -> boundary check -> volume estimation for one scene as a single job.
+
+    The boundary stage runs when boundary_file or boundary_id is given, the volume stage when
+    dem_file is uploaded or demtype names an OpenTopography dataset to fetch for the detected area.
+    """
+    paths = []
+    try:
+        _check_admission()
+        task_id = str(uuid.uuid4())
+        if area_method not in AREA_METHODS:
+            raise ValueError(f"area_method must be one of {', '.join(AREA_METHODS)}")
+        if demtype:
+            check_demtype(demtype)
+        # The boundary stage counts pixels on the detection grid itself, so no grid/pixel_size fields
+        options = {"area_method": area_method, "include_geometry": include_geometry}
+        quicklook = _quicklook_options(target_resolution, max_pixels)
+
+        with collect() as metrics:
+            image_path, image_hash = await asyncio.to_thread(stream_upload_to_tmp, file)
+            paths.append(image_path)
+            dem_path = dem_hash = None
+            if dem_file is not None:
+                dem_path, dem_hash = await asyncio.to_thread(stream_upload_to_tmp, dem_file)
+                paths.append(dem_path)
+
+            boundary_path = boundary_geojson = None
+            boundary_key = None
+            if boundary_id:
+                meta = get_boundary_registry().metadata(boundary_id)
+                if meta is None:
+                    raise HTTPException(status_code=404, detail=f"Unknown boundary_id: {boundary_id}")
+                boundary_key = [boundary_id, meta["version"], meta["content_hash"]]
+            elif boundary_file is not None:
+                if (boundary_file.filename or "").lower().endswith(".zip"):
+                    boundary_path, boundary_key = await asyncio.to_thread(stream_upload_to_tmp, boundary_file)
+                    paths.append(boundary_path)
+                else:
+                    boundary_geojson = json.loads((await boundary_file.read()).decode("utf-8"))
+                    boundary_key = hash_geojson(boundary_geojson)
+
+        cache_key = ResultCache.key("pipeline", image_hash=image_hash, dem_hash=dem_hash,
+                                    demtype=None if dem_hash else demtype, boundary=boundary_key,
+                                    method=integration_method, **_detection_params(), **quicklook, **options)
+        cached = None if profile else result_cache.get_bytes(cache_key)
+        if cached is not None:
+            _remove_files(*paths)
+            _complete_from_cache(task_id, "pipeline", file.filename, cached)
+            return JSONResponse(content={"task_id": task_id, "status": "completed"})
+
+        enqueue_task(task_id, "pipeline", run_pipeline, image_path, priority=priority, cache_key=cache_key,
+                     cleanup_paths=tuple(paths), filename=file.filename, profile=profile, metrics=metrics,
+                     dem_path=dem_path,
+                     boundary_path=boundary_path, boundary_geojson=boundary_geojson,
+                     boundary_id=boundary_id or None, demtype=demtype or None, method=integration_method,
+                     **quicklook, **options)
+        return JSONResponse(content={"task_id": task_id, "status": "queued"})
+    except HTTPException:
+        _remove_files(*paths)
+        raise
+    except UploadTooLargeError as e:
+        _remove_files(*paths)
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        _remove_files(*paths)
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/timeseries_async")
+async def timeseries_async_endpoint(
+    files: List[UploadFile] = File(...),
+    dates: str = Form(...),
+    aoi_id: str = Form(...),
+    include_geometry: bool = Form(True),
+    target_resolution: Optional[float] = Form(None),
+    max_pixels: Optional[int] = Form(None),
+    priority: Optional[int] = Form(None),
+    profile: bool = Form(False)
+):
+    """Queue detection of a stack of co-registered scenes of one AOI, reporting only the change per date.
+
+    dates lists one YYYY-MM-DD acquisition date per file, comma-separated in upload order. Each date is
+    compared with the latest date stored for aoi_id before it, including dates sent in earlier batches.
+    """
+    paths = []
+    try:
+        _check_admission()
+        task_id = str(uuid.uuid4())
+        mask_store.check_id(aoi_id)
+        scene_dates = [mask_store.check_date(value.strip()) for value in dates.split(",") if value.strip()]
+        if len(scene_dates) != len(files):
+            raise ValueError(f"Got {len(files)} files but {len(scene_dates)} dates")
+        quicklook = _quicklook_options(target_resolution, max_pixels)
+
+        scenes = []
+        with collect() as metrics:
+            for scene_date, upload in zip(scene_dates, files):
+                path, file_hash = await asyncio.to_thread(stream_upload_to_tmp, upload)
+                paths.append(path)
+                scenes.append({"date": scene_date, "path": path, "hash": file_hash})
+
+        enqueue_task(task_id, "timeseries", run_time_series, aoi_id, scenes, priority=priority,
+                     cleanup_paths=tuple(paths), filename=aoi_id, profile=profile, metrics=metrics,
+                     include_geometry=include_geometry, **quicklook)
+        return JSONResponse(content={"task_id": task_id, "status": "queued"})
+    except HTTPException:
+        _remove_files(*paths)
+        raise
+    except UploadTooLargeError as e:
+        _remove_files(*paths)
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        _remove_files(*paths)
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/timeseries")
+async def list_timeseries():
+    return JSONResponse(content={"aois": mask_store.list()})
+
+
+@app.get("/timeseries/{aoi_id}")
+async def get_timeseries(aoi_id: str):
+    """Stored dates of an AOI with their footprint area and mask grid"""
+    try:
+        dates = [mask_store.get(aoi_id, day) for day in mask_store.dates(aoi_id)]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not dates:
+        raise HTTPException(status_code=404, detail="AOI not found")
+    return JSONResponse(content={"aoi_id": aoi_id, "dates": [meta for meta in dates if meta is not None]})
+
+
+@app.get("/timeseries/{aoi_id}/{date}/mask")
+async def get_timeseries_mask(aoi_id: str, date: str):
+    """Stored detection mask of one date as a 1-bit COG"""
+    try:
+        path = mask_store.mask_path(aoi_id, date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if mask_store.get(aoi_id, date) is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Mask not found")
+    return FileResponse(path, media_type=MEDIA_TYPES["cog"], filename=f"{aoi_id}_{date}.tif")
+
+
+@app.delete("/timeseries/{aoi_id}")
+async def delete_timeseries(aoi_id: str, date: Optional[str] = None):
+    """Forget one stored date of an AOI, or all of them; the next batch then starts a new baseline"""
+    try:
+        deleted = mask_store.delete(aoi_id, date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Nothing stored for that AOI/date")
+    return JSONResponse(content={"message": "Deleted"})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,288 @@
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+
+from pipeline import run_pipeline_frames
+from boundary_check import get_boundary_registry, AREA_METHODS
+from volume_estimation import INTEGRATION_METHODS
+from utils.geo_utils import hash_file
+from utils.output_formats import write_flatgeobuf, write_mask_cog
+from utils.parallel import resolve_workers, get_process_pool
+from utils.dem_tiles import check_demtype
+from utils.metrics import collect
+
+try:
+    import pyarrow  # noqa: F401  optional: only needed for --format parquet
+except ImportError:
+    pyarrow = None
+
+
+RASTER_EXTENSIONS = (".tif", ".tiff")
+MANIFEST_NAME = "manifest.jsonl"
+OUTPUT_EXTENSIONS = {"fgb": ".fgb", "parquet": ".parquet"}
+# Scenes queued per worker: enough to keep the pool busy without holding thousands of futures
+IN_FLIGHT_PER_WORKER = 2
+# Seconds between scans of a watched directory
+WATCH_INTERVAL = 10.0
+
+
+def _write_parquet(gdf, path: str) -> str:
+    gdf.to_parquet(path)
+    return path
+
+
+OUTPUT_WRITERS = {"fgb": write_flatgeobuf, "parquet": _write_parquet}
+
+
+class Manifest:
+    """Append-only JSON-lines record of processed scenes in the output directory.
+
+    A scene is skipped when its last entry is 'done' for the same path, size, mtime and options, so an
+    interrupted backfill resumes where it stopped and failed scenes are retried on the next run.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    self._entries[entry["path"]] = entry
+
+    def is_done(self, key: Dict[str, Any]) -> bool:
+        entry = self._entries.get(key["path"])
+        return entry is not None and entry.get("status") == "done" and all(entry.get(k) == v for k, v in key.items())
+
+    def record(self, entry: Dict[str, Any]):
+        self._entries[entry["path"]] = entry
+        with open(self.path, "a", encoding="utf-8") as out:
+            out.write(json.dumps(entry) + "\n")
+
+
+def iter_scenes(inputs: List[str], recursive: bool = False) -> Iterator[Tuple[str, str]]:
+    """(absolute path, output name) of every GeoTIFF among the inputs.
+
+    Files given directly are named by their stem; files found in a directory keep their path relative
+    to it, so scenes with the same name in different folders do not overwrite each other's outputs.
+    """
+    for item in inputs:
+        item = os.path.abspath(item)
+        if os.path.isfile(item):
+            yield item, os.path.splitext(os.path.basename(item))[0]
+            continue
+        for root, dirs, files in os.walk(item):
+            dirs.sort()
+            if not recursive:
+                dirs[:] = []
+            for filename in sorted(files):
+                if filename.lower().endswith(RASTER_EXTENSIONS) and not filename.startswith("."):
+                    path = os.path.join(root, filename)
+                    yield path, os.path.splitext(os.path.relpath(path, item))[0]
+
+
+def process_scene(image_path: str, out_base: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the pipeline on one scene and write its layers next to out_base; returns the manifest fields.
+
+    Process-pool entry point: polygons go straight from the pipeline frames to FlatGeobuf/Parquet
+    without passing through GeoJSON, and only the summary (with the per-stage metrics) travels back.
+    """
+    started = time.time()
+    with collect() as metrics:
+        result = run_pipeline_frames(image_path, workers=1, **options["pipeline"])
+        layers = {"mining": result["mining"]}
+        boundary = result["boundary"]
+        if boundary is not None:
+            for name in ("legal", "illegal"):
+                if name in boundary:
+                    layers[name] = boundary.pop(name)
+
+        os.makedirs(os.path.dirname(out_base) or ".", exist_ok=True)
+        writer, extension = OUTPUT_WRITERS[options["format"]], OUTPUT_EXTENSIONS[options["format"]]
+        outputs = {}
+        for name, gdf in layers.items():
+            path = f"{out_base}.{name}{extension}"
+            if os.path.exists(path):
+                os.remove(path)
+            outputs[name] = writer(gdf, path)
+        if options["mask"]:
+            outputs["mask"] = write_mask_cog(result["mining"], result["grid"], f"{out_base}.mask.tif")
+
+    return {"area_ha": result["area_ha"], "polygons": int(len(result["mining"])),
+            "mask_shape": [result["grid"]["height"], result["grid"]["width"]], "boundary": boundary,
+            "volume": result["volume"], "outputs": outputs, "seconds": round(time.time() - started, 3),
+            "stages": metrics.snapshot()}
+
+
+def _options_signature(options: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(options, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _run_inline(fn, *args) -> Future:
+    # Serial runs go through the same Future-based loop as the pool
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def run_batch(inputs: List[str], out_dir: str, options: Dict[str, Any], workers: Optional[int] = None,
+              recursive: bool = False, force: bool = False, watch: bool = False,
+              interval: float = WATCH_INTERVAL, log=None) -> Dict[str, int]:
+    """Process every scene among the inputs into out_dir, skipping scenes the manifest has done.
+
+    options are {"format": "fgb"|"parquet", "mask": bool, "pipeline": run_pipeline_frames keyword
+    arguments}. Scenes run one per pool worker with a bounded number in flight, and each is recorded
+    in the manifest as soon as it finishes. With watch=True the inputs are rescanned every `interval`
+    seconds until interrupted; a new file is only picked up once its size and mtime stop changing.
+    Returns counts of processed, skipped and failed scenes.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(out_dir, MANIFEST_NAME))
+    signature = _options_signature(options)
+    workers = resolve_workers(workers)
+    pool = get_process_pool(workers) if workers > 1 else None
+    counts = {"processed": 0, "skipped": 0, "failed": 0}
+    handled, last_seen = set(), {}
+    in_flight: Dict[Future, Dict[str, Any]] = {}
+
+    def finish(future, key):
+        entry = dict(key, finished_at=time.time())
+        try:
+            entry.update(status="done", **future.result())
+            counts["processed"] += 1
+        except Exception as e:
+            entry.update(status="failed", error=f"{type(e).__name__}: {e}")
+            counts["failed"] += 1
+        manifest.record(entry)
+        if log is not None:
+            if entry["status"] == "done":
+                log(f"done   {key['path']}: {entry['area_ha']:.2f} ha, {entry['polygons']} polygons, {entry['seconds']:.1f}s")
+            else:
+                log(f"failed {key['path']}: {entry['error']}")
+
+    while True:
+        pending = []
+        for path, name in iter_scenes(inputs, recursive):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            key = {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "options": signature}
+            marker = (path, stat.st_size, stat.st_mtime_ns)
+            if marker in handled:
+                continue
+            if not force and manifest.is_done(key):
+                handled.add(marker)
+                counts["skipped"] += 1
+                continue
+            if watch and last_seen.get(path) != marker:
+                # Seen for the first time or still growing: wait a scan in case it is being copied in
+                last_seen[path] = marker
+                continue
+            handled.add(marker)
+            pending.append((key, os.path.join(out_dir, name)))
+
+        while pending or in_flight:
+            while pending and (pool is None or len(in_flight) < workers * IN_FLIGHT_PER_WORKER):
+                key, out_base = pending.pop(0)
+                if pool is None:
+                    finish(_run_inline(process_scene, key["path"], out_base, options), key)
+                else:
+                    in_flight[pool.submit(process_scene, key["path"], out_base, options)] = key
+            if in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future, in_flight.pop(future))
+
+        if not watch:
+            return counts
+        time.sleep(interval)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Run detection (plus optional boundary check and volume estimation) on local GeoTIFFs "
+                    "without the HTTP server, writing FlatGeobuf or GeoParquet layers per scene.")
+    parser.add_argument("inputs", nargs="+", help="GeoTIFF files and/or directories of GeoTIFFs")
+    parser.add_argument("--out", required=True, help="Output directory; holds the manifest and one set of layers per scene")
+    parser.add_argument("--format", choices=sorted(OUTPUT_WRITERS), default="fgb", help="Vector output format")
+    parser.add_argument("--mask", action="store_true", help="Also write the detection mask as a 1-bit COG")
+    parser.add_argument("--workers", type=int, help="Scenes processed at once (default: TERRAVIGIL_WORKERS; 0 = one per CPU)")
+    parser.add_argument("--recursive", action="store_true", help="Descend into subdirectories of input directories")
+    parser.add_argument("--watch", action="store_true", help="Keep rescanning the inputs for new files until interrupted")
+    parser.add_argument("--interval", type=float, default=WATCH_INTERVAL, help="Seconds between scans with --watch")
+    parser.add_argument("--force", action="store_true", help="Reprocess scenes the manifest already has")
+    parser.add_argument("--boundary", help="Lease boundaries (zipped shapefile or GeoJSON) to split legal/illegal mining")
+    parser.add_argument("--boundary-id", help="Registered boundary dataset to use instead of --boundary")
+    parser.add_argument("--area-method", choices=AREA_METHODS, default="vector")
+    parser.add_argument("--dem", help="DEM GeoTIFF covering the scenes, for volume estimation")
+    parser.add_argument("--demtype", help="OpenTopography dataset to fetch a DEM per scene from the tile store")
+    parser.add_argument("--integration-method", choices=INTEGRATION_METHODS, default="simpson")
+    parser.add_argument("--target-resolution", type=float, help="Quick-look ground resolution in CRS units")
+    parser.add_argument("--max-pixels", type=int, help="Quick-look pixel budget per scene")
+    args = parser.parse_args(argv)
+
+    if args.format == "parquet" and pyarrow is None:
+        parser.error("--format parquet needs pyarrow installed")
+    if args.boundary and args.boundary_id:
+        parser.error("pass --boundary or --boundary-id, not both")
+    if args.demtype:
+        try:
+            check_demtype(args.demtype)
+        except ValueError as e:
+            parser.error(str(e))
+
+    boundary_id, boundary_version = args.boundary_id, None
+    registry = get_boundary_registry()
+    if args.boundary:
+        # Registered once (by content), so every worker reuses the indexed leases instead of reparsing them
+        boundary_id = f"batch-{hash_file(args.boundary)[:16]}"
+        if args.boundary.lower().endswith(".zip"):
+            meta = registry.register(boundary_id, boundary_path=args.boundary)
+        else:
+            with open(args.boundary, "r", encoding="utf-8") as f:
+                meta = registry.register(boundary_id, boundary_geojson=json.load(f))
+        boundary_version = meta["content_hash"]
+    elif boundary_id:
+        meta = registry.metadata(boundary_id)
+        if meta is None:
+            parser.error(f"unknown boundary id: {boundary_id}")
+        boundary_version = meta["content_hash"]
+
+    options = {
+        "format": args.format,
+        "mask": args.mask,
+        "pipeline": {"boundary_id": boundary_id, "area_method": args.area_method,
+                     "dem_path": os.path.abspath(args.dem) if args.dem else None, "demtype": args.demtype,
+                     "method": args.integration_method, "target_resolution": args.target_resolution,
+                     "max_pixels": args.max_pixels},
+    }
+    # The manifest signature covers the boundary content too, so re-registered leases reprocess scenes
+    options_key = dict(options, boundary_version=boundary_version)
+
+    def log(message):
+        print(message, file=sys.stderr, flush=True)
+
+    try:
+        counts = run_batch(args.inputs, args.out, options_key, workers=args.workers, recursive=args.recursive,
+                           force=args.force, watch=args.watch, interval=args.interval, log=log)
+    except KeyboardInterrupt:
+        log("interrupted; finished scenes are in the manifest")
+        return 130
+    log(f"{counts['processed']} processed, {counts['skipped']} skipped, {counts['failed']} failed")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from typing import Optional
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.io import MemoryFile
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+
+
+# Arc-second grid, the resolution of SRTMGL1/COP30
+RESOLUTION_DEG = 1.0 / 3600
+NODATA = -9999.0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            west, south, east, north = (float(query[k][0]) for k in ("west", "south", "east", "north"))
+        except (KeyError, ValueError):
+            self.send_error(400, "west, south, east and north are required")
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        data = dem_geotiff(west, south, east, north, self.server.source)
+        self.server.requests += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "image/tiff")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def dem_geotiff(west: float, south: float, east: float, north: float, source: Optional[str] = None) -> bytes:
+    """GeoTIFF bytes of the bbox: `source` (any DEM file) warped to it, else a smooth synthetic terrain.
+
+    Either way the same point always gets the same height, so adjacent tiles line up.
+    """
+    width = max(1, int(round((east - west) / RESOLUTION_DEG)))
+    height = max(1, int(round((north - south) / RESOLUTION_DEG)))
+    transform = from_bounds(west, south, east, north, width, height)
+    if source is not None:
+        with rasterio.open(source) as src, WarpedVRT(src, crs="EPSG:4326", transform=transform, width=width,
+                                                     height=height, resampling=Resampling.bilinear,
+                                                     nodata=NODATA) as vrt:
+            dem = vrt.read(1).astype(np.float32)
+    else:
+        cols, rows = np.meshgrid(np.arange(width) + 0.5, np.arange(height) + 0.5)
+        lon, lat = transform * (cols, rows)
+        dem = (400 + 80 * np.sin(lon * 40) + 40 * np.cos(lat * 55)).astype(np.float32)
+    with MemoryFile() as memfile:
+        with memfile.open(driver="GTiff", width=width, height=height, count=1, dtype="float32",
+                          crs="EPSG:4326", transform=transform, nodata=NODATA) as dst:
+            dst.write(dem, 1)
+        return memfile.read()
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 source: Optional[str] = None) -> ThreadingHTTPServer:
+    """Serve the OpenTopography GlobalDEM query API in a daemon thread; stop with server.shutdown().
+
+    Point OPENTOPOGRAPHY_URL (or DemTileStore base_url) at server.url. latency adds a fixed delay
+    per request, to mimic the real service when benchmarking cold tile stores; source serves that
+    DEM (e.g. a synthetic one with pits) instead of the built-in terrain.
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.latency = latency
+    server.source = source
+    server.requests = 0
+    server.url = f"http://{server.server_address[0]}:{server.server_address[1]}/API/globaldem"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenTopography GlobalDEM API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument("--source", help="DEM GeoTIFF to serve instead of the built-in terrain")
+    args = parser.parse_args()
+    server = start_server(args.host, args.port, args.latency, args.source)
+    print(f"export OPENTOPOGRAPHY_URL={server.url}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
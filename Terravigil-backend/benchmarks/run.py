@@ -0,0 +1,354 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage, peak RSS is reported as null
+    resource = None
+
+import numpy as np
+import rasterio
+import geopandas as gpd
+import shapely
+from rasterio.windows import Window
+
+from detection import detect_mining_frame, vectorize_mask
+from boundary_check import check_boundary_frame, get_boundary_registry
+from volume_estimation import estimate_volume
+from utils.geo_utils import geojson_bytes_from_gdf
+from utils.dem_tiles import DemTileStore
+from benchmarks.synthetic import (write_scene, write_dem, write_leases, pit_mask_reader, scene_transform,
+                                  SCENE_CRS, BLOCK_SIZE, GENERATOR_VERSION)
+from benchmarks.opentopography_stub import start_server
+
+
+# Scene sizes by pixel count (square side), and lease layer sizes
+SCENE_SIZES = {"1M": 1000, "16M": 4000, "100M": 10000, "1B": 31623}
+LEASE_COUNTS = (10, 1000, 100_000)
+SUITES = {
+    "quick": {"sizes": ["1M"], "leases": [10, 1000]},
+    "standard": {"sizes": ["1M", "16M"], "leases": [10, 1000, 100_000]},
+    "full": {"sizes": list(SCENE_SIZES), "leases": list(LEASE_COUNTS)},
+}
+SCENE_STAGES = ("detect", "polygonize", "geojson", "volume", "auto_volume_cold", "auto_volume_warm")
+LEASE_STAGES = ("boundary", "boundary_raster", "boundary_inline")
+STAGES = SCENE_STAGES + LEASE_STAGES
+# Relative change in time or peak memory reported as a regression/improvement against the baseline
+DEFAULT_TOLERANCE = 0.15
+
+
+def _peak_rss_mb() -> Optional[float]:
+    # VmHWM is this process's own high-water mark; ru_maxrss on Linux keeps the parent's across exec
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _mining(inputs: Dict[str, Any]) -> gpd.GeoDataFrame:
+    return gpd.read_file(inputs["mining"])
+
+
+def _setup_detect(inputs, workers):
+    def run():
+        gdf, grid = detect_mining_frame(inputs["scene"], workers=workers)
+        return {"polygons": len(gdf), "pixels": grid["width"] * grid["height"]}
+    return run
+
+
+def _setup_polygonize(inputs, workers):
+    side = inputs["side"]
+    read_mask = pit_mask_reader(side, inputs["seed"])
+    tile = 4 * BLOCK_SIZE
+    windows = [Window(c, r, min(tile, side - c), min(tile, side - r))
+               for r in range(0, side, tile) for c in range(0, side, tile)]
+
+    def run():
+        gdf = vectorize_mask(read_mask, windows, side, side, scene_transform(side), SCENE_CRS)
+        return {"polygons": len(gdf)}
+    return run
+
+
+def _setup_geojson(inputs, workers):
+    mining = _mining(inputs)
+
+    def run():
+        return {"polygons": len(mining), "bytes": len(geojson_bytes_from_gdf(mining))}
+    return run
+
+
+def _setup_volume(inputs, workers):
+    mining = _mining(inputs)
+
+    def run():
+        result = estimate_volume(inputs["dem"], mining, workers=workers)
+        return {"volume_m3": round(result["volume_m3"], 1)}
+    return run
+
+
+def _setup_auto_volume(inputs, workers, warm: bool):
+    # Same steps as /auto_volume_estimation: parse the GeoJSON, mosaic DEM tiles for its bbox, integrate
+    mining_json = _mining(inputs).to_crs(4326).to_json()
+    server = start_server(source=inputs["dem"])
+    store_dir = os.path.join(inputs["tmp"], "dem-tiles")
+
+    def run():
+        if not warm:
+            shutil.rmtree(store_dir, ignore_errors=True)
+        requests_before = server.requests
+        geojson = json.loads(mining_json)
+        gdf = gpd.GeoDataFrame.from_features(geojson["features"], crs=4326)
+        store = DemTileStore(store_dir, base_url=server.url)
+        dem_path = store.build_mosaic(*gdf.total_bounds, directory=inputs["tmp"])
+        try:
+            # Like the endpoint, the lon/lat mosaic is integrated as is, so the volume is not in m3;
+            # the mosaic size is the counter that shows the same work was done
+            with rasterio.open(dem_path) as src:
+                dem_pixels = src.width * src.height
+            estimate_volume(dem_path, geojson, workers=workers)
+        finally:
+            os.remove(dem_path)
+        return {"dem_pixels": dem_pixels, "tile_requests": server.requests - requests_before}
+
+    if warm:
+        run()
+    return run
+
+
+def _setup_boundary(inputs, workers, area_method: str = "vector", inline: bool = False):
+    mining = _mining(inputs)
+    with open(inputs["grid"], "r", encoding="utf-8") as f:
+        grid = json.load(f)
+    with open(inputs["leases"], "r", encoding="utf-8") as f:
+        leases = json.load(f)
+    kwargs = {"boundary_geojson": leases} if inline else {"boundary_id": f"bench-{inputs['lease_count']}"}
+    if not inline:
+        get_boundary_registry().register(kwargs["boundary_id"], boundary_geojson=leases)
+        # Load the indexed dataset once, as a long-running worker would have it
+        get_boundary_registry().get(kwargs["boundary_id"])
+
+    def run():
+        result = check_boundary_frame(mining, area_method=area_method, grid=grid, frames=True, **kwargs)
+        return {"legal_area_ha": round(result["legal_area_ha"], 4), "illegal_area_ha": round(result["illegal_area_ha"], 4)}
+    return run
+
+
+SETUPS: Dict[str, Callable] = {
+    "detect": _setup_detect,
+    "polygonize": _setup_polygonize,
+    "geojson": _setup_geojson,
+    "volume": _setup_volume,
+    "auto_volume_cold": lambda inputs, workers: _setup_auto_volume(inputs, workers, warm=False),
+    "auto_volume_warm": lambda inputs, workers: _setup_auto_volume(inputs, workers, warm=True),
+    "boundary": _setup_boundary,
+    "boundary_raster": lambda inputs, workers: _setup_boundary(inputs, workers, area_method="raster"),
+    "boundary_inline": lambda inputs, workers: _setup_boundary(inputs, workers, inline=True),
+}
+
+
+def _run_case(stage: str, inputs: Dict[str, Any], repeat: int, workers: int) -> Dict[str, Any]:
+    # Runs in a fresh process per case, so peak RSS belongs to this stage (pool workers not included)
+    os.environ["TERRAVIGIL_BOUNDARY_DIR"] = os.path.join(inputs["data_dir"], "boundaries")
+    os.makedirs(inputs["tmp"], exist_ok=True)
+    run = SETUPS[stage](inputs, workers)
+    setup_rss = _peak_rss_mb()
+    times, counters = [], {}
+    for _ in range(repeat):
+        started = time.perf_counter()
+        counters = run()
+        times.append(time.perf_counter() - started)
+    return {"seconds": round(statistics.median(times), 4), "min_seconds": round(min(times), 4), "runs": repeat,
+            "peak_rss_mb": _peak_rss_mb(), "setup_rss_mb": setup_rss, "counters": counters}
+
+
+def _in_fresh_process(fn, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def _prepare_mining(scene: str, mining_path: str, grid_path: str):
+    gdf, grid = detect_mining_frame(scene)
+    gdf.to_file(mining_path, driver="FlatGeobuf")
+    with open(grid_path, "w", encoding="utf-8") as out:
+        json.dump(grid, out)
+
+
+def prepare_inputs(data_dir: str, sizes: List[str], lease_counts: List[int], seed: int = 0, log=print) -> Dict[str, Any]:
+    """Generate (once; files are reused across runs) the scenes, DEMs, detected polygons and lease layers."""
+    os.makedirs(data_dir, exist_ok=True)
+    inputs = {}
+    for name in sizes:
+        side = SCENE_SIZES[name]
+        base = os.path.join(data_dir, f"scene-{name}-s{seed}-v{GENERATOR_VERSION}")
+        paths = {"scene": f"{base}.tif", "dem": f"{base}.dem.tif", "mining": f"{base}.mining.fgb",
+                 "grid": f"{base}.grid.json"}
+        if not os.path.exists(paths["scene"]):
+            log(f"generating {name} scene ({side} x {side})")
+            write_scene(paths["scene"], side, seed)
+        if not os.path.exists(paths["dem"]):
+            log(f"generating {name} DEM")
+            write_dem(paths["dem"], side, seed)
+        if not os.path.exists(paths["grid"]):
+            log(f"detecting {name} scene once for the boundary and volume inputs")
+            _in_fresh_process(_prepare_mining, paths["scene"], paths["mining"], paths["grid"])
+        leases = {}
+        for count in lease_counts:
+            leases[count] = os.path.join(data_dir, f"leases-{name}-{count}-s{seed}.geojson")
+            if not os.path.exists(leases[count]):
+                log(f"generating {count} leases over the {name} scene")
+                write_leases(leases[count], count, side, seed)
+        inputs[name] = dict(paths, side=side, seed=seed, leases_by_count=leases, data_dir=data_dir,
+                            tmp=os.path.join(data_dir, "tmp"))
+    return inputs
+
+
+def run_suite(inputs: Dict[str, Any], stages: List[str], lease_counts: List[int], repeat: int = 3,
+              workers: int = 1, log=print) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    for name, scene_inputs in inputs.items():
+        for stage in stages:
+            counts = lease_counts if stage in LEASE_STAGES else [None]
+            for count in counts:
+                case_id = f"{stage}/{name}" + (f"/{count}" if count is not None else "")
+                case_inputs = dict(scene_inputs)
+                if count is not None:
+                    case_inputs.update(leases=scene_inputs["leases_by_count"][count], lease_count=count)
+                try:
+                    results[case_id] = _in_fresh_process(_run_case, stage, case_inputs, repeat, workers)
+                except Exception as e:
+                    results[case_id] = {"error": f"{type(e).__name__}: {e}"}
+                log(_format_row(case_id, results[case_id]))
+    return results
+
+
+def _format_row(case_id: str, result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None,
+                status: str = "") -> str:
+    if "error" in result:
+        return f"{case_id:<34} ERROR {result['error']}"
+    row = f"{case_id:<34} {result['seconds']:>9.3f}s {result['peak_rss_mb'] or 0:>8.1f} MB"
+    if baseline is not None and "seconds" in baseline:
+        row += f"   base {baseline['seconds']:>9.3f}s {baseline['peak_rss_mb'] or 0:>8.1f} MB  x{result['seconds'] / max(baseline['seconds'], 1e-9):.2f}"
+    return f"{row}  {status}".rstrip()
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = DEFAULT_TOLERANCE) -> Dict[str, str]:
+    """Status per case against a baseline run: slower/faster (time), more-memory/less-memory (peak RSS),
+    changed (different output counters, i.e. the stage no longer computes the same thing), new, or ok."""
+    statuses = {}
+    for case_id, result in results.items():
+        base = baseline.get(case_id)
+        if "error" in result:
+            statuses[case_id] = "error"
+            continue
+        if base is None or "seconds" not in base:
+            statuses[case_id] = "new"
+            continue
+        flags = []
+        ratio = result["seconds"] / max(base["seconds"], 1e-9)
+        if ratio > 1 + tolerance:
+            flags.append("slower")
+        elif ratio < 1 - tolerance:
+            flags.append("faster")
+        if result.get("peak_rss_mb") and base.get("peak_rss_mb"):
+            mem_ratio = result["peak_rss_mb"] / base["peak_rss_mb"]
+            if mem_ratio > 1 + tolerance:
+                flags.append("more-memory")
+            elif mem_ratio < 1 - tolerance:
+                flags.append("less-memory")
+        for key, value in result["counters"].items():
+            expected = base.get("counters", {}).get(key)
+            if expected is not None and not np.isclose(value, expected, rtol=1e-6):
+                flags.append("changed")
+                break
+        statuses[case_id] = ",".join(flags) or "ok"
+    return statuses
+
+
+def environment() -> Dict[str, Any]:
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "numpy": np.__version__, "shapely": shapely.__version__, "geos": shapely.geos_version_string,
+            "gdal": rasterio.__gdal_version__, "rasterio": rasterio.__version__, "geopandas": gpd.__version__}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Time each hot path on synthetic scenes, DEMs and lease layers.")
+    parser.add_argument("--suite", choices=sorted(SUITES), default="quick", help="Preset sizes (default: quick)")
+    parser.add_argument("--sizes", help=f"Comma-separated scene sizes out of {', '.join(SCENE_SIZES)}")
+    parser.add_argument("--leases", help="Comma-separated lease layer sizes, e.g. 10,1000,100000")
+    parser.add_argument("--stages", help=f"Comma-separated stages out of {', '.join(STAGES)} (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case; the median is reported")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for the stages that use a pool")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "terravigil-bench"),
+                        help="Where generated inputs are kept between runs")
+    parser.add_argument("--output", help="Write the results JSON here")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--save-baseline", help="Write this run's results as a baseline JSON")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Relative change in time or memory that counts as slower/faster")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit 1 when a case is slower, uses more memory, changed output or failed")
+    args = parser.parse_args(argv)
+
+    suite = SUITES[args.suite]
+    sizes = args.sizes.split(",") if args.sizes else suite["sizes"]
+    lease_counts = [int(v) for v in args.leases.split(",")] if args.leases else suite["leases"]
+    stages = args.stages.split(",") if args.stages else list(STAGES)
+    for value, known, label in ((sizes, SCENE_SIZES, "size"), (stages, STAGES, "stage")):
+        unknown = [v for v in value if v not in known]
+        if unknown:
+            parser.error(f"unknown {label}: {', '.join(unknown)}")
+
+    def log(message):
+        print(message, file=sys.stderr, flush=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    inputs = prepare_inputs(args.data_dir, sizes, lease_counts, args.seed, log=log)
+    results = run_suite(inputs, stages, lease_counts, repeat=args.repeat, workers=args.workers, log=log)
+    report = {"created_at": time.time(), "environment": environment(), "repeat": args.repeat,
+              "workers": args.workers, "seed": args.seed, "results": results}
+
+    statuses = {}
+    if baseline is not None:
+        statuses = compare(results, baseline, args.tolerance)
+        report["comparison"] = statuses
+        print("\ncase                                  time      peak RSS")
+        for case_id, result in results.items():
+            print(_format_row(case_id, result, baseline.get(case_id), statuses[case_id]))
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as out:
+                json.dump(report, out, indent=1)
+
+    regressions = [case for case, status in statuses.items()
+                   if any(flag in status for flag in ("slower", "more-memory", "changed", "error"))]
+    if args.fail_on_regression and (regressions or any("error" in r for r in results.values())):
+        log(f"regressions: {', '.join(regressions) or 'errors only'}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
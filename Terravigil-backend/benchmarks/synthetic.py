@@ -0,0 +1,182 @@
+import os
+import json
+import math
+from typing import Any, Callable, Dict
+
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+from rasterio.windows import Window
+
+
+# Synthetic scenes sit in UTM 43N (central India) on a 10 m grid; DEMs cover the same extent at 30 m
+SCENE_CRS = "EPSG:32643"
+ORIGIN = (500000.0, 2000000.0)
+PIXEL_SIZE = 10.0
+DEM_PIXEL_SIZE = 30.0
+BLOCK_SIZE = 512
+# Pits cover about PIT_FRACTION of the scene with radii between PIT_RADIUS pixels; SPECKLE_FRACTION of
+# the other pixels read as bare soil too, the noise the mask cleanup has to remove
+PIT_FRACTION = 0.05
+PIT_RADIUS = (6, 40)
+SPECKLE_FRACTION = 0.01
+# Part of the generated file names; bump it whenever the generator's output changes
+GENERATOR_VERSION = 2
+_MASK64 = (1 << 64) - 1
+
+
+def scene_transform(side: int) -> Affine:
+    return Affine(PIXEL_SIZE, 0.0, ORIGIN[0], 0.0, -PIXEL_SIZE, ORIGIN[1])
+
+
+def make_pits(side: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    """Pit centres and radii (scene pixels) covering about PIT_FRACTION of a side x side scene."""
+    rng = np.random.default_rng(seed)
+    mean_area = math.pi * np.mean(np.square(np.arange(PIT_RADIUS[0], PIT_RADIUS[1] + 1)))
+    count = max(1, int(side * side * PIT_FRACTION / mean_area))
+    return {"row": rng.uniform(0, side, count), "col": rng.uniform(0, side, count),
+            "radius": rng.uniform(PIT_RADIUS[0], PIT_RADIUS[1], count)}
+
+
+def pit_mask(pits: Dict[str, np.ndarray], window: Window, scale: float = 1.0) -> np.ndarray:
+    """Boolean pit mask of a window; scale converts scene pixels to the target grid's pixels."""
+    row_off, col_off = int(window.row_off), int(window.col_off)
+    height, width = int(window.height), int(window.width)
+    rows, cols, radii = pits["row"] * scale, pits["col"] * scale, pits["radius"] * scale
+    hit = ((rows + radii > row_off) & (rows - radii < row_off + height)
+           & (cols + radii > col_off) & (cols - radii < col_off + width))
+    mask = np.zeros((height, width), dtype=bool)
+    for row, col, radius in zip(rows[hit], cols[hit], radii[hit]):
+        r0, r1 = max(0, int(row - radius) - row_off), min(height, int(row + radius) + 2 - row_off)
+        c0, c1 = max(0, int(col - radius) - col_off), min(width, int(col + radius) + 2 - col_off)
+        yy, xx = np.ogrid[r0 + row_off:r1 + row_off, c0 + col_off:c1 + col_off]
+        mask[r0:r1, c0:c1] |= (yy + 0.5 - row) ** 2 + (xx + 0.5 - col) ** 2 <= radius * radius
+    return mask
+
+
+def pixel_uniform(window: Window, seed: int = 0) -> np.ndarray:
+    """Uniform [0, 1) value per pixel of a window, hashed (splitmix64) from its absolute row and column.
+
+    A pixel gets the same value through any window, so overlapping reads (tile halos) agree.
+    """
+    rows = np.arange(int(window.row_off), int(window.row_off) + int(window.height), dtype=np.uint64)
+    cols = np.arange(int(window.col_off), int(window.col_off) + int(window.width), dtype=np.uint64)
+    z = (rows[:, None] << np.uint64(32)) | cols[None, :]
+    z += np.uint64((seed * 0x9E3779B97F4A7C15) & _MASK64)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z ^= z >> np.uint64(31)
+    return (z >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+
+def speckle_mask(window: Window, seed: int = 0) -> np.ndarray:
+    return pixel_uniform(window, seed) < SPECKLE_FRACTION
+
+
+def pit_mask_reader(side: int, seed: int = 0) -> Callable[[Window], np.ndarray]:
+    """read_mask(window) over the pits of a synthetic scene plus speckle, with no file IO."""
+    pits = make_pits(side, seed)
+
+    def read_mask(window: Window) -> np.ndarray:
+        return pit_mask(pits, window) | speckle_mask(window, seed)
+    return read_mask
+
+
+def _iter_blocks(height: int, width: int):
+    for row_off in range(0, height, BLOCK_SIZE):
+        for col_off in range(0, width, BLOCK_SIZE):
+            yield Window(col_off, row_off, min(BLOCK_SIZE, width - col_off), min(BLOCK_SIZE, height - row_off))
+
+
+def _write_atomic(path: str, write: Callable[[str], None]) -> str:
+    tmp_path = f"{path}.part"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def write_scene(path: str, side: int, seed: int = 0) -> str:
+    """4-band uint16 scene (blue, green, red, NIR) with vegetation, bare-soil pits and speckle.
+
+    Written block by block, so even 1 gigapixel scenes never sit in memory.
+    """
+    pits = make_pits(side, seed)
+    profile = {"driver": "GTiff", "width": side, "height": side, "count": 4, "dtype": "uint16",
+               "crs": SCENE_CRS, "transform": scene_transform(side), "tiled": True,
+               "blockxsize": BLOCK_SIZE, "blockysize": BLOCK_SIZE, "compress": "deflate", "zlevel": 1}
+
+    def write(tmp_path):
+        with rasterio.open(tmp_path, "w", **profile) as dst:
+            for window in _iter_blocks(side, side):
+                # Band noise is written once per pixel, so seeding it by block is enough
+                rng = np.random.default_rng([seed, int(window.row_off), int(window.col_off)])
+                shape = (int(window.height), int(window.width))
+                bare = pit_mask(pits, window) | speckle_mask(window, seed)
+                noise = rng.normal(0, 60, (4,) + shape)
+                # Vegetation: NDVI around 0.6; bare soil: red close to NIR, NDVI around 0.05
+                bands = np.where(bare, np.array([1400, 1700, 2000, 2200])[:, None, None],
+                                 np.array([400, 700, 700, 2900])[:, None, None]) + noise
+                dst.write(np.clip(bands, 1, 10000).astype(np.uint16), window=window)
+    return _write_atomic(path, write)
+
+
+def write_dem(path: str, side: int, seed: int = 0) -> str:
+    """Float32 DEM over a scene's extent at DEM_PIXEL_SIZE: a gentle slope with a bowl under every pit."""
+    pits = make_pits(side, seed)
+    scale = PIXEL_SIZE / DEM_PIXEL_SIZE
+    dem_side = max(1, int(math.ceil(side * scale)))
+    depth = np.random.default_rng(seed + 1).uniform(5, 40, len(pits["radius"]))
+    transform = Affine(DEM_PIXEL_SIZE, 0.0, ORIGIN[0], 0.0, -DEM_PIXEL_SIZE, ORIGIN[1])
+    profile = {"driver": "GTiff", "width": dem_side, "height": dem_side, "count": 1, "dtype": "float32",
+               "crs": SCENE_CRS, "transform": transform, "tiled": True, "blockxsize": BLOCK_SIZE,
+               "blockysize": BLOCK_SIZE, "compress": "deflate", "nodata": -9999.0}
+    rows, cols, radii = pits["row"] * scale, pits["col"] * scale, pits["radius"] * scale
+
+    def write(tmp_path):
+        with rasterio.open(tmp_path, "w", **profile) as dst:
+            for window in _iter_blocks(dem_side, dem_side):
+                r0, c0 = int(window.row_off), int(window.col_off)
+                yy, xx = np.mgrid[r0:r0 + int(window.height), c0:c0 + int(window.width)].astype(np.float32)
+                dem = 400.0 + 0.02 * yy + 0.01 * xx
+                hit = ((rows + radii > r0) & (rows - radii < r0 + window.height)
+                       & (cols + radii > c0) & (cols - radii < c0 + window.width))
+                for row, col, radius, d in zip(rows[hit], cols[hit], radii[hit], depth[hit]):
+                    dist2 = ((yy + 0.5 - row) ** 2 + (xx + 0.5 - col) ** 2) / (radius * radius)
+                    dem -= np.where(dist2 < 1, d * (1 - dist2), 0).astype(np.float32)
+                dst.write(dem.astype(np.float32), 1, window=window)
+    return _write_atomic(path, write)
+
+
+def lease_collection(count: int, side: int, seed: int = 0) -> Dict[str, Any]:
+    """GeoJSON FeatureCollection (with a named CRS member) of `count` rectangular leases over a scene.
+
+    The scene is cut into a grid of at least `count` cells; a random subset of cells gets a lease
+    inset by a random margin, so leases cover part of the pits and leave the rest illegal.
+    """
+    rng = np.random.default_rng(seed + 2)
+    per_side = int(math.ceil(math.sqrt(count * 2)))
+    cell = side * PIXEL_SIZE / per_side
+    cells = rng.permutation(per_side * per_side)[:count]
+    features = []
+    for n, index in enumerate(cells):
+        row, col = divmod(int(index), per_side)
+        inset = rng.uniform(0.0, 0.2, 4) * cell
+        west, north = ORIGIN[0] + col * cell, ORIGIN[1] - row * cell
+        ring = [[west + inset[0], north - cell + inset[1]], [west + cell - inset[2], north - cell + inset[1]],
+                [west + cell - inset[2], north - inset[3]], [west + inset[0], north - inset[3]]]
+        ring.append(ring[0])
+        features.append({"type": "Feature", "properties": {"lease_id": f"L{n:06d}", "holder": f"holder-{n % 97}"},
+                         "geometry": {"type": "Polygon", "coordinates": [ring]}})
+    return {"type": "FeatureCollection", "features": features,
+            "crs": {"type": "name", "properties": {"name": "urn:ogc:def:crs:EPSG::32643"}}}
+
+
+def write_leases(path: str, count: int, side: int, seed: int = 0) -> str:
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            json.dump(lease_collection(count, side, seed), out)
+    return _write_atomic(path, write)
@@ -1,48 +1,333 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 import json
+import numpy as np
 import geopandas as gdf
 import geopandas as gpd
+import shapely
+from shapely.geometry import box
+from shapely.strtree import STRtree
+from pyproj import CRS
+from rasterio.features import rasterize
+from rasterio.transform import Affine, array_bounds
+from rasterio.windows import Window, from_bounds
 
-from utils.geo_utils import load_shapefile_from_zip, geojson_from_gdf, calculate_area_ha
+from utils.geo_utils import load_shapefile_from_zip, geojson_bytes_from_gdf, calculate_area_ha, pixel_row_areas
+from utils.boundary_registry import build_lease_index, boundary_registry_from_env
+from utils.geojson_io import geojson_frame
+from utils.metrics import stage
 
+AREA_METHODS = ("vector", "raster")
+# Longest side of the grid derived over the mining polygons when no detection grid is given
+RASTER_GRID_SIDE = 4096
+# Pixels rasterized at once by the raster area path
+RASTER_CHUNK_PIXELS = 4_194_304
 
-def check_boundary(mining_geojson: Dict[str, Any], boundary_path: Optional[str] = None, boundary_geojson: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    mining = gpd.GeoDataFrame.from_features(mining_geojson.get("features", []))
+# Registry opened lazily so job worker processes build their own from the same directory
+_boundary_registry = None
 
-    if boundary_geojson is not None:
-        boundary = gpd.GeoDataFrame.from_features(boundary_geojson.get("features", []))
-    elif boundary_path is not None:
-        boundary = load_shapefile_from_zip(boundary_path)
-    else:
-        raise ValueError("Either boundary_path (zip) or boundary_geojson must be provided")
 
-    # Ensure CRS alignment
-    if mining.crs is None:
-        mining = mining.set_crs(boundary.crs or 4326, allow_override=True)
-    if boundary.crs is None:
-        boundary = boundary.set_crs(mining.crs, allow_override=True)
-    if mining.crs != boundary.crs:
-        boundary = boundary.to_crs(mining.crs)
+def get_boundary_registry():
+    global _boundary_registry
+    if _boundary_registry is None:
+        _boundary_registry = boundary_registry_from_env()
+    return _boundary_registry
 
-    mining = mining.explode(index_parts=False, ignore_index=True)
-    boundary = boundary.explode(index_parts=False, ignore_index=True)
 
-    # Legal: intersection; Illegal: mining difference boundary union
-    boundary_union = boundary.unary_union
-    legal = gpd.overlay(mining, gpd.GeoDataFrame(geometry=[boundary_union], crs=mining.crs), how="intersection")
-    illegal = gpd.overlay(mining, gpd.GeoDataFrame(geometry=[boundary_union], crs=mining.crs), how="difference")
+def _polygonal(geom):
+    """Polygon parts of an overlay result (drops slivers collapsed to lines/points); None if empty."""
+    if geom is None or geom.is_empty:
+        return None
+    if geom.geom_type in ("Polygon", "MultiPolygon"):
+        return geom
+    parts = [g for g in getattr(geom, "geoms", []) if g.geom_type in ("Polygon", "MultiPolygon") and not g.is_empty]
+    if not parts:
+        return None
+    return shapely.union_all(parts)
+
+
+def _lease_attributes(index: Dict[str, Any], mining_columns) -> List[Dict[str, Any]]:
+    # Boundary attributes travel with legal pieces; names clashing with mining attributes get a suffix
+    clashes = index["columns"] & set(mining_columns)
+    if not clashes:
+        return index["records"]
+    return [{(f"{k}_lease" if k in clashes else k): v for k, v in record.items()} for record in index["records"]]
+
+
+def split_by_leases(mining: gpd.GeoDataFrame, boundary: Optional[gpd.GeoDataFrame] = None,
+                    index: Optional[Dict[str, Any]] = None):
+    """Split mining polygons into legal pieces (tagged with their lease) and illegal remainders.
+
+    An STRtree pairs each mining polygon with nearby lease parcels only. Polygons within a single
+    lease or touching none are classified by prepared predicates alone; exact clipping runs only
+    for polygons that cross a lease boundary. Overlapping leases never double count a piece.
+    Pass a prebuilt lease `index` (see build_lease_index) instead of `boundary` to reuse it across
+    calls; when it carries the lease union, crossing polygons covered by it skip the difference.
+    Mining polygons must be in the leases' CRS.
+    """
+    if index is None:
+        index = _lease_index(boundary)
+    with stage("overlay") as counts:
+        counts["polygons"] = len(mining)
+        return _split_by_leases(mining, index)
+
+
+def _split_by_leases(mining: gpd.GeoDataFrame, index: Dict[str, Any]):
+    mining_geoms = np.asarray(mining.geometry.values, dtype=object)
+    lease_geoms = index["geoms"]
+    tree = index["tree"]
+    shapely.prepare(mining_geoms)
+
+    hit_mining, hit_lease = tree.query(mining_geoms, predicate="intersects")
+    inside_mining, inside_lease = tree.query(mining_geoms, predicate="within")
+    containing_lease: Dict[int, int] = {}
+    for m, b in zip(inside_mining, inside_lease):
+        containing_lease.setdefault(int(m), int(b))
+    candidates: Dict[int, List[int]] = {}
+    for m, b in zip(hit_mining, hit_lease):
+        candidates.setdefault(int(m), []).append(int(b))
+
+    mining_attrs = mining.drop(columns=mining.geometry.name).to_dict("records") if len(mining.columns) > 1 \
+        else [{} for _ in range(len(mining))]
+    lease_attrs = _lease_attributes(index, mining.columns)
+    union = index.get("union")
+
+    legal_rows, legal_geoms, illegal_rows, illegal_geoms = [], [], [], []
+
+    def add_legal(i, lease, geom):
+        legal_rows.append({**mining_attrs[i], "lease_index": lease, **lease_attrs[lease]})
+        legal_geoms.append(geom)
+
+    for i, geom in enumerate(mining_geoms):
+        if geom is None or geom.is_empty:
+            continue
+        if i in containing_lease:
+            add_legal(i, containing_lease[i], geom)
+            continue
+        leases = candidates.get(i)
+        if not leases:
+            illegal_rows.append(mining_attrs[i])
+            illegal_geoms.append(geom)
+            continue
+
+        # Crosses at least one lease boundary: clip against each candidate lease
+        covered = None
+        for lease in sorted(leases):
+            piece = shapely.intersection(geom, lease_geoms[lease])
+            if covered is not None:
+                piece = shapely.difference(piece, covered)
+            piece = _polygonal(piece)
+            if piece is None:
+                continue
+            add_legal(i, lease, piece)
+            covered = piece if covered is None else shapely.union(covered, piece)
+        if covered is not None and union is not None and union.contains(geom):
+            continue
+        rest = geom if covered is None else _polygonal(shapely.difference(geom, covered))
+        if rest is not None:
+            illegal_rows.append(mining_attrs[i])
+            illegal_geoms.append(rest)
+
+    legal = gpd.GeoDataFrame(legal_rows, geometry=legal_geoms, crs=mining.crs)
+    illegal = gpd.GeoDataFrame(illegal_rows, geometry=illegal_geoms, crs=mining.crs)
+    return legal, illegal
+
+
+def _lease_index(boundary: gpd.GeoDataFrame) -> Dict[str, Any]:
+    with stage("lease_index") as counts:
+        counts["polygons"] = len(boundary)
+        return build_lease_index(boundary)
+
 
-    legal_area_ha = calculate_area_ha(legal)
-    illegal_area_ha = calculate_area_ha(illegal)
+def _reprojected_index(index: Dict[str, Any], crs) -> Dict[str, Any]:
+    """The same lease index (parcels, records and order) in another CRS."""
+    with stage("reproject") as counts:
+        counts["polygons"] = len(index["geoms"])
+        leases = gpd.GeoSeries(index["geoms"], crs=index["crs"]).to_crs(crs)
+    geoms = np.asarray(leases.values, dtype=object)
+    union = None
+    if index["union"] is not None:
+        union = shapely.union_all(geoms)
+        shapely.prepare(union)
+    return {**index, "crs": leases.crs, "geoms": geoms, "tree": STRtree(geoms), "union": union}
 
-    legal_geojson = geojson_from_gdf(legal) if not legal.empty else {"type": "FeatureCollection", "features": []}
-    illegal_geojson = geojson_from_gdf(illegal) if not illegal.empty else {"type": "FeatureCollection", "features": []}
+
+def _raster_grid(mining: gpd.GeoDataFrame, grid: Optional[Dict[str, Any]], pixel_size: Optional[float]):
+    """Transform and window covering the mining polygons: on the detection grid when it shares their CRS,
+    otherwise a fresh north-up grid of pixel_size (default: RASTER_GRID_SIDE pixels on the longest side)."""
+    west, south, east, north = mining.total_bounds
+    if grid is not None and pixel_size is None and grid.get("crs") is not None and mining.crs == grid["crs"]:
+        transform = Affine(*grid["transform"])
+        window = from_bounds(west, south, east, north, transform)
+        col_off, row_off = int(np.floor(window.col_off)), int(np.floor(window.row_off))
+        width = int(np.ceil(window.col_off + window.width)) - col_off
+        height = int(np.ceil(window.row_off + window.height)) - row_off
+        return transform, Window(col_off, row_off, max(1, width), max(1, height))
+    if pixel_size is None:
+        pixel_size = max(east - west, north - south) / RASTER_GRID_SIDE or 1.0
+    transform = Affine(pixel_size, 0.0, west, 0.0, -pixel_size, north)
+    width = max(1, int(np.ceil((east - west) / pixel_size)))
+    height = max(1, int(np.ceil((north - south) / pixel_size)))
+    return transform, Window(0, 0, width, height)
+
+
+def raster_lease_areas(mining: gpd.GeoDataFrame, index: Dict[str, Any], grid: Optional[Dict[str, Any]] = None,
+                       pixel_size: Optional[float] = None) -> Dict[str, Any]:
+    """Legal/illegal hectares by counting mining pixels inside/outside the leases, without clipping.
+
+    Mining polygons and leases are rasterized (pixel-centre rule) in row chunks over the mining
+    extent; pixels of geographic grids are weighted by their latitude-dependent ground area.
+    """
+    if mining.empty:
+        return {"legal_area_ha": 0.0, "illegal_area_ha": 0.0, "pixel_size": pixel_size}
+    transform, window = _raster_grid(mining, grid, pixel_size)
+    mining_geoms = np.asarray(mining.geometry.values, dtype=object)
+    mining_tree = STRtree(mining_geoms)
+    row_areas = pixel_row_areas(transform, mining.crs, window.row_off, window.height)
+    if not np.isfinite(row_areas).all():
+        # Typically projected coordinates labelled with a geographic CRS
+        raise ValueError(f"Pixel areas are not finite; the mining coordinates do not fit {mining.crs.to_string()}")
+
+    legal_m2 = illegal_m2 = 0.0
+    chunk_rows = max(1, RASTER_CHUNK_PIXELS // window.width)
+    for start in range(0, window.height, chunk_rows):
+        rows = min(chunk_rows, window.height - start)
+        chunk_transform = transform * Affine.translation(window.col_off, window.row_off + start)
+        chunk_box = box(*array_bounds(rows, window.width, chunk_transform))
+        geoms = mining_geoms[mining_tree.query(chunk_box)]
+        if len(geoms) == 0:
+            continue
+        with stage("rasterize") as counts:
+            mined = rasterize(geoms, out_shape=(rows, window.width), transform=chunk_transform, fill=0,
+                              default_value=1, dtype="uint8").astype(bool)
+            counts["pixels"], counts["polygons"] = mined.size, len(geoms)
+        if not mined.any():
+            continue
+        leases = index["geoms"][index["tree"].query(chunk_box)]
+        if len(leases):
+            with stage("rasterize") as counts:
+                leased = rasterize(leases, out_shape=(rows, window.width), transform=chunk_transform, fill=0,
+                                   default_value=1, dtype="uint8").astype(bool)
+                counts["pixels"], counts["polygons"] = leased.size, len(leases)
+        else:
+            leased = np.zeros_like(mined)
+        areas = row_areas[start:start + rows]
+        legal_m2 += float(areas @ (mined & leased).sum(axis=1))
+        illegal_m2 += float(areas @ (mined & ~leased).sum(axis=1))
 
     return {
-        "legal_area_ha": float(legal_area_ha),
-        "illegal_area_ha": float(illegal_area_ha),
-        "legal_geojson": legal_geojson,
-        "illegal_geojson": illegal_geojson
+        "legal_area_ha": legal_m2 / 10000.0,
+        "illegal_area_ha": illegal_m2 / 10000.0,
+        "pixel_size": [abs(transform.a), abs(transform.e)],
     }
 
 
+def check_boundary(mining_geojson: Dict[str, Any], boundary_path: Optional[str] = None, boundary_geojson: Optional[Dict[str, Any]] = None,
+                   boundary_id: Optional[str] = None, area_method: str = "vector", include_geometry: Optional[bool] = None,
+                   grid: Optional[Dict[str, Any]] = None, pixel_size: Optional[float] = None) -> Dict[str, Any]:
+    """Legal/illegal mining areas against lease boundaries.
+
+    area_method="vector" measures the clipped polygons; "raster" counts pixels on the detection
+    `grid` (as returned by detect_mining) or on a grid of pixel_size over the mining polygons.
+    Geometries are returned by default for vector and only on request (include_geometry) for raster.
+    GeoJSON is read in the CRS named by its crs member (as detect_mining writes it), else in the CRS
+    of `grid`, else WGS84.
+    """
+    with stage("geojson_parse") as counts:
+        mining = geojson_frame(mining_geojson, (grid or {}).get("crs"))
+        counts["polygons"] = len(mining)
+    return check_boundary_frame(mining, boundary_path=boundary_path, boundary_geojson=boundary_geojson,
+                                boundary_id=boundary_id, area_method=area_method, include_geometry=include_geometry,
+                                grid=grid, pixel_size=pixel_size)
+
+
+def check_boundary_frame(mining: gpd.GeoDataFrame, boundary_path: Optional[str] = None,
+                         boundary_geojson: Optional[Dict[str, Any]] = None, boundary_id: Optional[str] = None,
+                         area_method: str = "vector", include_geometry: Optional[bool] = None,
+                         grid: Optional[Dict[str, Any]] = None, pixel_size: Optional[float] = None,
+                         frames: bool = False) -> Dict[str, Any]:
+    """check_boundary for mining polygons already in a GeoDataFrame (a missing CRS means the boundary's).
+
+    frames=True keeps the legal/illegal pieces as GeoDataFrames under 'legal'/'illegal' instead of
+    encoding them to GeoJSON, for callers that write them in another format.
+    """
+    if area_method not in AREA_METHODS:
+        raise ValueError(f"area_method must be one of {', '.join(AREA_METHODS)}")
+    if include_geometry is None:
+        include_geometry = area_method == "vector"
+
+    if mining.crs is None and grid is not None and grid.get("crs"):
+        # Detection output is in the coordinates of its mask grid
+        mining = mining.set_crs(grid["crs"], allow_override=True)
+
+    index = None
+    if boundary_id is not None:
+        # Registered dataset: already parsed, exploded, unioned and indexed
+        with stage("boundary_load") as counts:
+            try:
+                index = get_boundary_registry().get(boundary_id)
+            except KeyError as e:
+                raise ValueError(str(e.args[0]))
+            counts["polygons"] = len(index["geoms"])
+        boundary_crs = index["crs"]
+    elif boundary_geojson is not None:
+        with stage("geojson_parse") as counts:
+            boundary = geojson_frame(boundary_geojson)
+            counts["polygons"] = len(boundary)
+    elif boundary_path is not None:
+        boundary = load_shapefile_from_zip(boundary_path)
+    else:
+        raise ValueError("Either boundary_path (zip), boundary_geojson or boundary_id must be provided")
+
+    # Ensure CRS alignment. Raster areas are counted on the detection grid, so there the leases
+    # (and mining polygons in another CRS) go to the grid's CRS instead of the other way round.
+    grid_crs = None
+    if area_method == "raster" and pixel_size is None and grid is not None and grid.get("crs"):
+        grid_crs = CRS.from_user_input(grid["crs"])
+    if index is not None:
+        if mining.crs is None:
+            mining = mining.set_crs(boundary_crs or 4326, allow_override=True)
+        if grid_crs is not None and boundary_crs is not None and boundary_crs != grid_crs:
+            index = _reprojected_index(index, grid_crs)
+            boundary_crs = grid_crs
+        if boundary_crs is not None and mining.crs != boundary_crs:
+            with stage("reproject") as counts:
+                counts["polygons"] = len(mining)
+                mining = mining.to_crs(boundary_crs)
+    else:
+        if mining.crs is None:
+            mining = mining.set_crs(boundary.crs or 4326, allow_override=True)
+        if boundary.crs is None:
+            boundary = boundary.set_crs(mining.crs, allow_override=True)
+        if grid_crs is not None and mining.crs != grid_crs:
+            with stage("reproject") as counts:
+                counts["polygons"] = len(mining)
+                mining = mining.to_crs(grid_crs)
+        if mining.crs != boundary.crs:
+            with stage("reproject") as counts:
+                counts["polygons"] = len(boundary)
+                boundary = boundary.to_crs(mining.crs)
+        index = _lease_index(boundary)
+
+    mining = mining.explode(index_parts=False, ignore_index=True)
+
+    result = {}
+    if area_method == "raster":
+        result.update(raster_lease_areas(mining, index, grid=grid, pixel_size=pixel_size))
+
+    if area_method == "vector" or include_geometry:
+        # Legal: pieces inside a lease (tagged with lease_index); Illegal: the remainder outside every lease
+        legal, illegal = split_by_leases(mining, index=index)
+        if area_method == "vector":
+            result["legal_area_ha"] = float(calculate_area_ha(legal))
+            result["illegal_area_ha"] = float(calculate_area_ha(illegal))
+        if include_geometry and frames:
+            result["legal"], result["illegal"] = legal, illegal
+        elif include_geometry:
+            result["legal_geojson"] = geojson_bytes_from_gdf(legal)
+            result["illegal_geojson"] = geojson_bytes_from_gdf(illegal)
+
+    result["area_method"] = area_method
+    if boundary_id is not None:
+        result["boundary_id"] = boundary_id
+        result["boundary_version"] = index["version"]
+    return result
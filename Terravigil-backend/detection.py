@@ -1,11 +1,40 @@
-from typing import Dict, Any
+import math
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, Iterable, List, Optional, Tuple
 import numpy as np
 import rasterio
 import rasterio.enums
+from rasterio.features import shapes
 from rasterio.transform import Affine
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+from scipy import ndimage
+import shapely
+from shapely.geometry import shape
+from shapely.ops import unary_union
 import geopandas as gpd
 
-from utils.geo_utils import load_raster, raster_mask_to_polygons, geojson_from_gdf, calculate_area_ha
+from utils.geo_utils import load_raster, iter_block_windows, pixel_geometries_to_gdf, geojson_bytes_from_gdf, calculate_area_ha
+from utils.parallel import resolve_workers, get_process_pool, split_evenly
+from utils.job_queue import JobContext, JobCancelledError
+from utils.metrics import collect, stage, merge_stages
+
+
+# Upper bound on pixels held in memory per tile (2048 x 2048); bounds RAM regardless of scene size
+DEFAULT_TILE_PIXELS = 4_194_304
+NDVI_THRESHOLD = 0.2
+BRIGHTNESS_THRESHOLD = 0.6
+# Share of job progress covered by the tile pass; stitching and serialization fill the rest
+TILE_PROGRESS_START = 5
+TILE_PROGRESS_END = 85
+# Mask cleanup before vectorization, all in pixels (0 turns a step off): opening then closing with a
+# disk of MORPHOLOGY_RADIUS, dropping components below MIN_COMPONENT_PIXELS, and coverage simplification
+# of the polygons with SIMPLIFY_TOLERANCE (roughly the square root of the largest triangle area removed)
+MORPHOLOGY_RADIUS = 1
+MIN_COMPONENT_PIXELS = 16
+SIMPLIFY_TOLERANCE = 1.0
+# Window chunks handed out per worker; more chunks than workers evens out tiles with little mining
+CHUNKS_PER_WORKER = 4
 
 
 def _pick_bands_for_ndvi(dataset: rasterio.io.DatasetReader):
@@ -26,91 +55,361 @@ def _pick_bands_for_ndvi(dataset: rasterio.io.DatasetReader):
     return red_index, nir_index
 
 
-def detect_mining(image_path: str) -> Dict[str, Any]:
-    try:
-        with load_raster(image_path) as src:
+def _estimate_p99(src: rasterio.io.DatasetReader, max_pixels: int) -> float:
+    # The brightness fallback needs a scene-wide 99th percentile; take it from a decimated read
+    # so it stays within the tile memory budget (exact when the band already fits the budget)
+    total_pixels = src.width * src.height
+    factor = max(1, int(np.ceil(np.sqrt(total_pixels / max_pixels))))
+    with stage("raster_read") as counts:
+        band1 = src.read(1, out_shape=(max(1, src.height // factor), max(1, src.width // factor)),
+                         resampling=rasterio.enums.Resampling.nearest)
+        counts["bytes_read"], counts["pixels"] = band1.nbytes, band1.size
+    band1 = band1.astype(np.float32)
+    valid = band1[~np.isnan(band1)]
+    p99 = float(np.percentile(valid, 99)) if valid.size else 1.0
+    return p99 if p99 != 0 else 1.0
+
+
+def _quicklook_plan(src: rasterio.io.DatasetReader, target_resolution: Optional[float] = None,
+                    max_pixels: Optional[int] = None) -> Tuple[Optional[int], float]:
+    """(overview level, further decimation) for a quick-look read; (None, 1.0) is full resolution.
+
+    The wanted reduction comes from target_resolution (CRS units per pixel) and/or the max_pixels
+    budget. Among full resolution and the internal overviews that fit the budget, the level nearest
+    the wanted reduction (on a log scale) is read. What remains beyond a factor of sqrt(2), or beyond
+    the coarsest overview for the budget, is decimated on the fly by a whole factor (rounded up):
+    GDAL averages whole pixel blocks far faster than fractional ones.
+    """
+    budget = math.sqrt(src.width * src.height / max_pixels) if max_pixels else 1.0
+    wanted = max(budget, target_resolution / max(src.res) if target_resolution else 1.0)
+    if wanted <= 1.0:
+        return None, 1.0
+    levels = [(None, 1)] + list(enumerate(src.overviews(1)))
+    eligible = [(level, factor) for level, factor in levels if factor >= budget] or levels[-1:]
+    level, factor = min(eligible, key=lambda item: abs(math.log(item[1] / wanted)))
+    remaining = wanted / factor
+    if remaining > math.sqrt(2) or factor < budget:
+        return level, float(math.ceil(remaining - 1e-9))
+    return level, 1.0
+
+
+@contextmanager
+def _open_scene(image_path: str, overview_level: Optional[int] = None, decimation: float = 1.0):
+    """The scene at its quick-look level: one internal overview, optionally decimated further by a
+    WarpedVRT with average resampling (reads stay block by block), or the file itself."""
+    with load_raster(image_path, overview_level) as src:
+        if decimation <= 1.0:
+            yield src
+            return
+        width = max(1, int(round(src.width / decimation)))
+        height = max(1, int(round(src.height / decimation)))
+        transform = src.transform * Affine.scale(src.width / width, src.height / height)
+        with WarpedVRT(src, crs=src.crs, transform=transform, width=width, height=height,
+                       resampling=rasterio.enums.Resampling.average) as vrt:
+            yield vrt
+
+
+def _tile_mask(src: rasterio.io.DatasetReader, window: Window, red_index: Optional[int],
+               nir_index: Optional[int], p99: float) -> np.ndarray:
+    if red_index is not None and nir_index is not None:
+        with stage("raster_read") as counts:
+            red = src.read(red_index, window=window)
+            nir = src.read(nir_index, window=window)
+            counts["bytes_read"], counts["pixels"] = red.nbytes + nir.nbytes, red.size
+        with stage("ndvi") as counts:
+            red, nir = red.astype(np.float32), nir.astype(np.float32)
+            denom = (nir + red)
+            denom[denom == 0] = 1e-6
+            ndvi = (nir - red) / denom
+            mining_mask = (ndvi < NDVI_THRESHOLD) & ~np.isnan(ndvi)
+            counts["pixels"] = ndvi.size
+    else:
+        # Fallback to brightness: if high reflectance area considered as exposed soil/mining
+        # Use first band as proxy, normalized by the scene 99th percentile
+        with stage("raster_read") as counts:
+            band1 = src.read(1, window=window)
+            counts["bytes_read"], counts["pixels"] = band1.nbytes, band1.size
+        with stage("brightness") as counts:
+            mining_mask = (band1.astype(np.float32) / p99) > BRIGHTNESS_THRESHOLD
+            counts["pixels"] = mining_mask.size
+    return mining_mask.astype(np.uint8)
+
+
+def _disk(radius: int) -> np.ndarray:
+    yy, xx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    return xx * xx + yy * yy <= radius * radius
+
+
+def _clean_window_mask(read_mask: Callable[[Window], np.ndarray], window: Window, width: int, height: int,
+                       cleanup: Dict[str, Any]) -> np.ndarray:
+    """Window of a mask after opening/closing and small-component removal, as if the whole mask were cleaned.
+
+    read_mask(window) returns the raw mask of any window inside the width x height grid. Morphology reads
+    a halo of 4 * radius pixels around the window (edge pixels repeat outside the grid), so pixels along a
+    seam see the same neighbourhood in both tiles. Components touching a seam may go on in the next tile;
+    they are kept here and size-filtered once stitched.
+    """
+    radius, min_pixels = cleanup["radius"], cleanup["min_pixels"]
+    if radius <= 0:
+        mask = read_mask(window).astype(bool)
+    else:
+        halo = 4 * radius
+        col_off, row_off = int(window.col_off), int(window.row_off)
+        col_end, row_end = col_off + int(window.width), row_off + int(window.height)
+        c0, r0 = max(0, col_off - halo), max(0, row_off - halo)
+        c1, r1 = min(width, col_end + halo), min(height, row_end + halo)
+        mask = read_mask(Window(c0, r0, c1 - c0, r1 - r0)).astype(bool)
+
+    with stage("mask_cleanup") as counts:
+        counts["pixels"] = mask.size
+        if radius > 0:
+            mask = np.pad(mask, ((halo - (row_off - r0), halo - (r1 - row_end)),
+                                 (halo - (col_off - c0), halo - (c1 - col_end))), mode="edge")
+            structure = _disk(radius)
+            mask = ndimage.binary_closing(ndimage.binary_opening(mask, structure), structure)
+            mask = mask[halo:halo + int(window.height), halo:halo + int(window.width)]
+
+        if min_pixels > 1 and mask.any():
+            # Default structure is 4-connected, the connectivity shapes() traces polygons with
+            labels, count = ndimage.label(mask)
+            keep = np.bincount(labels.ravel(), minlength=count + 1) >= min_pixels
+            if window.col_off > 0:
+                keep[labels[:, 0]] = True
+            if window.col_off + window.width < width:
+                keep[labels[:, -1]] = True
+            if window.row_off > 0:
+                keep[labels[0, :]] = True
+            if window.row_off + window.height < height:
+                keep[labels[-1, :]] = True
+            keep[0] = False
+            mask = keep[labels]
+    return mask.astype(np.uint8)
+
+
+def _clean_tile_mask(src: rasterio.io.DatasetReader, window: Window, red_index: Optional[int],
+                     nir_index: Optional[int], p99: float, cleanup: Dict[str, Any]) -> np.ndarray:
+    return _clean_window_mask(lambda w: _tile_mask(src, w, red_index, nir_index, p99), window,
+                              src.width, src.height, cleanup)
+
+
+def _polygonize_tile(mask: np.ndarray, window: Window, height: int, width: int) -> Tuple[List[Any], List[Any]]:
+    """Polygonize one tile in global pixel coordinates.
+
+    Returns (interior, edge): edge polygons touch a seam shared with a neighbouring tile
+    and must be stitched before they match the full-resolution result.
+    """
+    col_off, row_off = int(window.col_off), int(window.row_off)
+    col_end, row_end = col_off + int(window.width), row_off + int(window.height)
+    interior, edge = [], []
+    with stage("polygonize") as counts:
+        # Pixel-space coordinates are exact integers, so seams line up without tolerance
+        for geom, val in shapes(mask, mask=mask.astype(bool), transform=Affine.translation(col_off, row_off)):
+            if val != 1:
+                continue
+            poly = shape(geom)
+            minx, miny, maxx, maxy = poly.bounds
+            on_seam = (
+                (minx == col_off and col_off > 0) or (maxx == col_end and col_end < width)
+                or (miny == row_off and row_off > 0) or (maxy == row_end and row_end < height)
+            )
+            (edge if on_seam else interior).append(poly)
+        counts["pixels"], counts["polygons"] = mask.size, len(interior) + len(edge)
+    return interior, edge
+
+
+def _process_windows(src: rasterio.io.DatasetReader, windows: List[Window], red_index: Optional[int],
+                     nir_index: Optional[int], p99: float, cleanup: Dict[str, Any],
+                     context: Optional[JobContext] = None, report_progress: bool = False) -> Tuple[List[Any], List[Any]]:
+    interior, edge = [], []
+    for done, window in enumerate(windows, start=1):
+        # Cancellation checkpoint per tile, so a cancelled job frees its worker within one tile
+        if context is not None:
+            context.check_cancelled()
+        mask_uint8 = _clean_tile_mask(src, window, red_index, nir_index, p99, cleanup)
+        if mask_uint8.any():
+            tile_interior, tile_edge = _polygonize_tile(mask_uint8, window, src.height, src.width)
+            interior.extend(tile_interior)
+            edge.extend(tile_edge)
+        if context is not None and report_progress:
+            _report_tiles(context, done, len(windows), len(interior) + len(edge))
+    return interior, edge
+
+
+def _report_tiles(context: JobContext, tiles_done: int, tiles_total: int, polygons: int):
+    progress = TILE_PROGRESS_START + (TILE_PROGRESS_END - TILE_PROGRESS_START) * tiles_done / max(1, tiles_total)
+    context.report(progress, "detecting", force=tiles_done == tiles_total,
+                   tiles_done=tiles_done, tiles_total=tiles_total, polygons=polygons)
+
+
+def _detect_windows(image_path: str, source: Tuple[Optional[int], float], windows: List[Window],
+                    red_index: Optional[int], nir_index: Optional[int], p99: float, cleanup: Dict[str, Any],
+                    context: Optional[JobContext] = None) -> Tuple[List[Any], List[Any], Dict[str, Any]]:
+    # Process-pool entry point: each worker opens its own dataset handle at the same quick-look level,
+    # and hands its stage metrics back with the polygons
+    with collect() as metrics:
+        with _open_scene(image_path, *source) as src:
+            interior, edge = _process_windows(src, windows, red_index, nir_index, p99, cleanup, context)
+    return interior, edge, metrics.snapshot()
+
+
+def _stitch_edge_polygons(edge: List[Any], min_pixels: int = 0) -> List[Any]:
+    if not edge:
+        return []
+    with stage("stitch") as counts:
+        merged = unary_union(edge)
+        # Pixel-space area is the pixel count, so this finishes the component filter for seam components
+        stitched = [poly for poly in getattr(merged, "geoms", [merged]) if poly.area >= min_pixels]
+        counts["polygons"] = len(edge)
+    return stitched
+
+
+def _simplify_polygons(polygons: List[Any], tolerance: float) -> List[Any]:
+    # The polygons tile the mask without overlaps, so simplifying them as one coverage keeps shared
+    # edges and corner contacts consistent; per-polygon simplification could open gaps or overlaps
+    if tolerance <= 0 or not polygons:
+        return polygons
+    with stage("simplify") as counts:
+        counts["polygons"] = len(polygons)
+        # Stitching leaves collinear vertices where seams crossed and starts rings elsewhere; the
+        # simplifier depends on both, so drop them and normalize rings to match an untiled run
+        polygons = shapely.normalize(shapely.simplify(np.asarray(polygons, dtype=object), 0))
+        return list(shapely.coverage_simplify(polygons, tolerance))
+
+
+def vectorize_mask(read_mask: Callable[[Window], np.ndarray], windows: Iterable[Window], width: int, height: int,
+                   transform: Affine, crs: Any, morphology_radius: int = MORPHOLOGY_RADIUS,
+                   min_component_pixels: int = MIN_COMPONENT_PIXELS, simplify_tolerance: float = SIMPLIFY_TOLERANCE,
+                   context: Optional[JobContext] = None) -> gpd.GeoDataFrame:
+    """Polygons of any binary mask on a width x height grid, read tile by tile through read_mask(window).
+
+    Tiles are cleaned, polygonized, stitched and simplified exactly like the detection mask, so a
+    derived mask (e.g. the change between two dates) vectorizes the same way detections do.
+    """
+    cleanup = {"radius": int(morphology_radius), "min_pixels": int(min_component_pixels)}
+    interior, edge = [], []
+    for window in windows:
+        if context is not None:
+            context.check_cancelled()
+        mask_uint8 = _clean_window_mask(read_mask, window, width, height, cleanup)
+        if mask_uint8.any():
+            tile_interior, tile_edge = _polygonize_tile(mask_uint8, window, height, width)
+            interior.extend(tile_interior)
+            edge.extend(tile_edge)
+    polygons = _simplify_polygons(interior + _stitch_edge_polygons(edge, cleanup["min_pixels"]), simplify_tolerance)
+    return pixel_geometries_to_gdf(polygons, transform, crs)
+
+
+def detect_mining_frame(image_path: str, max_tile_pixels: int = DEFAULT_TILE_PIXELS,
+                        workers: Optional[int] = None, context: Optional[JobContext] = None,
+                        morphology_radius: int = MORPHOLOGY_RADIUS, min_component_pixels: int = MIN_COMPONENT_PIXELS,
+                        simplify_tolerance: float = SIMPLIFY_TOLERANCE, target_resolution: Optional[float] = None,
+                        max_pixels: Optional[int] = None):
+    """Detected mining polygons as a GeoDataFrame in the scene CRS, plus the mask grid description.
+
+    The mask is cleaned before vectorization (see MORPHOLOGY_RADIUS and friends), so speckle never
+    becomes polygons; the cleanup parameters are in pixels of the grid detection runs on.
+    target_resolution or max_pixels turn on quick-look: detection runs on the nearest internal
+    overview (see _quicklook_plan) and the grid describes that coarser raster.
+    """
+    workers = resolve_workers(workers)
+    cleanup = {"radius": int(morphology_radius), "min_pixels": int(min_component_pixels)}
+    with load_raster(image_path) as full:
+        original_size = [int(full.height), int(full.width)]
+        source = _quicklook_plan(full, target_resolution, max_pixels)
+    with _open_scene(image_path, *source) as src:
         transform: Affine = src.transform
         crs = src.crs
-        band_count = src.count
-        
-        # Check file size and dimensions for optimization
         width, height = src.width, src.height
-        total_pixels = width * height
-        
-        # For very large files, use windowed reading and downsampling
-        if total_pixels > 10_000_000:  # 10M pixels threshold
-            # Calculate downsample factor
-            downsample_factor = max(1, int(np.sqrt(total_pixels / 10_000_000)))
-            
-            # Read with downsampling
-            red_index, nir_index = _pick_bands_for_ndvi(src)
-            
-            if red_index is not None and nir_index is not None:
-                red = src.read(red_index, 
-                              out_shape=(height // downsample_factor, width // downsample_factor),
-                              resampling=rasterio.enums.Resampling.average).astype(np.float32)
-                nir = src.read(nir_index,
-                              out_shape=(height // downsample_factor, width // downsample_factor), 
-                              resampling=rasterio.enums.Resampling.average).astype(np.float32)
-                
-                denom = (nir + red)
-                denom[denom == 0] = 1e-6
-                ndvi = (nir - red) / denom
-                mining_mask = (ndvi < 0.2) & ~np.isnan(ndvi)
-                
-                # Update transform for downsampled data
-                new_transform = src.transform * src.transform.scale(downsample_factor, downsample_factor)
-            else:
-                # Fallback with downsampling
-                band1 = src.read(1, 
-                               out_shape=(height // downsample_factor, width // downsample_factor),
-                               resampling=rasterio.enums.Resampling.average).astype(np.float32)
-                p99 = np.percentile(band1[~np.isnan(band1)], 99) if np.any(~np.isnan(band1)) else 1.0
-                if p99 == 0:
-                    p99 = 1.0
-                norm = band1 / p99
-                mining_mask = norm > 0.6
-                
-                new_transform = src.transform * src.transform.scale(downsample_factor, downsample_factor)
+
+        red_index, nir_index = _pick_bands_for_ndvi(src)
+        p99 = 1.0
+        if red_index is None or nir_index is None:
+            p99 = _estimate_p99(src, max_tile_pixels)
+
+        # Walk native block windows so only one tile of each band is in memory at a time
+        windows = list(iter_block_windows(src, max_tile_pixels))
+        if workers <= 1 or len(windows) <= 1:
+            interior, edge = _process_windows(src, windows, red_index, nir_index, p99, cleanup, context,
+                                              report_progress=True)
         else:
-            # Original processing for smaller files
-            red_index, nir_index = _pick_bands_for_ndvi(src)
-
-            if red_index is not None and nir_index is not None:
-                red = src.read(red_index).astype(np.float32)
-                nir = src.read(nir_index).astype(np.float32)
-                denom = (nir + red)
-                denom[denom == 0] = 1e-6
-                ndvi = (nir - red) / denom
-                mining_mask = (ndvi < 0.2) & ~np.isnan(ndvi)
-            else:
-                # Fallback to brightness: if high reflectance area considered as exposed soil/mining
-                # Use first band as proxy
-                band1 = src.read(1).astype(np.float32)
-                # Normalize by 99th percentile
-                p99 = np.percentile(band1[~np.isnan(band1)], 99) if np.any(~np.isnan(band1)) else 1.0
-                if p99 == 0:
-                    p99 = 1.0
-                norm = band1 / p99
-                mining_mask = norm > 0.6
-            
-            new_transform = transform
-
-        mask_uint8 = mining_mask.astype(np.uint8)
-        geojson = raster_mask_to_polygons(mask_uint8, new_transform, crs)
-
-        # area in hectares
-        gdf = gpd.GeoDataFrame.from_features(geojson.get("features", []), crs=crs)
-        area_ha = calculate_area_ha(gdf)
-
-        return {
-            "area_ha": float(area_ha),
-            "geojson": geojson,
-            "mask_shape": [int(mask_uint8.shape[0]), int(mask_uint8.shape[1])],
-            "original_size": [height, width],
-            "downsampled": total_pixels > 10_000_000
-        }
-    except Exception as e:
-        raise RuntimeError(f"Detection failed: {str(e)}")
+            # Contiguous chunks gathered in submission order keep output identical to the serial path
+            pool = get_process_pool(workers)
+            chunks = split_evenly(windows, workers * CHUNKS_PER_WORKER)
+            futures = [
+                pool.submit(_detect_windows, image_path, source, chunk, red_index, nir_index, p99, cleanup, context)
+                for chunk in chunks
+            ]
+            interior, edge = [], []
+            tiles_done = 0
+            try:
+                for chunk, future in zip(chunks, futures):
+                    chunk_interior, chunk_edge, stages = future.result()
+                    merge_stages(stages)
+                    interior.extend(chunk_interior)
+                    edge.extend(chunk_edge)
+                    tiles_done += len(chunk)
+                    if context is not None:
+                        _report_tiles(context, tiles_done, len(windows), len(interior) + len(edge))
+            except JobCancelledError:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    if context is not None:
+        context.report(TILE_PROGRESS_END, "stitching", polygons=len(interior) + len(edge))
+    polygons = interior + _stitch_edge_polygons(edge, cleanup["min_pixels"])
+    if context is not None:
+        context.report(88, "simplifying", polygons=len(polygons))
+    polygons = _simplify_polygons(polygons, simplify_tolerance)
+    if context is not None:
+        context.report(90, "vectorizing", polygons=len(polygons))
+    gdf = pixel_geometries_to_gdf(polygons, transform, crs)
+    # Mask grid, so boundary checks can count pixels on it (see check_boundary area_method="raster")
+    grid = {"crs": crs.to_string() if crs else None, "transform": list(transform)[:6],
+            "width": int(width), "height": int(height),
+            "resolution": [abs(transform.a), abs(transform.e)], "original_size": original_size,
+            "overview_level": source[0], "decimation": source[1]}
+    return gdf, grid
+
+
+def detection_summary(area_ha: float, geojson: Any, grid: Dict[str, Any]) -> Dict[str, Any]:
+    """Detection result fields; mask_shape differs from original_size when quick-look read a coarser level."""
+    mask_shape = [int(grid["height"]), int(grid["width"])]
+    return {
+        "area_ha": float(area_ha),
+        "geojson": geojson,
+        "mask_shape": mask_shape,
+        "original_size": grid["original_size"],
+        "downsampled": mask_shape != grid["original_size"],
+        "resolution": grid["resolution"],
+        "overview_level": grid["overview_level"],
+        "grid": grid
+    }
+
 
+def detection_result(gdf: gpd.GeoDataFrame, grid: Dict[str, Any], context: Optional[JobContext] = None) -> Dict[str, Any]:
+    """Detection result of detect_mining_frame's output: the GeoJSON, encoded once, and the area."""
+    geojson = geojson_bytes_from_gdf(gdf)
 
+    # area in hectares
+    if context is not None:
+        context.report(95, "area", polygons=len(gdf))
+    area_ha = calculate_area_ha(gdf)
+
+    return detection_summary(area_ha, geojson, grid)
+
+
+def detect_mining(image_path: str, max_tile_pixels: int = DEFAULT_TILE_PIXELS,
+                  workers: Optional[int] = None, context: Optional[JobContext] = None,
+                  morphology_radius: int = MORPHOLOGY_RADIUS, min_component_pixels: int = MIN_COMPONENT_PIXELS,
+                  simplify_tolerance: float = SIMPLIFY_TOLERANCE, target_resolution: Optional[float] = None,
+                  max_pixels: Optional[int] = None) -> Dict[str, Any]:
+    try:
+        gdf, grid = detect_mining_frame(image_path, max_tile_pixels, workers, context,
+                                        morphology_radius, min_component_pixels, simplify_tolerance,
+                                        target_resolution, max_pixels)
+        return detection_result(gdf, grid, context)
+    except JobCancelledError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Detection failed: {str(e)}")
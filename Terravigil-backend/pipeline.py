@@ -0,0 +1,100 @@
+from typing import Dict, Any, Optional
+import os
+
+from detection import detect_mining_frame, detection_summary
+from boundary_check import check_boundary_frame
+from volume_estimation import estimate_volume
+from utils.geo_utils import geojson_bytes_from_gdf, calculate_area_ha, scratch_dir
+from utils.dem_tiles import dem_tile_store_from_env
+from utils.job_queue import JobContext, JobCancelledError
+
+
+# Share of the job's progress given to each stage; detection dominates the run time
+DETECTION_PROGRESS = (0, 70)
+BOUNDARY_PROGRESS = (70, 80)
+VOLUME_PROGRESS = (80, 100)
+
+
+def run_pipeline_frames(image_path: str, dem_path: Optional[str] = None, boundary_path: Optional[str] = None,
+                        boundary_geojson: Optional[Dict[str, Any]] = None, boundary_id: Optional[str] = None,
+                        demtype: Optional[str] = None, area_method: str = "vector",
+                        include_geometry: Optional[bool] = None, method: str = "simpson",
+                        workers: Optional[int] = None, target_resolution: Optional[float] = None,
+                        max_pixels: Optional[int] = None, context: Optional[JobContext] = None) -> Dict[str, Any]:
+    """The stages of run_pipeline without any GeoJSON encoding.
+
+    Returns the detected polygons ('mining', a GeoDataFrame in the scene CRS), their 'grid' and
+    'area_ha', and the 'boundary' and 'volume' sections (None when the stage did not run). The boundary
+    section holds its legal/illegal pieces as GeoDataFrames under 'legal'/'illegal' when geometries are kept.
+    """
+    def stage_context(progress_range):
+        return context.sub_range(*progress_range) if context is not None else None
+
+    try:
+        mining, grid = detect_mining_frame(image_path, workers=workers, context=stage_context(DETECTION_PROGRESS),
+                                           target_resolution=target_resolution, max_pixels=max_pixels)
+        area_ha = calculate_area_ha(mining)
+    except JobCancelledError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Detection failed: {str(e)}")
+
+    boundary = None
+    if boundary_path is not None or boundary_geojson is not None or boundary_id is not None:
+        if context is not None:
+            context.report(BOUNDARY_PROGRESS[0], "boundary", polygons=len(mining))
+        boundary = check_boundary_frame(mining, boundary_path=boundary_path, boundary_geojson=boundary_geojson,
+                                        boundary_id=boundary_id, area_method=area_method,
+                                        include_geometry=include_geometry, grid=grid, frames=True)
+
+    volume = None
+    if dem_path is not None or demtype:
+        if mining.empty:
+            # Nothing detected: an empty mask would otherwise integrate the whole DEM
+            volume = {"baseline_reference_elevation": None, "max_depth_m": 0.0, "avg_depth_m": 0.0,
+                      "volume_m3": 0.0, "integration_method": method}
+        else:
+            fetched_dem = None
+            if dem_path is None:
+                if context is not None:
+                    context.report(VOLUME_PROGRESS[0], "dem")
+                west, south, east, north = mining.to_crs(4326).total_bounds
+                # Tiles are lon/lat; volumes are integrated on metre pixels (the scene's CRS, or its UTM zone)
+                dem_crs = mining.crs if mining.crs is not None and mining.crs.is_projected else mining.estimate_utm_crs()
+                fetched_dem = dem_path = dem_tile_store_from_env().build_mosaic(
+                    west, south, east, north, demtype=demtype, directory=scratch_dir(), dst_crs=dem_crs)
+            try:
+                volume = estimate_volume(dem_path, mining, workers=workers, method=method,
+                                         context=stage_context(VOLUME_PROGRESS))
+            finally:
+                if fetched_dem is not None and os.path.exists(fetched_dem):
+                    os.remove(fetched_dem)
+
+    return {"mining": mining, "grid": grid, "area_ha": area_ha, "boundary": boundary, "volume": volume}
+
+
+def run_pipeline(image_path: str, dem_path: Optional[str] = None, boundary_path: Optional[str] = None,
+                 boundary_geojson: Optional[Dict[str, Any]] = None, boundary_id: Optional[str] = None,
+                 demtype: Optional[str] = None, area_method: str = "vector", include_geometry: Optional[bool] = None,
+                 method: str = "simpson", workers: Optional[int] = None, target_resolution: Optional[float] = None,
+                 max_pixels: Optional[int] = None, context: Optional[JobContext] = None) -> Dict[str, Any]:
+    """Detection, boundary check and volume estimation for one scene in a single job.
+
+    The detected polygons stay a GeoDataFrame with the scene CRS, and the mask grid is handed to the
+    boundary stage, so nothing is serialized between stages; GeoJSON is produced once for the result.
+    The boundary stage runs when a boundary is given; the volume stage when a DEM is given, or when
+    demtype names an OpenTopography dataset to fetch for the detected area. target_resolution or
+    max_pixels run detection in quick-look mode (see detect_mining_frame).
+    """
+    frames = run_pipeline_frames(image_path, dem_path=dem_path, boundary_path=boundary_path,
+                                 boundary_geojson=boundary_geojson, boundary_id=boundary_id, demtype=demtype,
+                                 area_method=area_method, include_geometry=include_geometry, method=method,
+                                 workers=workers, target_resolution=target_resolution, max_pixels=max_pixels,
+                                 context=context)
+    detection = detection_summary(frames["area_ha"], geojson_bytes_from_gdf(frames["mining"]), frames["grid"])
+    boundary = frames["boundary"]
+    if boundary is not None:
+        boundary = {(f"{key}_geojson" if key in ("legal", "illegal") else key):
+                    (geojson_bytes_from_gdf(value) if key in ("legal", "illegal") else value)
+                    for key, value in boundary.items()}
+    return {"detection": detection, "boundary": boundary, "volume": frames["volume"]}
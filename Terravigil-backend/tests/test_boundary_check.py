@@ -0,0 +1,89 @@
+import json
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import box
+
+import boundary_check
+from benchmarks.synthetic import lease_collection, write_scene
+from boundary_check import check_boundary, split_by_leases
+from detection import detect_mining_frame
+from utils.boundary_registry import BoundaryRegistry, build_lease_index
+
+GRID = {"crs": "EPSG:32643", "transform": [10.0, 0.0, 500000.0, 0.0, -10.0, 2000000.0], "width": 100, "height": 100}
+
+
+def _geojson(geoms, crs):
+    return json.loads(gpd.GeoDataFrame({"name": [f"f{i}" for i in range(len(geoms))]}, geometry=geoms,
+                                       crs=crs).to_json())
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    registry = BoundaryRegistry(str(tmp_path / "boundaries"))
+    monkeypatch.setattr(boundary_check, "_boundary_registry", registry)
+    return registry
+
+
+def test_raster_areas_use_the_detection_grid_for_leases_in_another_crs(registry):
+    mining = _geojson([box(500100, 1999000, 500600, 1999500)], None)
+    leases = gpd.GeoDataFrame(geometry=[box(500000, 1999200, 500400, 1999800)], crs=GRID["crs"])
+    registry.register("wgs84", boundary_geojson=json.loads(leases.to_crs(4326).to_json()))
+
+    result = check_boundary(mining, boundary_id="wgs84", area_method="raster", grid=GRID)
+    assert result["pixel_size"] == [10.0, 10.0]
+    assert result["legal_area_ha"] == pytest.approx(9.0)
+    assert result["illegal_area_ha"] == pytest.approx(16.0)
+
+    inline = check_boundary(mining, boundary_geojson=json.loads(leases.to_json()), area_method="raster", grid=GRID)
+    assert (inline["legal_area_ha"], inline["illegal_area_ha"]) == (result["legal_area_ha"], result["illegal_area_ha"])
+
+
+@pytest.fixture(scope="module")
+def mining(tmp_path_factory):
+    scene = write_scene(str(tmp_path_factory.mktemp("leases") / "scene.tif"), 1000, seed=0)
+    gdf, _ = detect_mining_frame(scene, workers=1)
+    gdf["mining_id"] = range(len(gdf))
+    return gdf
+
+
+def _areas(gdf, by):
+    return gdf.assign(area=gdf.area).groupby(by)["area"].sum()
+
+
+@pytest.mark.parametrize("with_union", [False, True])
+def test_split_matches_overlay(mining, with_union):
+    leases = gpd.GeoDataFrame.from_features(lease_collection(40, 1000)["features"], crs=mining.crs)
+    legal, illegal = split_by_leases(mining, index=build_lease_index(leases, with_union=with_union))
+    assert len(legal) and len(illegal)
+    assert set(legal["lease_id"]) <= set(leases["lease_id"])
+
+    reference = gpd.overlay(mining, leases.assign(lease_index=range(len(leases))), how="intersection",
+                            keep_geom_type=True)
+    expected = _areas(reference, ["mining_id", "lease_index"])
+    _assert_areas(_areas(legal, ["mining_id", "lease_index"]), expected)
+
+    outside = mining.assign(geometry=mining.difference(leases.union_all()))
+    outside = outside[~outside.is_empty]
+    _assert_areas(_areas(illegal, "mining_id"), _areas(outside, "mining_id"))
+
+
+def test_overlapping_leases_count_once(mining):
+    leases = gpd.GeoDataFrame.from_features(lease_collection(40, 1000)["features"], crs=mining.crs)
+    # A lease over the whole scene overlaps all the others
+    leases = gpd.GeoDataFrame(
+        {"lease_id": list(leases["lease_id"]) + ["everything"]},
+        geometry=list(leases.geometry) + [box(*mining.total_bounds).buffer(-2000)], crs=mining.crs)
+    legal, illegal = split_by_leases(mining, boundary=leases)
+
+    union = leases.union_all()
+    inside = mining.intersection(union)
+    _assert_areas(_areas(legal, "mining_id"), _areas(mining.assign(geometry=inside)[~inside.is_empty], "mining_id"))
+    assert legal.area.sum() + illegal.area.sum() == pytest.approx(mining.area.sum(), rel=1e-9)
+    # Pieces inside a synthetic lease go to it, not to the lease covering everything listed after it
+    assert (legal["lease_id"] != "everything").any()
+
+
+def _assert_areas(actual, expected):
+    assert list(actual.index) == list(expected.index)
+    assert actual.values == pytest.approx(expected.values, rel=1e-9, abs=1e-6)
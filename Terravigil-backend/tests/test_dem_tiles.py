@@ -0,0 +1,149 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pytest
+import rasterio
+from pyproj import Transformer
+from rasterio.io import MemoryFile
+from rasterio.transform import from_bounds
+
+from utils.dem_tiles import dem_tile_store_from_env
+
+
+# 10 arc-seconds: 36 x 36 pixels per 0.1 degree tile
+RESOLUTION_DEG = 1.0 / 360
+
+
+def _height(lon, lat):
+    return (lon - 77.0) * 1000.0 + (lat - 21.0) * 100.0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        west, south, east, north = (float(query[k][0]) for k in ("west", "south", "east", "north"))
+        width = int(round((east - west) / RESOLUTION_DEG))
+        height = int(round((north - south) / RESOLUTION_DEG))
+        transform = from_bounds(west, south, east, north, width, height)
+        cols, rows = np.meshgrid(np.arange(width) + 0.5, np.arange(height) + 0.5)
+        lon, lat = transform * (cols, rows)
+        with MemoryFile() as memfile:
+            with memfile.open(driver="GTiff", width=width, height=height, count=1, dtype="float32",
+                              crs="EPSG:4326", transform=transform) as dst:
+                dst.write(_height(lon, lat).astype(np.float32), 1)
+            data = memfile.read()
+        self.server.requests.append((query["demtype"][0], west, south, east, north))
+        self.send_response(200)
+        self.send_header("Content-Type", "image/tiff")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def store(server, tmp_path, monkeypatch):
+    host, port = server.server_address[:2]
+    monkeypatch.setenv("OPENTOPOGRAPHY_URL", f"http://{host}:{port}/API/globaldem")
+    monkeypatch.setenv("TERRAVIGIL_DEM_CACHE_DIR", str(tmp_path / "tiles"))
+    monkeypatch.delenv("TERRAVIGIL_DEM_TILE_DEG", raising=False)
+    monkeypatch.delenv("TERRAVIGIL_DEM_CACHE_MAX_BYTES", raising=False)
+    monkeypatch.delenv("OPENTOPOGRAPHY_API_KEY", raising=False)
+    return dem_tile_store_from_env()
+
+
+def _tiles(requests):
+    return sorted((round(west, 6), round(south, 6)) for _, west, south, _, _ in requests)
+
+
+def test_fetches_only_missing_tiles(store, server, tmp_path):
+    store.build_mosaic(77.05, 21.05, 77.15, 21.15, directory=str(tmp_path))
+    assert _tiles(server.requests) == [(77.0, 21.0), (77.0, 21.1), (77.1, 21.0), (77.1, 21.1)]
+    assert {demtype for demtype, *_ in server.requests} == {"COP30"}
+
+    # Shifted east by one tile column: only the two new tiles are downloaded
+    del server.requests[:]
+    store.build_mosaic(77.12, 21.05, 77.25, 21.15, directory=str(tmp_path))
+    assert _tiles(server.requests) == [(77.2, 21.0), (77.2, 21.1)]
+
+    # Inside tiles already on disk: no download at all
+    del server.requests[:]
+    store.build_mosaic(77.02, 21.02, 77.22, 21.18, directory=str(tmp_path))
+    assert server.requests == []
+
+
+def test_mosaic_matches_request(store, tmp_path):
+    west, south, east, north = 77.05, 21.05, 77.15, 21.15
+    path = store.build_mosaic(west, south, east, north, directory=str(tmp_path))
+    with rasterio.open(path) as src:
+        assert src.crs.to_epsg() == 4326
+        assert np.allclose(tuple(src.bounds), (west, south, east, north), atol=1e-9)
+        assert src.width == src.height == 36
+        dem = src.read(1)
+        cols, rows = np.meshgrid(np.arange(src.width) + 0.5, np.arange(src.height) + 0.5)
+        lon, lat = src.transform * (cols, rows)
+    assert np.allclose(dem, _height(lon, lat), atol=1e-2)
+
+
+def test_mosaic_warps_to_a_projected_crs(store, tmp_path):
+    path = store.build_mosaic(77.05, 21.05, 77.15, 21.15, directory=str(tmp_path), dst_crs="EPSG:32643")
+    with rasterio.open(path) as src:
+        assert src.crs.to_epsg() == 32643
+        # 10 arc-seconds at 21 N is roughly 290 x 310 m; volumes multiply by these, not by degrees
+        assert 250 < src.transform.a < 350 and 250 < -src.transform.e < 350
+        dem = src.read(1, masked=True)
+        cols, rows = np.meshgrid(np.arange(src.width) + 0.5, np.arange(src.height) + 0.5)
+        x, y = src.transform * (cols, rows)
+    lon, lat = Transformer.from_crs(32643, 4326, always_xy=True).transform(x, y)
+    # Corners of the rotated bbox are nodata; the heights inside are the same surface
+    inside = ~dem.mask & (lon > 77.06) & (lon < 77.14) & (lat > 21.06) & (lat < 21.14)
+    assert inside.sum() > 500
+    assert np.allclose(dem.data[inside], _height(lon, lat)[inside], atol=0.5)
+
+
+def test_lru_eviction_stays_under_quota(store, server, tmp_path):
+    store.build_mosaic(77.0, 21.0, 77.1, 21.1, directory=str(tmp_path))
+    tile_bytes = os.path.getsize(store.tile_path("COP30", 770, 210))
+    store.max_bytes = 5 * tile_bytes
+
+    # Two disjoint 2 x 2 requests; the first one's tiles are made older so the LRU order is certain
+    store.build_mosaic(78.0, 21.0, 78.2, 21.2, directory=str(tmp_path))
+    for n, name in enumerate(sorted(os.listdir(os.path.join(store.directory, "COP30")))):
+        os.utime(os.path.join(store.directory, "COP30", name), (1000 + n, 1000 + n))
+    second = store.tile_indices(79.0, 21.0, 79.2, 21.2)
+    store.build_mosaic(79.0, 21.0, 79.2, 21.2, directory=str(tmp_path))
+
+    names = os.listdir(os.path.join(store.directory, "COP30"))
+    total = sum(os.path.getsize(os.path.join(store.directory, "COP30", name)) for name in names)
+    assert total <= store.max_bytes
+    # The tiles of the latest request are always kept
+    assert all(os.path.exists(store.tile_path("COP30", ix, iy)) for ix, iy in second)
+    assert len(names) == 5
+
+    # An evicted tile is downloaded again on the next request
+    del server.requests[:]
+    store.build_mosaic(77.0, 21.0, 77.1, 21.1, directory=str(tmp_path))
+    assert _tiles(server.requests) == [(77.0, 21.0)]
+
+
+@pytest.mark.parametrize("demtype", ["../../x", "/tmp/x", "COP30/../..", "", "a b"])
+def test_rejects_demtype_outside_the_store(store, server, tmp_path, demtype):
+    with pytest.raises(ValueError):
+        store.build_mosaic(77.05, 21.05, 77.15, 21.15, demtype=demtype, directory=str(tmp_path))
+    assert server.requests == []
+    assert os.listdir(store.directory) == []
@@ -0,0 +1,24 @@
+import pytest
+import shapely
+
+from benchmarks.synthetic import write_scene
+from detection import detect_mining_frame
+
+
+@pytest.fixture(scope="module")
+def scene(tmp_path_factory):
+    return write_scene(str(tmp_path_factory.mktemp("scenes") / "scene.tif"), 1500, seed=0)
+
+
+def _geometries(gdf):
+    return sorted(shapely.to_wkt(shapely.normalize(gdf.geometry.values)))
+
+
+@pytest.mark.parametrize("tile_side", [100, 333, 700])
+def test_tiled_detection_matches_untiled(scene, tile_side):
+    whole, grid = detect_mining_frame(scene, workers=1)
+    tiled, tiled_grid = detect_mining_frame(scene, max_tile_pixels=tile_side * tile_side, workers=1)
+    assert tiled_grid == grid
+    assert len(whole) > 0
+    # Default cleanup and simplification: seams must not move a single vertex
+    assert _geometries(tiled) == _geometries(whole)
@@ -0,0 +1,41 @@
+import threading
+
+from utils.job_queue import JobScheduler
+
+
+def _submit(scheduler, job_id, fn, *args, **callbacks):
+    done = threading.Event()
+    outcome = {}
+
+    def on_finally():
+        done.set()
+    callbacks.setdefault("on_complete", lambda result: outcome.update(result=result))
+    callbacks.setdefault("on_error", lambda e: outcome.update(error=e))
+    scheduler.submit(job_id, fn, *args, on_finally=on_finally, **callbacks)
+    return done, outcome
+
+
+def _raise(*args):
+    raise RuntimeError("callback failed")
+
+
+def test_failing_callbacks_do_not_kill_dispatchers():
+    scheduler = JobScheduler(workers=1, max_queue=8)
+    try:
+        errors = []
+        done, _ = _submit(scheduler, "complete", abs, -1, on_complete=_raise, on_error=errors.append)
+        assert done.wait(60)
+        # A failing on_complete is reported to on_error, like a failing job
+        assert [str(e) for e in errors] == ["callback failed"]
+
+        done, _ = _submit(scheduler, "error", int, "not a number", on_error=_raise)
+        assert done.wait(60)
+        done, _ = _submit(scheduler, "start", abs, -2, on_start=_raise, on_error=_raise)
+        assert done.wait(60)
+
+        # The only dispatcher thread is still alive and runs the next job
+        done, outcome = _submit(scheduler, "after", abs, -3)
+        assert done.wait(60)
+        assert outcome == {"result": 3}
+    finally:
+        scheduler.shutdown()
@@ -0,0 +1,86 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+import shapely
+
+from benchmarks.synthetic import write_dem, write_scene
+from detection import detect_mining_frame
+from utils.job_queue import JobCancelledError, JobContext, JobScheduler
+from utils.parallel import get_process_pool
+from volume_estimation import estimate_volume
+
+# Pools use spawn, so everything they run lives at module level and is imported by the workers
+
+
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("parallel")
+    return {"scene": write_scene(str(directory / "scene.tif"), 1000, seed=3),
+            "dem": write_dem(str(directory / "dem.tif"), 1000, seed=3)}
+
+
+def test_parallel_detection_matches_serial(data):
+    serial, grid = detect_mining_frame(data["scene"], max_tile_pixels=256 * 256, workers=1)
+    parallel, parallel_grid = detect_mining_frame(data["scene"], max_tile_pixels=256 * 256, workers=2)
+    assert parallel_grid == grid
+    assert len(serial) > 0
+    assert shapely.to_wkt(parallel.geometry.values).tolist() == shapely.to_wkt(serial.geometry.values).tolist()
+
+
+def test_parallel_volume_matches_serial(data):
+    mining, _ = detect_mining_frame(data["scene"], workers=1)
+    for method in ("simpson", "trapezoid", "sum"):
+        serial = estimate_volume(data["dem"], mining, workers=1, method=method)
+        parallel = estimate_volume(data["dem"], mining, workers=2, method=method)
+        assert serial["volume_m3"] > 0
+        assert parallel["volume_m3"] == pytest.approx(serial["volume_m3"], rel=1e-12)
+        assert {k: v for k, v in parallel.items() if k != "volume_m3"} == \
+               {k: v for k, v in serial.items() if k != "volume_m3"}
+
+
+def _wait_for_cancel(context: JobContext, timeout: float = 60.0) -> str:
+    # Runs in a pool worker: only the manager-backed event can tell it about the cancellation
+    context.report(10, "waiting", force=True)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        context.check_cancelled()
+        time.sleep(0.05)
+    return "timed out"
+
+
+def _nested_job(context: JobContext) -> str:
+    # A scheduler job that fans out to the shared detection/volume pool, as detection does
+    return get_process_pool(2).submit(_wait_for_cancel, context).result()
+
+
+def test_cancel_event_reaches_pool_workers():
+    manager = multiprocessing.get_context("spawn").Manager()
+    try:
+        context = JobContext("job", manager.Queue(), manager.Event())
+        future = get_process_pool(2).submit(_wait_for_cancel, context)
+        assert context.events.get(timeout=60)[1]["stage"] == "waiting"
+        context.cancel_event.set()
+        with pytest.raises(JobCancelledError):
+            future.result(timeout=60)
+    finally:
+        manager.shutdown()
+
+
+def test_scheduler_cancel_reaches_nested_pool_workers():
+    scheduler = JobScheduler(workers=1, max_queue=4)
+    done = threading.Event()
+    errors, results = [], []
+
+    def on_progress(payload):
+        if payload.get("stage") == "waiting":
+            scheduler.cancel("nested")
+    try:
+        scheduler.submit("nested", _nested_job, with_context=True, on_progress=on_progress,
+                         on_complete=results.append, on_error=errors.append, on_finally=done.set)
+        assert done.wait(120)
+        assert results == []
+        assert [type(e) for e in errors] == [JobCancelledError]
+    finally:
+        scheduler.shutdown()
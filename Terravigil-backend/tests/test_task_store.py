@@ -0,0 +1,18 @@
+from utils.task_store import TaskStore
+
+
+def test_conditional_update_keeps_a_cancelled_task(tmp_path):
+    store = TaskStore(spill_dir=str(tmp_path))
+    store.create("job", {"status": "processing", "progress": 40})
+    assert store.update("job", status="cancelled")
+    # The completing job loses the race: nothing it writes lands
+    assert not store.update("job", unless_status=("cancelled",), status="completed", progress=100,
+                            result={"area": 1.0}, metrics={"stages": {}})
+    task = store.get("job")
+    assert (task["status"], task["progress"]) == ("cancelled", 40)
+    assert task.get("result") is None and "metrics" not in task
+
+    store.create("other", {"status": "processing"})
+    assert store.update("other", unless_status=("cancelled",), status="completed", result={"area": 1.0})
+    assert store.get("other")["status"] == "completed"
+    assert not store.update("missing", status="completed")
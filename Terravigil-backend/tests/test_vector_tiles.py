@@ -0,0 +1,89 @@
+import gzip
+import os
+
+import pyogrio
+import pytest
+
+from benchmarks.synthetic import write_scene
+from detection import detect_mining_frame
+from utils.vector_tiles import SIMPLIFICATION, SIMPLIFICATION_MAX_ZOOM, VectorTileCache
+
+
+MIN_ZOOM, MAX_ZOOM = 8, 13
+
+
+@pytest.fixture(scope="module")
+def mining(tmp_path_factory):
+    scene = write_scene(str(tmp_path_factory.mktemp("tiles") / "scene.tif"), 1000, seed=0)
+    gdf, _ = detect_mining_frame(scene, workers=1)
+    return gdf
+
+
+@pytest.fixture
+def cache(mining, tmp_path):
+    cache = VectorTileCache(str(tmp_path / "cache"), min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM)
+    cache.build("task", {"mining": mining})
+    return cache
+
+
+def _tiles(directory, suffix):
+    return sorted(tuple(int(part) for part in os.path.relpath(os.path.join(root, name), directory)[:-len(suffix)]
+                        .split(os.sep))
+                  for root, _, files in os.walk(directory) for name in files if name.endswith(suffix))
+
+
+def _read_tile(data, tmp_path, z, x, y):
+    # GDAL reads a lone tile by its z/x/y path
+    path = tmp_path / "read" / str(z) / str(x) / f"{y}.pbf"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(gzip.decompress(data))
+    return pyogrio.read_dataframe(str(path), layer="mining")
+
+
+def test_tiles_match_a_full_pyramid(cache, mining, tmp_path):
+    reference = tmp_path / "reference"
+    pyogrio.write_dataframe(mining, str(reference), driver="MVT", layer="mining",
+                            dataset_options={"FORMAT": "DIRECTORY", "COMPRESS": "NO", "MINZOOM": MIN_ZOOM,
+                                             "MAXZOOM": MAX_ZOOM, "SIMPLIFICATION": SIMPLIFICATION,
+                                             "SIMPLIFICATION_MAX_ZOOM": SIMPLIFICATION_MAX_ZOOM})
+    tiles = _tiles(str(reference), ".pbf")
+    assert {z for z, _, _ in tiles} == set(range(MIN_ZOOM, MAX_ZOOM + 1))
+    for z, x, y in tiles:
+        expected = pyogrio.read_dataframe(str(reference / str(z) / str(x) / f"{y}.pbf"), layer="mining")
+        data = cache.tile("task", z, x, y)
+        if expected.empty:
+            continue
+        actual = _read_tile(data, tmp_path, z, x, y)
+        assert len(actual) == len(expected)
+        assert actual.area.sum() == pytest.approx(expected.area.sum(), rel=1e-9)
+
+
+def test_tiles_are_encoded_on_request(cache, tmp_path):
+    # Building stores the layers only
+    assert _tiles(cache.pyramid_path("task"), ".mvt") == []
+    tilejson = cache.tilejson("task")
+    assert [layer["id"] for layer in tilejson["vector_layers"]] == ["mining"]
+
+    data = cache.tile("task", 10, 725, 459)
+    assert len(_read_tile(data, tmp_path, 10, 725, 459)) > 0
+    assert _tiles(cache.pyramid_path("task"), ".mvt") == [(10, 725, 459)]
+    assert cache.tile("task", 10, 725, 459) == data
+
+    # Empty tiles are remembered as such; zooms outside the range are never encoded
+    assert cache.tile("task", 10, 0, 0) is None
+    assert cache.tile("task", MAX_ZOOM + 1, 0, 0) is None
+    assert cache.tile("task", 10, 1024, 0) is None
+    assert _tiles(cache.pyramid_path("task"), ".mvt") == [(10, 0, 0), (10, 725, 459)]
+
+
+def test_feature_cap_keeps_the_largest(mining, tmp_path):
+    cache = VectorTileCache(str(tmp_path / "cache"), min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM, max_tile_features=5)
+    cache.build("task", {"mining": mining})
+    tile = _read_tile(cache.tile("task", 10, 725, 459), tmp_path, 10, 725, 459)
+    assert len(tile) == 5
+    largest = mining.loc[mining.to_crs(3857).area.nlargest(5).index]
+    pyogrio.write_dataframe(largest, str(tmp_path / "reference"), driver="MVT", layer="mining",
+                            dataset_options={"FORMAT": "DIRECTORY", "COMPRESS": "NO", "MINZOOM": 10,
+                                             "MAXZOOM": 10, "SIMPLIFICATION": SIMPLIFICATION})
+    expected = pyogrio.read_dataframe(str(tmp_path / "reference" / "10" / "725" / "459.pbf"), layer="mining")
+    assert tile.area.sum() == pytest.approx(expected.area.sum(), rel=1e-9)
@@ -0,0 +1,239 @@
+from typing import Dict, Any, List, Optional
+import os
+import sys
+import argparse
+
+import numpy as np
+import rasterio
+import rasterio.enums
+from rasterio.features import geometry_window, rasterize
+from rasterio.vrt import WarpedVRT
+from rasterio.errors import WindowError
+
+from detection import (detect_mining_frame, vectorize_mask, DEFAULT_TILE_PIXELS, NDVI_THRESHOLD,
+                       BRIGHTNESS_THRESHOLD, MORPHOLOGY_RADIUS, MIN_COMPONENT_PIXELS, SIMPLIFY_TOLERANCE)
+from utils.geo_utils import calculate_area_ha, feature_areas_m2, geojson_bytes_from_gdf, iter_block_windows, hash_file
+from utils.geojson_io import dumps
+from utils.mask_store import MaskStore, mask_store_from_env
+from utils.output_formats import write_mask_cog
+from utils.parallel import resolve_workers, get_process_pool
+from utils.job_queue import JobContext, JobCancelledError
+from utils.metrics import collect, merge_stages
+
+
+# Share of the job's progress for detecting the scenes; the change pass over stored masks fills the rest
+DETECTION_PROGRESS = (0, 80)
+CHANGE_PROGRESS = (80, 100)
+
+
+def _scene_params(target_resolution: Optional[float], max_pixels: Optional[int]) -> Dict[str, Any]:
+    # Stored with every mask: a date is only reused when its scene was detected with the same settings
+    return {"ndvi_threshold": NDVI_THRESHOLD, "brightness_threshold": BRIGHTNESS_THRESHOLD,
+            "morphology_radius": MORPHOLOGY_RADIUS, "min_component_pixels": MIN_COMPONENT_PIXELS,
+            "simplify_tolerance": SIMPLIFY_TOLERANCE, "target_resolution": target_resolution,
+            "max_pixels": max_pixels}
+
+
+def _detect_scene(image_path: str, mask_path: str, workers: int = 1, target_resolution: Optional[float] = None,
+                  max_pixels: Optional[int] = None) -> Dict[str, Any]:
+    # Process-pool entry point: only the mask (on disk), a few numbers and the stage metrics travel back,
+    # never the polygons
+    with collect() as metrics:
+        gdf, grid = detect_mining_frame(image_path, workers=workers, target_resolution=target_resolution,
+                                        max_pixels=max_pixels)
+        write_mask_cog(gdf, grid, mask_path)
+        area_ha = calculate_area_ha(gdf)
+    return {"area_ha": area_ha, "polygons": int(len(gdf)), "grid": grid, "stages": metrics.snapshot()}
+
+
+def change_frame(current_path: str, previous_path: str, max_tile_pixels: int = DEFAULT_TILE_PIXELS,
+                 context: Optional[JobContext] = None):
+    """Polygons of the disturbance in the current mask that the previous mask did not have.
+
+    Both masks are read tile by tile; a previous mask on another grid (e.g. a different quick-look
+    level) is resampled onto the current one with nearest neighbour. The change mask is cleaned like a
+    detection, which also drops the one or two pixel slivers that re-rasterized outlines leave along
+    unchanged pit edges. Each polygon is 'grown' when it borders the previous footprint, else 'new'.
+    """
+    with rasterio.open(current_path) as current, rasterio.open(previous_path) as previous:
+        same = (current.width, current.height, current.crs) == (previous.width, previous.height, previous.crs) \
+            and current.transform.almost_equals(previous.transform)
+        before = previous if same else WarpedVRT(
+            previous, crs=current.crs, transform=current.transform, width=current.width, height=current.height,
+            resampling=rasterio.enums.Resampling.nearest)
+        try:
+            def read_change(window):
+                return current.read(1, window=window).astype(bool) & ~before.read(1, window=window).astype(bool)
+
+            windows = list(iter_block_windows(current, max_tile_pixels))
+            change = vectorize_mask(read_change, windows, current.width, current.height, current.transform,
+                                    current.crs, context=context)
+            change["kind"] = [_change_kind(before, geom) for geom in change.geometry] if len(change) else []
+        finally:
+            if before is not previous:
+                before.close()
+    change["area_ha"] = feature_areas_m2(change) / 10000.0
+    return change
+
+
+def _change_kind(before, geom) -> str:
+    # One pixel ring around the polygon: any previous disturbance there means an existing pit grew
+    ring = geom.buffer(max(abs(before.transform.a), abs(before.transform.e)))
+    try:
+        window = geometry_window(before, [ring])
+    except WindowError:
+        return "new"
+    touched = rasterize([(ring, 1)], out_shape=(int(window.height), int(window.width)),
+                        transform=before.window_transform(window), fill=0, dtype="uint8").astype(bool)
+    return "grown" if (before.read(1, window=window).astype(bool) & touched).any() else "new"
+
+
+def run_time_series(aoi_id: str, scenes: List[Dict[str, Any]], store: Optional[MaskStore] = None,
+                    workers: Optional[int] = None, target_resolution: Optional[float] = None,
+                    max_pixels: Optional[int] = None, include_geometry: bool = True,
+                    context: Optional[JobContext] = None) -> Dict[str, Any]:
+    """Detect a stack of co-registered scenes of one AOI and report what changed between dates.
+
+    scenes are {"date": "YYYY-MM-DD", "path": ..., "hash": optional sha256} in any order. Every date
+    keeps a compact mask in the MaskStore; a date already stored for the same scene and settings is not
+    detected again. Each date is compared with the latest stored date before it (from this batch or an
+    earlier one) and only the new or grown disturbance is vectorized; the first date of an AOI is the
+    baseline. Scenes run in parallel, one per worker; a single scene uses the workers for its tiles.
+    """
+    store = store or mask_store_from_env()
+    store.check_id(aoi_id)
+    if not scenes:
+        raise ValueError("At least one scene is required")
+    scenes = sorted(({"date": store.check_date(s["date"]), "path": s["path"], "hash": s.get("hash")}
+                     for s in scenes), key=lambda s: s["date"])
+    dates = [s["date"] for s in scenes]
+    if len(set(dates)) != len(dates):
+        raise ValueError("Each scene needs its own date")
+    params = _scene_params(target_resolution, max_pixels)
+
+    pending = []
+    for scene in scenes:
+        scene["hash"] = scene["hash"] or hash_file(scene["path"])
+        stored = store.get(aoi_id, scene["date"])
+        scene["reused"] = (stored is not None and stored.get("scene_hash") == scene["hash"]
+                           and stored.get("params") == params and os.path.exists(store.mask_path(aoi_id, scene["date"])))
+        if not scene["reused"]:
+            pending.append(scene)
+
+    workers = resolve_workers(workers)
+    for scene in pending:
+        scene["mask"] = store.temp_mask_path(aoi_id)
+
+    def store_scene(scene, detected):
+        merge_stages(detected.pop("stages"))
+        store.put(aoi_id, scene["date"], scene.pop("mask"),
+                  {"scene_hash": scene["hash"], "params": params, **detected})
+
+    def report_scenes(done):
+        if context is not None:
+            span = DETECTION_PROGRESS[1] - DETECTION_PROGRESS[0]
+            context.report(DETECTION_PROGRESS[0] + span * done / max(1, len(pending)), "detecting",
+                           force=done == len(pending), scenes_done=done, scenes_total=len(pending),
+                           scenes_reused=len(scenes) - len(pending))
+
+    try:
+        report_scenes(0)
+        if workers <= 1 or len(pending) <= 1:
+            for done, scene in enumerate(pending, start=1):
+                if context is not None:
+                    context.check_cancelled()
+                store_scene(scene, _detect_scene(scene["path"], scene["mask"], workers, target_resolution, max_pixels))
+                report_scenes(done)
+        else:
+            pool = get_process_pool(workers)
+            futures = [pool.submit(_detect_scene, scene["path"], scene["mask"], 1, target_resolution, max_pixels)
+                       for scene in pending]
+            try:
+                for done, (scene, future) in enumerate(zip(pending, futures), start=1):
+                    detected = future.result()
+                    if context is not None:
+                        context.check_cancelled()
+                    store_scene(scene, detected)
+                    report_scenes(done)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    except JobCancelledError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Detection failed: {str(e)}")
+    finally:
+        for scene in pending:
+            if scene.get("mask") and os.path.exists(scene["mask"]):
+                os.remove(scene["mask"])
+
+    entries = []
+    for done, scene in enumerate(scenes):
+        if context is not None:
+            span = CHANGE_PROGRESS[1] - CHANGE_PROGRESS[0]
+            context.report(CHANGE_PROGRESS[0] + span * done / len(scenes), "change", dates_done=done,
+                           dates_total=len(scenes))
+            context.check_cancelled()
+        current = store.get(aoi_id, scene["date"])
+        previous = store.previous(aoi_id, scene["date"])
+        entry = {"date": scene["date"], "scene_hash": scene["hash"], "reused": scene["reused"],
+                 "area_ha": current["area_ha"], "previous_date": previous["date"] if previous else None,
+                 "baseline": previous is None}
+        if previous is None:
+            entry.update(change_area_ha=None, new_area_ha=None, grown_area_ha=None, change_polygons=0,
+                         change_geojson=None)
+        else:
+            change = change_frame(store.mask_path(aoi_id, scene["date"]), store.mask_path(aoi_id, previous["date"]),
+                                  context=context)
+            grown = change["kind"] == "grown"
+            entry.update(
+                change_area_ha=float(change["area_ha"].sum()),
+                new_area_ha=float(change.loc[~grown, "area_ha"].sum()),
+                grown_area_ha=float(change.loc[grown, "area_ha"].sum()),
+                change_polygons=int(len(change)),
+                change_geojson=geojson_bytes_from_gdf(change) if include_geometry else None,
+            )
+        entries.append(entry)
+
+    return {
+        "aoi_id": aoi_id,
+        "dates": entries,
+        "change_area_ha": float(sum(entry["change_area_ha"] or 0.0 for entry in entries)),
+        "grid": store.get(aoi_id, scenes[-1]["date"])["grid"],
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Detect mining on a stack of co-registered scenes of one AOI and report the change per date.")
+    parser.add_argument("--aoi", required=True, help="AOI id the per-date masks are stored under")
+    parser.add_argument("--scene", nargs=2, action="append", metavar=("DATE", "PATH"), required=True,
+                        help="Acquisition date (YYYY-MM-DD) and GeoTIFF of one scene; repeat per scene")
+    parser.add_argument("--store", help="Mask store directory (default: TERRAVIGIL_MASK_DIR)")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: TERRAVIGIL_WORKERS; 0 = one per CPU)")
+    parser.add_argument("--target-resolution", type=float, help="Quick-look ground resolution in CRS units")
+    parser.add_argument("--max-pixels", type=int, help="Quick-look pixel budget per scene")
+    parser.add_argument("--no-geometry", action="store_true", help="Report change areas only, without polygons")
+    parser.add_argument("--output", help="Write the JSON result here instead of stdout")
+    args = parser.parse_args(argv)
+
+    result = run_time_series(
+        args.aoi, [{"date": date, "path": path} for date, path in args.scene],
+        store=MaskStore(args.store) if args.store else None, workers=args.workers,
+        target_resolution=args.target_resolution, max_pixels=args.max_pixels, include_geometry=not args.no_geometry)
+    data = dumps(result)
+    if args.output:
+        with open(args.output, "wb") as out:
+            out.write(data)
+    else:
+        sys.stdout.buffer.write(data + b"\n")
+    for entry in result["dates"]:
+        change = "baseline" if entry["baseline"] else f"+{entry['change_area_ha']:.2f} ha"
+        print(f"{entry['date']}: {entry['area_ha']:.2f} ha disturbed, {change}"
+              f"{' (reused)' if entry['reused'] else ''}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
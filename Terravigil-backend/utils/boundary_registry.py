@@ -0,0 +1,247 @@
+import os
+import re
+import json
+import time
+import hashlib
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import geopandas as gpd
+import pyogrio
+import pyogrio.errors
+import shapely
+from shapely.strtree import STRtree
+
+from utils.geo_utils import load_shapefile_from_zip
+from utils.geojson_io import geojson_frame
+
+
+BOUNDARY_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+_VERSION_FILE = re.compile(r"^v(\d+)\.")
+# Attempts of get() when the version it read is replaced before its files are opened
+LOAD_ATTEMPTS = 3
+
+
+def build_lease_index(boundary: gpd.GeoDataFrame, with_union: bool = False) -> Dict[str, Any]:
+    """Exploded lease parcels with an STRtree, attribute records and (optionally) their prepared union."""
+    boundary = boundary.explode(index_parts=False, ignore_index=True)
+    geoms = np.asarray(boundary.geometry.values, dtype=object)
+    attrs = boundary.drop(columns=boundary.geometry.name)
+    # to_dict("records") yields nothing for a frame without columns
+    records = attrs.to_dict("records") if len(attrs.columns) else [{} for _ in range(len(attrs))]
+    index = {
+        "crs": boundary.crs,
+        "geoms": geoms,
+        "tree": STRtree(geoms),
+        "records": records,
+        "columns": set(attrs.columns),
+        "union": None,
+    }
+    if with_union:
+        union = shapely.union_all(geoms)
+        shapely.prepare(union)
+        index["union"] = union
+    return index
+
+
+class BoundaryRegistry:
+    """Lease boundary datasets registered once under an id and reused by every boundary check.
+
+    Each registration is parsed, optionally reprojected, exploded and unioned once, then stored
+    under `directory/<id>/` as FlatGeobuf (the parcels, in order) plus the union as WKB, with a
+    metadata file. Nothing is unpickled, and the directory is private to the server's user. Re-registering different content bumps the
+    version (identical content keeps it). The previous version's files stay on disk until the next
+    registration, so readers that looked up the old version can still open it. Indexed datasets are
+    kept in memory per process, up to max_loaded of them, and reloaded when another process
+    registers a newer version.
+    """
+
+    def __init__(self, directory: str, max_loaded: int = 8):
+        self.directory = directory
+        self.max_loaded = max(1, max_loaded)
+        self._loaded: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = Lock()
+        self._make_private(directory)
+
+    @staticmethod
+    def _make_private(directory: str):
+        # The default lives in the shared temp dir: refuse a directory someone else created there
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if hasattr(os, "getuid"):
+            if os.stat(directory).st_uid != os.getuid():
+                raise RuntimeError(f"Boundary directory {directory} is owned by another user")
+            os.chmod(directory, 0o700)
+
+    def _meta_path(self, boundary_id: str) -> str:
+        return os.path.join(self.directory, boundary_id, "meta.json")
+
+    def _data_path(self, boundary_id: str, version: int) -> str:
+        return os.path.join(self.directory, boundary_id, f"v{version}.fgb")
+
+    def _union_path(self, boundary_id: str, version: int) -> str:
+        return os.path.join(self.directory, boundary_id, f"v{version}.union.wkb")
+
+    @staticmethod
+    def _check_id(boundary_id: str):
+        if not BOUNDARY_ID_PATTERN.match(boundary_id or ""):
+            raise ValueError("boundary_id must be 1-64 characters of letters, digits, '.', '_' or '-'")
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _write_frame(path: str, boundary: gpd.GeoDataFrame):
+        # GDAL writes a directory of layers unless the name ends in .fgb
+        tmp_path = f"{os.path.splitext(path)[0]}.part.fgb"
+        try:
+            # No spatial index, so FlatGeobuf keeps the parcel order (lease_index refers to it)
+            pyogrio.write_dataframe(boundary, tmp_path, driver="FlatGeobuf", SPATIAL_INDEX="NO")
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def metadata(self, boundary_id: str) -> Optional[Dict[str, Any]]:
+        self._check_id(boundary_id)
+        try:
+            with open(self._meta_path(boundary_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def list(self) -> List[Dict[str, Any]]:
+        metas = []
+        for name in sorted(os.listdir(self.directory)):
+            if BOUNDARY_ID_PATTERN.match(name):
+                meta = self.metadata(name)
+                if meta is not None:
+                    metas.append(meta)
+        return metas
+
+    def register(self, boundary_id: str, boundary_path: Optional[str] = None,
+                 boundary_geojson: Optional[Dict[str, Any]] = None, target_crs: Optional[str] = None) -> Dict[str, Any]:
+        """Parse and index a boundary dataset (zipped shapefile or GeoJSON) under boundary_id.
+
+        target_crs reprojects the leases once here, so checks against mining polygons in that CRS
+        skip the per-request reprojection. Returns the dataset metadata.
+        """
+        self._check_id(boundary_id)
+        hasher = hashlib.sha256()
+        if boundary_geojson is not None:
+            hasher.update(json.dumps(boundary_geojson, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+            # Honours a named CRS member (as our own legal/illegal GeoJSON carries); otherwise WGS84
+            boundary = geojson_frame(boundary_geojson)
+        elif boundary_path is not None:
+            with open(boundary_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    hasher.update(chunk)
+            boundary = load_shapefile_from_zip(boundary_path)
+        else:
+            raise ValueError("Either boundary_path (zip) or boundary_geojson must be provided")
+        hasher.update(str(target_crs).encode("utf-8"))
+        content_hash = hasher.hexdigest()
+
+        previous = self.metadata(boundary_id)
+        if previous is not None and previous.get("content_hash") == content_hash:
+            return previous
+
+        if boundary.crs is None:
+            boundary = boundary.set_crs(4326, allow_override=True)
+        if target_crs:
+            boundary = boundary.to_crs(target_crs)
+        boundary = boundary.explode(index_parts=False, ignore_index=True)
+        union = shapely.union_all(np.asarray(boundary.geometry.values, dtype=object))
+
+        version = (previous or {}).get("version", 0) + 1
+        os.makedirs(os.path.join(self.directory, boundary_id), mode=0o700, exist_ok=True)
+        self._write_frame(self._data_path(boundary_id, version), boundary)
+        self._write_atomic(self._union_path(boundary_id, version), shapely.to_wkb(union))
+        meta = {
+            "boundary_id": boundary_id,
+            "version": version,
+            "content_hash": content_hash,
+            "crs": boundary.crs.to_string() if boundary.crs is not None else None,
+            "parcels": int(len(boundary)),
+            "bounds": [float(v) for v in boundary.total_bounds] if len(boundary) else None,
+            "registered_at": time.time(),
+        }
+        self._write_atomic(self._meta_path(boundary_id), json.dumps(meta).encode("utf-8"))
+        # Versions before the previous one: anyone still reading those looked them up two registrations ago
+        folder = os.path.join(self.directory, boundary_id)
+        for name in os.listdir(folder):
+            match = _VERSION_FILE.match(name)
+            if match and int(match.group(1)) < version - 1:
+                try:
+                    os.remove(os.path.join(folder, name))
+                except OSError:
+                    pass
+        with self._lock:
+            self._loaded.pop(boundary_id, None)
+        return meta
+
+    def get(self, boundary_id: str) -> Dict[str, Any]:
+        """Lease index (see build_lease_index) of the current version, plus 'boundary_id' and 'version'."""
+        for attempt in range(LOAD_ATTEMPTS):
+            meta = self.metadata(boundary_id)
+            if meta is None:
+                raise KeyError(f"Unknown boundary_id: {boundary_id}")
+            with self._lock:
+                index = self._loaded.get(boundary_id)
+                if index is not None and index["version"] == meta["version"]:
+                    self._loaded.move_to_end(boundary_id)
+                    return index
+            try:
+                with open(self._union_path(boundary_id, meta["version"]), "rb") as f:
+                    union = shapely.from_wkb(f.read())
+                frame = pyogrio.read_dataframe(self._data_path(boundary_id, meta["version"]))
+                break
+            except (OSError, pyogrio.errors.DataSourceError):
+                # Registrations in between removed this version: read the current one instead
+                latest = self.metadata(boundary_id)
+                if attempt == LOAD_ATTEMPTS - 1 or latest is None or latest["version"] == meta["version"]:
+                    raise
+        index = build_lease_index(frame)
+        shapely.prepare(union)
+        index.update(union=union, boundary_id=boundary_id, version=meta["version"])
+
+        with self._lock:
+            self._loaded[boundary_id] = index
+            self._loaded.move_to_end(boundary_id)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+        return index
+
+    def delete(self, boundary_id: str) -> bool:
+        meta = self.metadata(boundary_id)
+        with self._lock:
+            self._loaded.pop(boundary_id, None)
+        if meta is None:
+            return False
+        folder = os.path.join(self.directory, boundary_id)
+        for name in os.listdir(folder):
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
+        return True
+
+
+def boundary_registry_from_env() -> BoundaryRegistry:
+    """Registry stored in TERRAVIGIL_BOUNDARY_DIR (default: terravigil-boundaries in the system temp dir)."""
+    directory = os.environ.get("TERRAVIGIL_BOUNDARY_DIR") or os.path.join(tempfile.gettempdir(), "terravigil-boundaries")
+    return BoundaryRegistry(directory, max_loaded=int(os.environ.get("TERRAVIGIL_BOUNDARY_MAX_LOADED", 8)))
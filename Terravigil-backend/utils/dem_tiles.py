@@ -0,0 +1,191 @@
+import os
+import re
+import math
+import tempfile
+import urllib.parse
+import urllib.request
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import rasterio
+from pyproj import CRS
+from rasterio.merge import merge
+from rasterio.transform import Affine, array_bounds
+from rasterio.warp import Resampling, calculate_default_transform, reproject
+
+from utils.metrics import stage
+
+
+OPENTOPOGRAPHY_URL = "https://portal.opentopography.org/API/globaldem"
+# 0.1 degree tiles: roughly 370 x 370 pixels of COP30, small enough that a mine rarely pulls more than 4
+DEFAULT_TILE_DEG = 0.1
+# OpenTopography dataset names (COP30, SRTMGL1, SRTMGL3, NASADEM, ...); they also name cache subdirectories
+DEMTYPE_PATTERN = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+def check_demtype(demtype: str) -> str:
+    """demtype if it looks like an OpenTopography dataset name, else ValueError (it becomes a path)."""
+    if not isinstance(demtype, str) or not DEMTYPE_PATTERN.match(demtype):
+        raise ValueError("demtype must be an OpenTopography dataset name such as COP30, SRTMGL1 or SRTMGL3")
+    return demtype
+
+
+class DemTileStore:
+    """Persistent cache of DEM tiles on a fixed lon/lat grid, one subdirectory per demtype.
+
+    A bbox request downloads only the grid tiles that are not on disk yet, then mosaics the
+    covering tiles clipped to the bbox. Tiles are evicted least recently used (by mtime)
+    once the store exceeds max_bytes.
+    """
+
+    def __init__(self, directory: str, tile_deg: float = DEFAULT_TILE_DEG,
+                 max_bytes: int = 5 * 1024 * 1024 * 1024, base_url: str = OPENTOPOGRAPHY_URL,
+                 api_key: Optional[str] = None):
+        self.directory = directory
+        self.tile_deg = tile_deg
+        self.max_bytes = max_bytes
+        self.base_url = base_url
+        self.api_key = api_key
+        self._locks: Dict[str, Lock] = {}
+        self._locks_guard = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def tile_indices(self, west: float, south: float, east: float, north: float) -> List[Tuple[int, int]]:
+        size = self.tile_deg
+        x0, x1 = math.floor(west / size), max(math.floor(west / size), math.ceil(east / size) - 1)
+        y0, y1 = math.floor(south / size), max(math.floor(south / size), math.ceil(north / size) - 1)
+        return [(ix, iy) for iy in range(y0, y1 + 1) for ix in range(x0, x1 + 1)]
+
+    def tile_bounds(self, ix: int, iy: int) -> Tuple[float, float, float, float]:
+        # Rounded so neighbouring tiles share exactly the same edge coordinates
+        size = self.tile_deg
+        return (round(ix * size, 9), round(iy * size, 9), round((ix + 1) * size, 9), round((iy + 1) * size, 9))
+
+    def tile_path(self, demtype: str, ix: int, iy: int) -> str:
+        return os.path.join(self.directory, check_demtype(demtype), f"{ix}_{iy}.tif")
+
+    def _tile_lock(self, path: str) -> Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(path, Lock())
+
+    def _tile_url(self, demtype: str, ix: int, iy: int) -> str:
+        west, south, east, north = self.tile_bounds(ix, iy)
+        params = {"demtype": demtype, "west": west, "south": south, "east": east, "north": north,
+                  "outputFormat": "GTiff"}
+        if self.api_key:
+            params["API_Key"] = self.api_key
+        return f"{self.base_url}?{urllib.parse.urlencode(params)}"
+
+    def fetch_tile(self, demtype: str, ix: int, iy: int) -> str:
+        """Return the local path of a tile, downloading it only if it is not cached."""
+        path = self.tile_path(demtype, ix, iy)
+        with self._tile_lock(path):
+            if os.path.exists(path):
+                # mtime doubles as the LRU clock for eviction
+                os.utime(path, None)
+                return path
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+            os.close(fd)
+            try:
+                with stage("dem_download") as counts:
+                    urllib.request.urlretrieve(self._tile_url(demtype, ix, iy), tmp_path)
+                    counts["bytes_read"] = os.path.getsize(tmp_path)
+                if os.path.getsize(tmp_path) == 0:
+                    raise RuntimeError("Downloaded DEM tile is empty")
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return path
+
+    def build_mosaic(self, west: float, south: float, east: float, north: float, demtype: str = "COP30",
+                     directory: Optional[str] = None, dst_crs: Any = None) -> str:
+        """Mosaic the cached tiles covering the bbox into a temporary GeoTIFF clipped to it.
+
+        Tiles are lon/lat; pass a projected dst_crs to warp the mosaic (bilinear) into metre pixels
+        before anything measures volumes on it.
+        """
+        indices = self.tile_indices(west, south, east, north)
+        paths = [self.fetch_tile(demtype, ix, iy) for ix, iy in indices]
+
+        datasets = [rasterio.open(p) for p in paths]
+        try:
+            profile = datasets[0].profile
+            with stage("dem_mosaic") as counts:
+                mosaic, transform = merge(datasets, bounds=(west, south, east, north))
+                counts["bytes_read"], counts["pixels"] = mosaic.nbytes, mosaic[0].size
+        finally:
+            for ds in datasets:
+                ds.close()
+
+        if dst_crs is not None and CRS.from_user_input(dst_crs) != CRS.from_user_input(profile["crs"]):
+            mosaic, transform = self._warp(mosaic, transform, profile, dst_crs)
+            profile["crs"] = dst_crs
+        profile.update(driver="GTiff", height=mosaic.shape[1], width=mosaic.shape[2], count=mosaic.shape[0],
+                       transform=transform, tiled=False)
+        profile.pop("blockxsize", None)
+        profile.pop("blockysize", None)
+        fd, out_path = tempfile.mkstemp(suffix=".tif", dir=directory)
+        os.close(fd)
+        with rasterio.open(out_path, "w", **profile) as dst:
+            dst.write(mosaic)
+
+        self.evict(keep=set(paths))
+        return out_path
+
+    @staticmethod
+    def _warp(mosaic: np.ndarray, transform: Affine, profile: Dict[str, Any], dst_crs: Any) -> Tuple[np.ndarray, Affine]:
+        count, height, width = mosaic.shape
+        if profile.get("nodata") is None:
+            # The corners outside the warped bbox need a value nothing mistakes for elevation
+            profile["nodata"] = np.nan if np.issubdtype(mosaic.dtype, np.floating) else np.iinfo(mosaic.dtype).min
+        with stage("dem_warp") as counts:
+            dst_transform, dst_width, dst_height = calculate_default_transform(
+                profile["crs"], dst_crs, width, height, *array_bounds(height, width, transform))
+            warped = np.full((count, dst_height, dst_width), profile["nodata"], dtype=mosaic.dtype)
+            reproject(mosaic, warped, src_transform=transform, src_crs=profile["crs"], dst_transform=dst_transform,
+                      dst_crs=dst_crs, src_nodata=profile["nodata"], dst_nodata=profile["nodata"],
+                      resampling=Resampling.bilinear)
+            counts["pixels"] = warped[0].size
+        return warped, dst_transform
+
+    def evict(self, keep: Optional[set] = None):
+        keep = keep or set()
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".tif"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+def dem_tile_store_from_env() -> DemTileStore:
+    """Store configured by TERRAVIGIL_DEM_CACHE_DIR, TERRAVIGIL_DEM_CACHE_MAX_BYTES, OPENTOPOGRAPHY_URL
+    and OPENTOPOGRAPHY_API_KEY."""
+    directory = os.environ.get("TERRAVIGIL_DEM_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "terravigil-dem-tiles")
+    return DemTileStore(
+        directory,
+        tile_deg=float(os.environ.get("TERRAVIGIL_DEM_TILE_DEG", DEFAULT_TILE_DEG)),
+        max_bytes=int(os.environ.get("TERRAVIGIL_DEM_CACHE_MAX_BYTES", 5 * 1024 * 1024 * 1024)),
+        base_url=os.environ.get("OPENTOPOGRAPHY_URL", OPENTOPOGRAPHY_URL),
+        api_key=os.environ.get("OPENTOPOGRAPHY_API_KEY") or None,
+    )
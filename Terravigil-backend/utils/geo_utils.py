@@ -1,74 +1,360 @@
 import os
 import io
 import json
+import hashlib
 import tempfile
-from typing import Tuple, Optional, Dict, Any
+import threading
+from typing import Tuple, Optional, Dict, Any, List
 
 import numpy as np
 import rasterio
-from rasterio.features import shapes
+from rasterio.features import shapes, geometry_window, rasterize
 from rasterio.transform import Affine
 from rasterio.mask import mask as rio_mask
+from rasterio.windows import Window
+from rasterio.errors import WindowError
 import geopandas as gpd
-from shapely.geometry import shape, mapping, Polygon, MultiPolygon
+from pyproj import CRS, Geod, Transformer
+import shapely
+from shapely.geometry import shape, mapping, box, Polygon, MultiPolygon
+from shapely.strtree import STRtree
 from fastapi import UploadFile
 
+from utils.geojson_io import RawJSON, feature_collection_bytes, loads as geojson_loads
+from utils.metrics import stage
 
-def load_raster(path: str):
+
+def load_raster(path: str, overview_level: Optional[int] = None):
+    # overview_level opens one internal overview as if it were the dataset; only that level is read
+    if overview_level is not None:
+        return rasterio.open(path, overview_level=overview_level)
     return rasterio.open(path)
 
 
-def save_upload_file_tmp(upload_file: UploadFile) -> str:
+def iter_block_windows(src: rasterio.io.DatasetReader, max_pixels: int = 4_194_304):
+    """Yield windows aligned to the dataset's native blocks, each holding at most ~max_pixels.
+
+    Blocks that are already large enough are yielded as-is; small blocks (e.g. one-row strips)
+    are grouped into block-aligned tiles so per-tile overhead stays low.
+    """
+    block_h, block_w = src.block_shapes[0]
+    block_pixels = block_h * block_w
+    if block_pixels >= max_pixels:
+        for _, window in src.block_windows(1):
+            yield window
+        return
+
+    # Grow tiles along the row first (cheap for strips), then down the columns
+    blocks_per_tile = max(1, max_pixels // block_pixels)
+    blocks_across = -(-src.width // block_w)
+    cols = min(blocks_per_tile, blocks_across)
+    rows = max(1, blocks_per_tile // cols)
+    tile_h, tile_w = block_h * rows, block_w * cols
+    for row_off in range(0, src.height, tile_h):
+        for col_off in range(0, src.width, tile_w):
+            yield Window(col_off, row_off, min(tile_w, src.width - col_off), min(tile_h, src.height - row_off))
+
+
+def _occupancy_clusters(boxes, members, gap: int, height: int, width: int):
+    """First clustering pass on a grid of gap-sized cells, so thousands of dense sites never become
+    an all-pairs overlap query; may merge boxes up to one cell further apart than `gap`."""
+    cell = max(1, gap)
+    rows, cols = -(-height // cell) + 2, -(-width // cell) + 2
+    occupied = np.zeros((rows, cols), dtype=np.uint8)
+    cells = []
+    for c0, r0, c1, r1 in boxes:
+        # Padded box in cell units, offset by one cell so padding at the raster edge stays in range
+        cr0, cc0 = int((r0 - gap) // cell) + 1, int((c0 - gap) // cell) + 1
+        cr1, cc1 = int((r1 + gap - 1) // cell) + 2, int((c1 + gap - 1) // cell) + 2
+        cr0, cc0, cr1, cc1 = max(cr0, 0), max(cc0, 0), min(cr1, rows), min(cc1, cols)
+        occupied[cr0:cr1, cc0:cc1] = 1
+        cells.append((cr0, cc0))
+
+    components = [geom for geom, _ in shapes(occupied, mask=occupied.astype(bool), connectivity=4)]
+    labels = rasterize([(geom, n) for n, geom in enumerate(components)], out_shape=occupied.shape,
+                       fill=-1, dtype="int32")
+
+    merged: Dict[int, Tuple[list, list]] = {}
+    for (cr0, cc0), bounds, idx in zip(cells, boxes, members):
+        group_bounds, group_idx = merged.setdefault(int(labels[cr0, cc0]), ([], []))
+        group_bounds.append(bounds)
+        group_idx.extend(idx)
+    new_boxes, new_members = [], []
+    for bounds, idx in merged.values():
+        arr = np.asarray(bounds)
+        new_boxes.append((arr[:, 0].min(), arr[:, 1].min(), arr[:, 2].max(), arr[:, 3].max()))
+        new_members.append(sorted(idx))
+    return new_boxes, new_members
+
+
+def cluster_geometry_windows(src: rasterio.io.DatasetReader, geometries, gap: int = 64) -> List[Tuple[Window, List[int]]]:
+    """Group geometries (in the dataset CRS) into clusters that each get one pixel window.
+
+    Geometries whose windows come within `gap` pixels of each other share a window, so scattered
+    sites are read as several small windows rather than one union bounding box. Returns
+    (window, member indices) pairs; geometries outside the raster are dropped.
+    """
+    with stage("cluster_windows") as counts:
+        counts["polygons"] = len(geometries)
+        return _cluster_geometry_windows(src, geometries, gap)
+
+
+def _cluster_geometry_windows(src: rasterio.io.DatasetReader, geometries, gap: int) -> List[Tuple[Window, List[int]]]:
+    boxes, members = [], []
+    for i, geom in enumerate(geometries):
+        if geom is None or geom.is_empty:
+            continue
+        try:
+            win = geometry_window(src, [geom])
+        except WindowError:
+            continue
+        if win.width < 1 or win.height < 1:
+            continue
+        boxes.append((win.col_off, win.row_off, win.col_off + win.width, win.row_off + win.height))
+        members.append([i])
+
+    if len(boxes) > 1:
+        boxes, members = _occupancy_clusters(boxes, members, gap, src.height, src.width)
+
+    # Merge clusters until no two padded cluster boxes touch; repeat because a merged box can reach new neighbours
+    while len(boxes) > 1:
+        tree = STRtree([box(c0 - gap, r0 - gap, c1 + gap, r1 + gap) for c0, r0, c1, r1 in boxes])
+        left, right = tree.query(tree.geometries, predicate="intersects")
+        parent = list(range(len(boxes)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for a, b in zip(left, right):
+            ra, rb = find(int(a)), find(int(b))
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+        roots = [find(i) for i in range(len(boxes))]
+        if len(set(roots)) == len(boxes):
+            break
+        merged: Dict[int, Tuple[list, list]] = {}
+        for i, root in enumerate(roots):
+            bounds, idx = merged.setdefault(root, ([], []))
+            bounds.append(boxes[i])
+            idx.extend(members[i])
+        boxes, members = [], []
+        for bounds, idx in merged.values():
+            arr = np.asarray(bounds)
+            boxes.append((arr[:, 0].min(), arr[:, 1].min(), arr[:, 2].max(), arr[:, 3].max()))
+            members.append(sorted(idx))
+
+    return [
+        (Window(int(c0), int(r0), int(c1 - c0), int(r1 - r0)), idx)
+        for (c0, r0, c1, r1), idx in zip(boxes, members)
+    ]
+
+
+# Uploads are copied in fixed-size chunks so memory stays constant regardless of file size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = 1024 * 1024 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    pass
+
+
+def scratch_dir() -> Optional[str]:
+    """Directory for temporary uploads/downloads: TERRAVIGIL_SCRATCH_DIR, else the system temp dir."""
+    path = os.environ.get("TERRAVIGIL_SCRATCH_DIR")
+    if path:
+        os.makedirs(path, exist_ok=True)
+    return path or None
+
+
+def stream_upload_to_tmp(upload_file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES,
+                         directory: Optional[str] = None) -> Tuple[str, str]:
+    """Copy an upload to a temp file chunk by chunk, returning (path, sha256 hex digest).
+
+    Raises UploadTooLargeError as soon as more than max_bytes have been seen; the partial file is removed.
+    """
+    size = getattr(upload_file, "size", None)
+    if size is not None and size > max_bytes:
+        raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+
     suffix = os.path.splitext(upload_file.filename or "upload.bin")[1]
-    fd, tmp_path = tempfile.mkstemp(suffix=suffix)
-    with os.fdopen(fd, "wb") as out:
-        out.write(upload_file.file.read())
+    fd, tmp_path = tempfile.mkstemp(suffix=suffix, dir=directory or scratch_dir())
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        with stage("upload") as counts, os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = upload_file.file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                counts["bytes_read"] = written
+                if written > max_bytes:
+                    raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except Exception:
+            pass
+        raise
+    return tmp_path, digest.hexdigest()
+
+
+def hash_file(path: str) -> str:
+    """sha256 hex digest of a local file, read in upload-sized chunks (same value stream_upload_to_tmp gives)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_upload_file_tmp(upload_file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES,
+                         directory: Optional[str] = None) -> str:
+    tmp_path, _ = stream_upload_to_tmp(upload_file, max_bytes=max_bytes, directory=directory)
     return tmp_path
 
 
-def raster_mask_to_polygons(mask: np.ndarray, transform: Affine, crs: Any) -> Dict[str, Any]:
-    mask = mask.astype(np.uint8)
-    results = []
-    for geom, val in shapes(mask, mask=mask.astype(bool), transform=transform):
-        if val == 1:
-            results.append({
-                "type": "Feature",
-                "properties": {},
-                "geometry": geom
-            })
-    geojson = {"type": "FeatureCollection", "features": results}
-    # Clean invalid geometries via GeoPandas buffer(0)
-    if len(results) > 0:
-        gdf = gpd.GeoDataFrame.from_features(results, crs=crs)
-        gdf["geometry"] = gdf["geometry"].buffer(0)
-        return geojson_from_gdf(gdf)
-    return geojson
+def pixel_geometries_to_gdf(geometries, transform: Affine, crs: Any) -> gpd.GeoDataFrame:
+    """Build a GeoDataFrame from polygons in pixel (col, row) space, mapping them through `transform`."""
+    gdf = gpd.GeoDataFrame(geometry=list(geometries), crs=crs)
+    if gdf.empty:
+        return gdf
+    with stage("georeference") as counts:
+        counts["polygons"] = len(gdf)
+        world = gdf.geometry.affine_transform(transform.to_shapely())
+    # Clean invalid geometries via buffer(0) once they are in world coordinates
+    with stage("buffer0") as counts:
+        counts["polygons"] = len(gdf)
+        gdf["geometry"] = world.buffer(0)
+    return gdf
 
 
 def load_shapefile_from_zip(zip_path: str) -> gpd.GeoDataFrame:
     # geopandas can read from zip file directly using the path with 'zip://' prefix
-    return gpd.read_file(f"zip://{zip_path}")
+    with stage("boundary_read") as counts:
+        counts["bytes_read"] = os.path.getsize(zip_path)
+        gdf = gpd.read_file(f"zip://{zip_path}")
+        counts["polygons"] = len(gdf)
+    return gdf
+
+
+def geojson_from_gdf(gdf: gpd.GeoDataFrame, precision: Optional[int] = None) -> Dict[str, Any]:
+    return geojson_loads(feature_collection_bytes(gdf, precision))
+
+
+def geojson_bytes_from_gdf(gdf: gpd.GeoDataFrame, precision: Optional[int] = None) -> RawJSON:
+    """FeatureCollection of the polygon parts, encoded once and kept as bytes for the response."""
+    with stage("geojson_encode") as counts:
+        counts["polygons"] = len(gdf)
+        return RawJSON(feature_collection_bytes(gdf, precision))
+
+
+# World Cylindrical Equal Area: areas are measured here unless the geodesic method is asked for
+AREA_CRS = 6933
+AREA_METHODS = ("equal_area", "geodesic")
+
+_transformers = threading.local()
+_WGS84_GEOD = Geod(ellps="WGS84")
+
+
+def _crs_key(crs: Any) -> str:
+    if isinstance(crs, CRS):
+        return crs.srs or crs.to_wkt()
+    return str(crs)
 
 
-def geojson_from_gdf(gdf: gpd.GeoDataFrame) -> Dict[str, Any]:
-    gdf = gdf.explode(index_parts=False, ignore_index=True)
-    return json.loads(gdf.to_json())
+def get_transformer(src_crs: Any, dst_crs: Any) -> Transformer:
+    """Cached always_xy transformer per CRS pair (per thread, as pyproj transformers are not shareable)."""
+    cache = getattr(_transformers, "cache", None)
+    if cache is None:
+        cache = _transformers.cache = {}
+    key = (_crs_key(src_crs), _crs_key(dst_crs))
+    transformer = cache.get(key)
+    if transformer is None:
+        transformer = cache[key] = Transformer.from_crs(src_crs, dst_crs, always_xy=True)
+    return transformer
+
+
+def feature_areas_m2(gdf: gpd.GeoDataFrame, method: str = "equal_area") -> np.ndarray:
+    """Ground area (m²) of every row of gdf, in row order; missing geometries count as 0.
+
+    equal_area moves all vertices to EPSG:6933 in one transformer call over the flat coordinate array
+    and measures them there; geodesic measures each geometry on the WGS84 ellipsoid (exact, slower).
+    A frame without a CRS is taken as EPSG:4326. The frame itself is never copied or reprojected.
+    Raises ValueError when an area is not finite, e.g. for projected coordinates in a geographic CRS.
+    """
+    if method not in AREA_METHODS:
+        raise ValueError(f"method must be one of {', '.join(AREA_METHODS)}")
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+    if geoms.size == 0:
+        return np.zeros(0, dtype=np.float64)
+    crs = gdf.crs if gdf.crs is not None else CRS.from_epsg(4326)
+
+    if method == "geodesic":
+        if not crs.is_geographic or crs.to_epsg() != 4326:
+            geoms = _transform_geometries(geoms, get_transformer(crs, 4326))
+        with stage("geodesic_area") as counts:
+            counts["polygons"] = len(geoms)
+            areas = np.array([abs(_WGS84_GEOD.geometry_area_perimeter(g)[0]) if g is not None and not g.is_empty
+                              else 0.0 for g in geoms], dtype=np.float64)
+        return _checked_areas(areas, crs)
+
+    if crs.to_epsg() != AREA_CRS:
+        try:
+            geoms = _transform_geometries(geoms, get_transformer(crs, AREA_CRS))
+        except Exception:
+            # fallback to Web Mercator
+            geoms = _transform_geometries(geoms, get_transformer(crs, 3857))
+    with np.errstate(invalid="ignore"):
+        areas = shapely.area(geoms)
+    # Missing geometries have no area; anything else that is not finite failed to reproject
+    areas[shapely.is_missing(geoms)] = 0.0
+    return _checked_areas(areas, crs)
+
+
+def _checked_areas(areas: np.ndarray, crs: CRS) -> np.ndarray:
+    bad = int(np.count_nonzero(~np.isfinite(areas)))
+    if bad:
+        # Typically projected coordinates labelled with a geographic CRS
+        raise ValueError(f"Area of {bad} of {len(areas)} geometries is not finite; "
+                         f"their coordinates do not fit {crs.to_string()}")
+    return areas
+
+
+def _transform_geometries(geoms: np.ndarray, transformer: Transformer) -> np.ndarray:
+    def project(coords):
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack([x, y])
+    with stage("reproject") as counts:
+        counts["polygons"] = len(geoms)
+        return shapely.transform(geoms, project)
 
 
 def calculate_area_ha(gdf: gpd.GeoDataFrame) -> float:
     if gdf.empty:
         return 0.0
-    # Reproject to equal-area projection if geographic
-    if gdf.crs is None:
-        # assume EPSG:4326 and project to World Cylindrical Equal Area
-        gdf = gdf.set_crs(4326, allow_override=True)
-    try:
-        area_gdf = gdf.to_crs(6933)  # World Cylindrical Equal Area
-    except Exception:
-        # fallback to Web Mercator
-        area_gdf = gdf.to_crs(3857)
-    area_m2 = area_gdf.geometry.area.sum()
-    return float(area_m2 / 10000.0)
+    return float(feature_areas_m2(gdf).sum() / 10000.0)
+
+
+def pixel_row_areas(transform: Affine, crs, row_off: int, height: int) -> np.ndarray:
+    """Ground area (m²) of one pixel in each of `height` rows starting at row_off of a north-up grid.
+
+    Geographic grids shrink towards the poles, so each row is measured in EPSG:6933 (the equal-area
+    CRS calculate_area_ha uses); projected grids have a constant pixel area.
+    """
+    if crs is None or not CRS.from_user_input(crs).is_geographic:
+        return np.full(height, abs(transform.a * transform.e - transform.b * transform.d), dtype=np.float64)
+    transformer = get_transformer(crs, AREA_CRS)
+    lat_edges = np.clip(transform.f + transform.e * (row_off + np.arange(height + 1)), -90.0, 90.0)
+    _, y = transformer.transform(np.full(height + 1, transform.c), lat_edges)
+    # x in a cylindrical projection depends only on longitude: every pixel in a row has the same width
+    x, _ = transformer.transform(np.array([transform.c, transform.c + transform.a]), np.zeros(2))
+    return np.abs(np.diff(y)) * abs(x[1] - x[0])
 
 
 def mask_raster_with_geojson(src: rasterio.io.DatasetReader, mask_geojson: Dict[str, Any], crop: bool = True):
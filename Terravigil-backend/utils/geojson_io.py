@@ -0,0 +1,158 @@
+import os
+import re
+import json
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder produces the same JSON, only slower
+    orjson = None
+
+
+def _precision_from_env() -> Optional[int]:
+    value = os.environ.get("TERRAVIGIL_GEOJSON_PRECISION", "")
+    return int(value) if value.strip() else None
+
+
+# Decimal places kept in serialized coordinates; None keeps full float precision
+COORDINATE_PRECISION = _precision_from_env()
+
+# Rows encoded per vectorized batch by iter_features
+FEATURE_BATCH_ROWS = 50_000
+
+_EMPTY_COLLECTION = b'{"type": "FeatureCollection", "features": []}'
+
+
+class RawJSON:
+    """Already-encoded JSON that dumps() splices into its output verbatim.
+
+    Results carry their GeoJSON this way so it is written once, straight from the geometries,
+    and never parsed back into dicts on its way to the cache, the task store or the response.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __getstate__(self):
+        return self.data
+
+    def __setstate__(self, state):
+        self.data = state
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def loads(self) -> Any:
+        return loads(self.data)
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _encode(value: Any, default) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, default=default)
+    return json.dumps(value, default=default, ensure_ascii=False).encode("utf-8")
+
+
+def dumps(value: Any) -> bytes:
+    """Encode to JSON bytes with the fastest available encoder, splicing in RawJSON fragments."""
+    if isinstance(value, RawJSON):
+        return value.data
+    fragments = []
+    # Fragments are encoded as unique placeholder strings, then swapped for their bytes in one pass
+    token = uuid.uuid4().hex
+
+    def default(obj):
+        if isinstance(obj, RawJSON):
+            fragments.append(obj.data)
+            return f"\ue000{token}:{len(fragments) - 1}\ue001"
+        return _default(obj)
+
+    data = _encode(value, default)
+    if not fragments:
+        return data
+    pattern = re.compile(b'"\xee\x80\x80' + token.encode("ascii") + b':(\\d+)\xee\x80\x81"')
+    return pattern.sub(lambda m: fragments[int(m.group(1))], data)
+
+
+def loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _crs_member(crs) -> str:
+    # Same named-CRS member gdf.to_json() adds for anything other than WGS84
+    if crs is None or crs.equals("epsg:4326"):
+        return ""
+    authority = crs.to_authority()
+    if authority is None or authority[0] not in ("EDCS", "EPSG", "OGC", "SI", "UCUM"):
+        return ""
+    return f', "crs": {{"type": "name", "properties": {{"name": "urn:ogc:def:crs:{authority[0]}::{authority[1]}"}}}}'
+
+
+def iter_features(gdf: gpd.GeoDataFrame, precision: Optional[int] = None,
+                  batch_size: int = FEATURE_BATCH_ROWS) -> Iterator[List[str]]:
+    """Feature JSON strings, one per polygon part, for batch_size rows of gdf at a time.
+
+    Coordinates go from shapely to text in one vectorized GEOS call per batch (after optional rounding
+    to `precision` decimals, default COORDINATE_PRECISION); attributes go through the fast encoder.
+    Feature ids count parts across batches, as explode() numbers them.
+    """
+    if precision is None:
+        precision = COORDINATE_PRECISION
+    next_id = 0
+    for start in range(0, len(gdf), batch_size):
+        batch = gdf.iloc[start:start + batch_size]
+        geoms = np.asarray(batch.geometry.values, dtype=object)
+        # One entry per part, like explode(); rows without geometry yield none
+        parts, owners = shapely.get_parts(geoms, return_index=True)
+        if precision is not None:
+            parts = shapely.transform(parts, lambda coords: np.round(coords, precision))
+        geometry_json = shapely.to_geojson(parts)
+        geometry_json[shapely.is_empty(parts)] = "null"
+
+        attrs = batch.drop(columns=batch.geometry.name)
+        if len(attrs.columns):
+            records = attrs.astype(object).where(pd.notna(attrs), None).to_dict("records")
+            properties = [_encode(records[i], _default).decode("utf-8") for i in owners]
+        else:
+            properties = ["{}"] * len(owners)
+
+        yield [
+            f'{{"id": "{n}", "type": "Feature", "properties": {props}, "geometry": {geom}}}'
+            for n, (props, geom) in enumerate(zip(properties, geometry_json), start=next_id)
+        ]
+        next_id += len(parts)
+
+
+def feature_collection_bytes(gdf: gpd.GeoDataFrame, precision: Optional[int] = None) -> bytes:
+    """GeoJSON FeatureCollection bytes with one feature per polygon part, in gdf.to_json() layout."""
+    if gdf.empty:
+        return _EMPTY_COLLECTION
+    features = ",".join(",".join(batch) for batch in iter_features(gdf, precision))
+    return f'{{"type": "FeatureCollection", "features": [{features}]{_crs_member(gdf.crs)}}}'.encode("utf-8")
+
+
+def geojson_frame(geojson: Optional[Dict[str, Any]], crs: Any = None) -> gpd.GeoDataFrame:
+    """GeoDataFrame of a result FeatureCollection, in its named CRS member, else `crs`, else WGS84."""
+    geojson = geojson or {}
+    crs = ((geojson.get("crs") or {}).get("properties") or {}).get("name") or crs or "EPSG:4326"
+    features = geojson.get("features", [])
+    if not features:
+        return gpd.GeoDataFrame(geometry=[], crs=crs)
+    return gpd.GeoDataFrame.from_features(features, crs=crs)
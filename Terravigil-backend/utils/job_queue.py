@@ -0,0 +1,251 @@
+import os
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# Lower value runs first; quick boundary checks should not wait behind scene-sized detections
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class SchedulerClosedError(Exception):
+    pass
+
+
+class JobCancelledError(Exception):
+    pass
+
+
+class JobContext:
+    """Handle passed into a running job for progress reports and cancellation checkpoints.
+
+    Picklable, so it crosses into the worker process; reports travel back over a manager queue.
+    Progress is throttled to one message per min_interval unless the stage changes or force is set.
+    """
+
+    def __init__(self, job_id: str, events=None, cancel_event=None, min_interval: float = 0.25,
+                 progress_range: Tuple[float, float] = (0.0, 100.0)):
+        self.job_id = job_id
+        self.events = events
+        self.cancel_event = cancel_event
+        self.min_interval = min_interval
+        self.progress_range = progress_range
+        self._last_report = 0.0
+        self._last_stage = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_last_report"], state["_last_stage"] = 0.0, None
+        return state
+
+    def sub_range(self, start: float, end: float) -> "JobContext":
+        """Context for one step of a multi-step job: its 0-100 progress maps onto start-end of this one."""
+        low, high = self.progress_range
+        span = (high - low) / 100.0
+        return JobContext(self.job_id, self.events, self.cancel_event, self.min_interval,
+                          (low + start * span, low + end * span))
+
+    def cancelled(self) -> bool:
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled():
+            raise JobCancelledError(f"Job {self.job_id} was cancelled")
+
+    def report(self, progress: float, stage: str, force: bool = False, **counters: Any):
+        self.check_cancelled()
+        if self.events is None:
+            return
+        now = time.monotonic()
+        if not force and stage == self._last_stage and now - self._last_report < self.min_interval:
+            return
+        self._last_report, self._last_stage = now, stage
+        low, high = self.progress_range
+        progress = low + (high - low) * progress / 100.0
+        self.events.put((self.job_id, {"progress": int(progress), "stage": stage, **counters}))
+
+
+class JobScheduler:
+    """Priority job queue drained by a bounded process pool.
+
+    `fn` runs in a worker process, so it and its arguments must be picklable; the callbacks run
+    in the API process on a dispatcher thread. submit() refuses work once max_queue jobs are waiting.
+    With with_context=True the job receives a JobContext as `context`, whose reports reach on_progress
+    and whose cancel flag is raised by cancel() while the job runs.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 16):
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        # Entries are (priority, sequence, job); the sequence keeps FIFO order within a priority
+        self._queue: "queue.PriorityQueue[Tuple[int, int, Optional[Dict[str, Any]]]]" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._queued: Dict[str, Dict[str, Any]] = {}
+        self._running: Dict[str, Dict[str, Any]] = {}
+        self._cancelled: set = set()
+        self._closed = False
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._threads = []
+        self._manager = None
+        self._events = None
+        self._cancel_events: Dict[str, Any] = {}
+
+    def _start(self):
+        # Caller holds the lock; pool and dispatchers are created on first use
+        if self._pool is not None:
+            return
+        ctx = multiprocessing.get_context("spawn")
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+        # Manager-backed queue/events are shareable with pool workers, unlike plain multiprocessing primitives
+        self._manager = ctx.Manager()
+        self._events = self._manager.Queue()
+        listener = threading.Thread(target=self._listen, name="job-progress-listener", daemon=True)
+        listener.start()
+        self._threads.append(listener)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._dispatch, name=f"job-dispatcher-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return len(self._queued)
+
+    def is_full(self) -> bool:
+        return self.queue_depth() >= self.max_queue
+
+    def submit(self, job_id: str, fn: Callable, *args, priority: int = PRIORITY_NORMAL,
+               on_start: Optional[Callable] = None, on_complete: Optional[Callable] = None,
+               on_error: Optional[Callable] = None, on_finally: Optional[Callable] = None,
+               on_progress: Optional[Callable] = None, with_context: bool = False, **kwargs):
+        with self._lock:
+            if self._closed:
+                raise SchedulerClosedError("Job scheduler is shutting down")
+            if len(self._queued) >= self.max_queue:
+                raise QueueFullError(f"Job queue is full ({self.max_queue} waiting)")
+            self._start()
+            if with_context:
+                cancel_event = self._manager.Event()
+                self._cancel_events[job_id] = cancel_event
+                kwargs["context"] = JobContext(job_id, self._events, cancel_event)
+            job = {
+                "job_id": job_id, "fn": fn, "args": args, "kwargs": kwargs, "on_start": on_start,
+                "on_complete": on_complete, "on_error": on_error, "on_finally": on_finally,
+                "on_progress": on_progress
+            }
+            self._queued[job_id] = job
+            self._queue.put((priority, next(self._seq), job))
+
+    def cancel(self, job_id: str) -> bool:
+        """Drop a queued job, or flag a running one so it stops at its next checkpoint.
+
+        Returns False if the job is unknown or finished.
+        """
+        with self._lock:
+            if job_id in self._queued:
+                del self._queued[job_id]
+                self._cancelled.add(job_id)
+                return True
+            if job_id in self._running:
+                cancel_event = self._cancel_events.get(job_id)
+                if cancel_event is not None:
+                    cancel_event.set()
+                return True
+            return False
+
+    def _listen(self):
+        while True:
+            try:
+                item = self._events.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            job_id, payload = item
+            with self._lock:
+                job = self._running.get(job_id)
+            if job is not None:
+                self._callback(job, "on_progress", payload)
+
+    @staticmethod
+    def _callback(job: Dict[str, Any], name: str, *args) -> Optional[Exception]:
+        """Run one of the job's callbacks; a failure is logged and returned, never raised into the thread."""
+        if not job[name]:
+            return None
+        try:
+            job[name](*args)
+        except Exception as e:
+            logger.exception("%s callback of job %s failed", name, job["job_id"])
+            return e
+        return None
+
+    def _dispatch(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                return
+            job_id = job["job_id"]
+            with self._lock:
+                if job_id in self._cancelled:
+                    self._cancelled.discard(job_id)
+                    skip = True
+                else:
+                    self._queued.pop(job_id, None)
+                    self._running[job_id] = job
+                    skip = False
+            if skip:
+                with self._lock:
+                    self._cancel_events.pop(job_id, None)
+                self._callback(job, "on_finally")
+                continue
+            try:
+                # A failing on_start or on_complete is reported to on_error like a failing job
+                error = self._callback(job, "on_start")
+                if error is None:
+                    try:
+                        result = self._pool.submit(job["fn"], *job["args"], **job["kwargs"]).result()
+                    except Exception as e:
+                        error = e
+                    else:
+                        error = self._callback(job, "on_complete", result)
+                if error is not None:
+                    self._callback(job, "on_error", error)
+            finally:
+                with self._lock:
+                    self._running.pop(job_id, None)
+                    self._cancel_events.pop(job_id, None)
+                self._callback(job, "on_finally")
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            threads, pool = list(self._threads), self._pool
+        for _ in threads:
+            # Stop sentinels sort after every real job
+            self._queue.put((1 << 30, next(self._seq), None))
+        if pool is not None:
+            self._events.put(None)
+            pool.shutdown(wait=False, cancel_futures=True)
+            self._manager.shutdown()
+
+
+def job_scheduler_from_env() -> JobScheduler:
+    """Scheduler sized by TERRAVIGIL_JOB_WORKERS (default 2) and TERRAVIGIL_JOB_QUEUE_DEPTH (default 16)."""
+    return JobScheduler(
+        workers=int(os.environ.get("TERRAVIGIL_JOB_WORKERS", 2)),
+        max_queue=int(os.environ.get("TERRAVIGIL_JOB_QUEUE_DEPTH", 16)),
+    )
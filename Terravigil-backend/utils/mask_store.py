@@ -0,0 +1,131 @@
+import os
+import re
+import json
+import time
+import tempfile
+from datetime import date as Date
+from typing import Any, Dict, List, Optional
+
+
+AOI_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+class MaskStore:
+    """Per-date detection masks of monitored areas, kept so each new scene is compared with the last one.
+
+    Every date of an AOI is a 1-bit deflate COG `directory/<aoi_id>/<date>.tif` (the rasterized,
+    cleaned detection) with a `<date>.json` beside it holding the scene hash, detection parameters,
+    footprint area and mask grid. Dates are ISO YYYY-MM-DD, so they sort chronologically as strings.
+    Each date has its own files, so jobs adding different dates to one AOI never rewrite shared state.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def check_id(aoi_id: str):
+        if not AOI_ID_PATTERN.match(aoi_id or ""):
+            raise ValueError("aoi_id must be 1-64 characters of letters, digits, '.', '_' or '-'")
+
+    @staticmethod
+    def check_date(value: str) -> str:
+        try:
+            return Date.fromisoformat(value).isoformat()
+        except (TypeError, ValueError):
+            raise ValueError(f"Dates must be ISO YYYY-MM-DD, got {value!r}")
+
+    def aoi_dir(self, aoi_id: str) -> str:
+        self.check_id(aoi_id)
+        return os.path.join(self.directory, aoi_id)
+
+    def mask_path(self, aoi_id: str, date: str) -> str:
+        return os.path.join(self.aoi_dir(aoi_id), f"{self.check_date(date)}.tif")
+
+    def _meta_path(self, aoi_id: str, date: str) -> str:
+        return os.path.join(self.aoi_dir(aoi_id), f"{self.check_date(date)}.json")
+
+    def temp_mask_path(self, aoi_id: str) -> str:
+        """Fresh path inside the AOI folder for a mask being written, so put() can rename it in place."""
+        folder = self.aoi_dir(aoi_id)
+        os.makedirs(folder, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tif")
+        os.close(fd)
+        return path
+
+    def get(self, aoi_id: str, date: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._meta_path(aoi_id, date), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def dates(self, aoi_id: str) -> List[str]:
+        folder = self.aoi_dir(aoi_id)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(name[:-len(".json")] for name in os.listdir(folder)
+                      if name.endswith(".json") and not name.startswith("."))
+
+    def previous(self, aoi_id: str, date: str) -> Optional[Dict[str, Any]]:
+        """Metadata of the latest stored date before `date`, or None when `date` would be the first."""
+        date = self.check_date(date)
+        for earlier in reversed(self.dates(aoi_id)):
+            if earlier < date:
+                return self.get(aoi_id, earlier)
+        return None
+
+    def put(self, aoi_id: str, date: str, mask_path: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+        """Move a written mask (see temp_mask_path) into place for `date` and record its metadata."""
+        date = self.check_date(date)
+        meta = dict(meta, aoi_id=aoi_id, date=date, stored_at=time.time())
+        os.replace(mask_path, self.mask_path(aoi_id, date))
+        # Metadata last: a date only shows up once its mask is complete
+        fd, tmp_path = tempfile.mkstemp(dir=self.aoi_dir(aoi_id), prefix=".", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as out:
+                json.dump(meta, out)
+            os.replace(tmp_path, self._meta_path(aoi_id, date))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return meta
+
+    def list(self) -> List[Dict[str, Any]]:
+        aois = []
+        for name in sorted(os.listdir(self.directory)):
+            if AOI_ID_PATTERN.match(name) and os.path.isdir(os.path.join(self.directory, name)):
+                dates = self.dates(name)
+                if dates:
+                    aois.append({"aoi_id": name, "dates": len(dates), "first_date": dates[0], "last_date": dates[-1]})
+        return aois
+
+    def delete(self, aoi_id: str, date: Optional[str] = None) -> bool:
+        """Remove one date, or the whole AOI when date is None; False if there was nothing to remove."""
+        dates = [self.check_date(date)] if date is not None else self.dates(aoi_id)
+        removed = False
+        for day in dates:
+            for path in (self._meta_path(aoi_id, day), self.mask_path(aoi_id, day)):
+                try:
+                    os.remove(path)
+                    removed = True
+                except OSError:
+                    pass
+        if date is None:
+            folder = self.aoi_dir(aoi_id)
+            if os.path.isdir(folder):
+                for name in os.listdir(folder):
+                    try:
+                        os.remove(os.path.join(folder, name))
+                    except OSError:
+                        pass
+                try:
+                    os.rmdir(folder)
+                except OSError:
+                    pass
+        return removed
+
+
+def mask_store_from_env() -> MaskStore:
+    """Store kept in TERRAVIGIL_MASK_DIR (default: terravigil-masks in the system temp dir)."""
+    return MaskStore(os.environ.get("TERRAVIGIL_MASK_DIR") or os.path.join(tempfile.gettempdir(), "terravigil-masks"))
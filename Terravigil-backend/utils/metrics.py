@@ -0,0 +1,280 @@
+import os
+import sys
+import time
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Histogram buckets: seconds from 1 ms to 15 min, bytes from 1 KiB to 4 GiB, counts from 1 to 10^10
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+BYTES_BUCKETS = tuple(4 ** n for n in range(5, 17))
+COUNT_BUCKETS = tuple(10 ** n for n in range(0, 11))
+# name -> (help, buckets) of every exported histogram
+HISTOGRAMS = {
+    "terravigil_request_seconds": ("Wall time of a request or job", SECONDS_BUCKETS),
+    "terravigil_stage_seconds": ("Wall time of one stage in a request or job, summed over its calls", SECONDS_BUCKETS),
+    "terravigil_stage_bytes_read": ("Bytes read by one stage in a request or job", BYTES_BUCKETS),
+    "terravigil_stage_pixels": ("Pixels handled by one stage in a request or job", COUNT_BUCKETS),
+    "terravigil_stage_polygons": ("Polygons handled by one stage in a request or job", COUNT_BUCKETS),
+    "terravigil_stage_peak_memory_bytes": ("Peak traced memory of one stage in a profiled request or job", BYTES_BUCKETS),
+}
+# Stage fields that feed a histogram; other counters are only reported with the result
+STAGE_HISTOGRAMS = {
+    "seconds": "terravigil_stage_seconds",
+    "bytes_read": "terravigil_stage_bytes_read",
+    "pixels": "terravigil_stage_pixels",
+    "polygons": "terravigil_stage_polygons",
+    "peak_memory_bytes": "terravigil_stage_peak_memory_bytes",
+}
+# Functions listed (by cumulative time) in the hotspots of a profiled run
+PROFILE_TOP = 25
+
+_active: ContextVar[Optional["StageMetrics"]] = ContextVar("terravigil_stage_metrics", default=None)
+# tracemalloc is process-wide: started by the first profiled run and stopped by the last one
+_tracing_lock = Lock()
+_tracing_users = 0
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """High-water resident memory of this process (VmHWM on Linux, ru_maxrss elsewhere)."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return int(peak if sys.platform == "darwin" else peak * 1024)
+
+
+class StageMetrics:
+    """Wall time, counters and (when profiling) peak memory per stage of one request or job.
+
+    Stages are timed with stage() while the collector is active (see collect()), including in threads
+    started with asyncio.to_thread, which copy the context. Work done in pool processes is collected
+    there and merged back with merge_stages(), so with several workers the seconds of a stage add up
+    across processes and can exceed total_seconds.
+    """
+
+    def __init__(self, profile: bool = False):
+        self.profile = profile
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.total_seconds = 0.0
+        self._profiler: Optional[cProfile.Profile] = None
+        # Per open stage while tracing: [traced bytes at entry, highest peak seen so far]
+        self._memory: List[List[int]] = []
+
+    def record(self, name: str, seconds: float, peak_memory: Optional[int] = None, **counters: float):
+        entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+        entry["seconds"] += seconds
+        entry["calls"] += 1
+        for key, value in counters.items():
+            entry[key] = entry.get(key, 0) + value
+        if peak_memory is not None:
+            entry["peak_memory_bytes"] = max(entry.get("peak_memory_bytes", 0), peak_memory)
+
+    def merge(self, stages: Dict[str, Dict[str, float]]):
+        for name, values in stages.items():
+            entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            for key, value in values.items():
+                entry[key] = max(entry.get(key, 0), value) if key == "peak_memory_bytes" else entry.get(key, 0) + value
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {name: {key: round(value, 6) if key == "seconds" else value for key, value in values.items()}
+                for name, values in self.stages.items()}
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """fn(*args, **kwargs), under the profiler when profiling (it only sees the calling thread)."""
+        if not self.profile:
+            return fn(*args, **kwargs)
+        if self._profiler is None:
+            self._profiler = cProfile.Profile()
+        return self._profiler.runcall(fn, *args, **kwargs)
+
+    def hotspots(self) -> List[Dict[str, Any]]:
+        if self._profiler is None:
+            return []
+        stats = pstats.Stats(self._profiler).stats
+        top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP]
+        return [{"function": f"{os.path.basename(filename)}:{line}({name})", "calls": calls,
+                 "own_seconds": round(own, 6), "cumulative_seconds": round(cumulative, 6)}
+                for (filename, line, name), (_, calls, own, cumulative, _) in top]
+
+    def summary(self) -> Dict[str, Any]:
+        """What is attached to a result: total and per-stage figures, plus hotspots when profiled."""
+        result = {"total_seconds": round(self.total_seconds, 6), "peak_rss_bytes": peak_rss_bytes(),
+                  "profiled": self.profile, "stages": self.snapshot()}
+        if self.profile:
+            result["hotspots"] = self.hotspots()
+        return result
+
+    def _enter_memory(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if self._memory:
+            self._memory[-1][1] = max(self._memory[-1][1], peak)
+        tracemalloc.reset_peak()
+        self._memory.append([current, current])
+
+    def _exit_memory(self) -> int:
+        # Nested stages reset the peak, so each open stage keeps the highest peak it has seen
+        _, peak = tracemalloc.get_traced_memory()
+        start, seen = self._memory.pop()
+        peak = max(seen, peak)
+        if self._memory:
+            self._memory[-1][1] = max(self._memory[-1][1], peak)
+        tracemalloc.reset_peak()
+        return max(0, peak - start)
+
+
+def _start_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0:
+            tracemalloc.stop()
+
+
+@contextmanager
+def collect(profile: bool = False) -> Iterator[StageMetrics]:
+    """Collect the stages timed inside the block into a new StageMetrics.
+
+    profile=True also traces allocations (per-stage peak_memory_bytes) and lets call() run the
+    profiler. Traced memory is process-wide, so profiled runs that overlap inflate each other's peaks.
+    """
+    metrics = StageMetrics(profile)
+    token = _active.set(metrics)
+    if profile:
+        _start_tracing()
+    started = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.total_seconds = time.perf_counter() - started
+        if profile:
+            _stop_tracing()
+        _active.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[Dict[str, float]]:
+    """Time the block as stage `name` of the active collector (a no-op without one).
+
+    Counters put in the yielded dict (bytes_read, pixels, polygons, ...) are added to the stage.
+    """
+    metrics = _active.get()
+    counters: Dict[str, float] = {}
+    if metrics is None:
+        yield counters
+        return
+    traced = metrics.profile and tracemalloc.is_tracing()
+    if traced:
+        metrics._enter_memory()
+    started = time.perf_counter()
+    try:
+        yield counters
+    finally:
+        seconds = time.perf_counter() - started
+        metrics.record(name, seconds, metrics._exit_memory() if traced else None, **counters)
+
+
+def merge_stages(stages: Dict[str, Dict[str, float]]):
+    """Add stages collected elsewhere (e.g. a pool worker's snapshot()) to the active collector."""
+    metrics = _active.get()
+    if metrics is not None and stages:
+        metrics.merge(stages)
+
+
+def run_measured(fn: Callable, *args, profile: bool = False, **kwargs) -> Tuple[Any, Dict[str, Any]]:
+    """(fn(*args, **kwargs), its metrics summary); picklable, so jobs can run it in a worker process."""
+    with collect(profile) as metrics:
+        result = metrics.call(fn, *args, **kwargs)
+    return result, metrics.summary()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...], **extra: str) -> str:
+    pairs = list(labels) + list(extra.items())
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}" if pairs else ""
+
+
+class MetricsRegistry:
+    """Histograms of finished requests and jobs, rendered in the Prometheus text format.
+
+    Lives in the API process; jobs report through the summary they return (see run_measured).
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        # (histogram, sorted labels) -> [count per bucket..., sum, count]
+        self._series: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+
+    def observe(self, name: str, value: float, **labels: str):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def observe_summary(self, operation: str, summary: Dict[str, Any]):
+        """One observation per histogram for a request or job and each of its stages."""
+        self.observe("terravigil_request_seconds", summary.get("total_seconds", 0.0), operation=operation)
+        for stage_name, values in (summary.get("stages") or {}).items():
+            for field, histogram in STAGE_HISTOGRAMS.items():
+                if field in values:
+                    self.observe(histogram, values[field], operation=operation, stage=stage_name)
+
+    def render(self, gauges: Optional[Dict[str, Tuple[str, Optional[float]]]] = None) -> str:
+        """Exposition text of every histogram, plus `gauges` given as {name: (help, value)}."""
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        lines = []
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (series_name, labels), values in sorted(series.items()):
+                if series_name != name:
+                    continue
+                for bound, count in zip(buckets, values):
+                    lines.append(f"{name}_bucket{_labels(labels, le=_number(bound))} {_number(count)}")
+                lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {_number(values[-1])}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(values[-2])}")
+                lines.append(f"{name}_count{_labels(labels)} {_number(values[-1])}")
+        for name, (help_text, value) in (gauges or {}).items():
+            if value is None:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {_number(value)}"]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,124 @@
+import os
+import tempfile
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyogrio
+import rasterio
+import rasterio.shutil
+from rasterio.features import rasterize
+from rasterio.transform import Affine, array_bounds
+from rasterio.windows import Window
+from shapely.geometry import box
+from shapely.strtree import STRtree
+
+from utils.geojson_io import geojson_frame, iter_features
+
+
+# `format` values accepted by the result endpoints; geojson is the plain JSON response
+OUTPUT_FORMATS = ("geojson", "ndjson", "fgb", "cog")
+MEDIA_TYPES = {
+    "geojson": "application/json",
+    "ndjson": "application/x-ndjson",
+    "fgb": "application/flatgeobuf",
+    "cog": "image/tiff; application=geotiff; profile=cloud-optimized",
+}
+FILE_EXTENSIONS = {"geojson": ".geojson", "ndjson": ".ndjson", "fgb": ".fgb", "cog": ".tif"}
+# Mask pixels rasterized per chunk (rounded to whole COG blocks), bounding memory on large scenes
+MASK_CHUNK_PIXELS = 4_194_304
+COG_BLOCK_SIZE = 512
+
+
+def detection_frame(detection: Dict[str, Any]) -> gpd.GeoDataFrame:
+    """Polygons of a detection result (its 'geojson' section) in the CRS of its mask grid."""
+    return geojson_frame(detection.get("geojson"), (detection.get("grid") or {}).get("crs"))
+
+
+def read_feature_collection(path: str) -> gpd.GeoDataFrame:
+    """GeoDataFrame of a FeatureCollection file, parsed by GDAL (in its named CRS member, else WGS84)."""
+    gdf = pyogrio.read_dataframe(path)
+    # GDAL turns the feature ids into an attribute; result features carry their own properties only
+    return gdf.drop(columns=["id"]) if "id" in gdf.columns else gdf
+
+
+def result_layers(kind: Optional[str], result: Dict[str, Any]) -> Dict[str, gpd.GeoDataFrame]:
+    """Polygon layers of a task result by name: 'mining' for detections, 'legal'/'illegal' for boundary
+    checks that kept their geometries (pipeline results contribute both), and 'change' for time series,
+    with the date of each change polygon as an attribute."""
+    layers = {}
+    if kind == "timeseries":
+        frames = []
+        for entry in result.get("dates", []):
+            if entry.get("change_geojson") is not None:
+                frame = geojson_frame(entry["change_geojson"], (result.get("grid") or {}).get("crs"))
+                if not frame.empty:
+                    frames.append(frame.to_crs(4326).assign(date=entry["date"]))
+        if frames:
+            layers["change"] = gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=4326)
+        return layers
+    detection = result.get("detection") if kind == "pipeline" else result if kind == "detection" else None
+    if detection and detection.get("geojson") is not None:
+        layers["mining"] = detection_frame(detection)
+    boundary = result.get("boundary") if kind == "pipeline" else result if kind == "boundary" else None
+    for name in ("legal", "illegal"):
+        if boundary and boundary.get(f"{name}_geojson") is not None:
+            layers[name] = geojson_frame(boundary[f"{name}_geojson"])
+    return layers
+
+
+def iter_ndjson(gdf: gpd.GeoDataFrame, precision: Optional[int] = None) -> Iterator[bytes]:
+    """Newline-delimited GeoJSON: one Feature per line, encoded and yielded a batch at a time."""
+    for batch in iter_features(gdf, precision):
+        if batch:
+            yield ("\n".join(batch) + "\n").encode("utf-8")
+
+
+def write_flatgeobuf(gdf: gpd.GeoDataFrame, path: str) -> str:
+    """FlatGeobuf with a packed Hilbert R-tree, so clients can fetch just the features in a bbox."""
+    gdf = gdf.explode(index_parts=False, ignore_index=True)
+    gdf.to_file(path, driver="FlatGeobuf", SPATIAL_INDEX="YES")
+    return path
+
+
+def write_mask_cog(gdf: gpd.GeoDataFrame, grid: Dict[str, Any], path: str,
+                   chunk_pixels: int = MASK_CHUNK_PIXELS) -> str:
+    """Rasterize the polygons back onto the detection grid as a 1-bit, deflate-compressed COG.
+
+    Rows are burned chunk by chunk into a tiled GeoTIFF, querying an STRtree for the polygons that
+    reach each chunk, then copied to COG layout with nearest-neighbour overviews.
+    """
+    transform = Affine(*grid["transform"])
+    width, height = int(grid["width"]), int(grid["height"])
+    if gdf.crs is not None and grid.get("crs") and gdf.crs != grid["crs"]:
+        gdf = gdf.to_crs(grid["crs"])
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+    tree = STRtree(geoms)
+    rows_per_chunk = max(1, chunk_pixels // max(1, width))
+    if rows_per_chunk > COG_BLOCK_SIZE:
+        rows_per_chunk -= rows_per_chunk % COG_BLOCK_SIZE
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or None, suffix=".part.tif")
+    os.close(fd)
+    try:
+        with rasterio.open(tmp_path, "w", driver="GTiff", width=width, height=height, count=1, dtype="uint8",
+                           crs=grid.get("crs"), transform=transform, tiled=True, blockxsize=COG_BLOCK_SIZE,
+                           blockysize=COG_BLOCK_SIZE, compress="deflate", nbits=1) as dst:
+            for row_off in range(0, height, rows_per_chunk):
+                window = Window(0, row_off, width, min(rows_per_chunk, height - row_off))
+                chunk_transform = dst.window_transform(window)
+                shape = (int(window.height), width)
+                hits = tree.query(box(*array_bounds(shape[0], shape[1], chunk_transform)))
+                if len(hits):
+                    chunk = rasterize(((geom, 1) for geom in geoms[np.sort(hits)]), out_shape=shape,
+                                      transform=chunk_transform, fill=0, dtype="uint8")
+                else:
+                    chunk = np.zeros(shape, dtype=np.uint8)
+                dst.write(chunk, 1, window=window)
+        rasterio.shutil.copy(tmp_path, path, driver="COG", compress="deflate", nbits=1,
+                             blocksize=COG_BLOCK_SIZE, resampling="nearest")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
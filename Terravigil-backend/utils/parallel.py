@@ -0,0 +1,60 @@
+import os
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from typing import Dict, List, Optional, Sequence, Any
+
+
+# Shared pools keyed by worker count; spawning interpreters is expensive, so they are reused across requests
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pool_lock = Lock()
+
+
+def resolve_workers(workers: Optional[int] = None) -> int:
+    """Number of worker processes: explicit value, else TERRAVIGIL_WORKERS, else 1 (serial).
+
+    Zero or a negative value means one worker per CPU.
+    """
+    if workers is None:
+        workers = int(os.environ.get("TERRAVIGIL_WORKERS", "1") or 1)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def get_process_pool(workers: int) -> ProcessPoolExecutor:
+    with _pool_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            if not _pools:
+                # A job worker process joins its child processes before the pool's own exit hook runs, so
+                # without this a job that used a pool would never exit. Finalizers run before that join; the
+                # priority puts this one ahead of the pool queues' own finalizers, which stop their feeders
+                multiprocessing.util.Finalize(None, shutdown_pools, exitpriority=100)
+            # spawn rather than fork: the API process runs threads (asyncio.to_thread, task workers)
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pools[workers] = pool
+        return pool
+
+
+def shutdown_pools():
+    """Shut down the shared pools, cancelling work that has not started; the next use creates new ones."""
+    with _pool_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def split_evenly(items: Sequence[Any], parts: int) -> List[List[Any]]:
+    """Split items into at most `parts` contiguous, non-empty chunks, preserving order."""
+    items = list(items)
+    parts = max(1, min(parts, len(items)))
+    size, extra = divmod(len(items), parts)
+    chunks, start = [], 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return [chunk for chunk in chunks if chunk]
@@ -0,0 +1,155 @@
+import os
+import json
+import hashlib
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Optional
+
+from utils.geojson_io import COORDINATE_PRECISION, dumps, loads
+
+
+# Bump when detection/volume/boundary output changes so stale on-disk entries stop matching
+CACHE_VERSION = 2
+
+
+def hash_geojson(geojson: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Stable content hash of a GeoJSON object (key order and whitespace do not matter)."""
+    if geojson is None:
+        return None
+    canonical = json.dumps(geojson, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Two-tier result cache: an in-memory LRU over encoded results and an on-disk store.
+
+    Entries are JSON bytes keyed by a hash of the input content plus parameters. The memory tier is
+    bounded by total bytes; the disk tier evicts least recently used files when over max_disk_bytes.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_memory_bytes: int = 256 * 1024 * 1024,
+                 max_disk_bytes: int = 2 * 1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(kind: str, **params: Any) -> str:
+        payload = json.dumps({"kind": kind, "version": CACHE_VERSION, "precision": COORDINATE_PRECISION, **params},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _remember(self, key: str, data: bytes):
+        # Caller holds the lock
+        if len(data) > self.max_memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # mtime doubles as the LRU clock for disk eviction
+            os.utime(path, None)
+        except OSError:
+            return None
+        with self._lock:
+            self._remember(key, data)
+        return data
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        data = self.get_bytes(key)
+        return loads(data) if data is not None else None
+
+    def put(self, key: str, value: Dict[str, Any]) -> bytes:
+        # Pre-encoded GeoJSON (RawJSON) inside the result is copied through, not re-encoded
+        data = dumps(value)
+        with self._lock:
+            self._remember(key, data)
+        if self.directory:
+            # Write-then-rename so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    out.write(data)
+                os.replace(tmp_path, self._path(key))
+            except OSError:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            self._evict_disk()
+        return data
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        if total <= self.max_disk_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_disk_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith(".json"):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+
+
+def result_cache_from_env() -> ResultCache:
+    """Cache configured by TERRAVIGIL_CACHE_DIR / TERRAVIGIL_CACHE_MAX_BYTES / TERRAVIGIL_CACHE_MEMORY_BYTES.
+
+    An empty TERRAVIGIL_CACHE_DIR keeps the cache in memory only.
+    """
+    directory = os.environ.get("TERRAVIGIL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "terravigil-cache"))
+    return ResultCache(
+        directory=directory or None,
+        max_memory_bytes=int(os.environ.get("TERRAVIGIL_CACHE_MEMORY_BYTES", 256 * 1024 * 1024)),
+        max_disk_bytes=int(os.environ.get("TERRAVIGIL_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024)),
+    )
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import sqlite3
+import tempfile
+from threading import Lock
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from utils.geojson_io import RawJSON, dumps, loads
+
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+# Columns with their own storage; any other task field lives in the JSON 'meta' column
+_COLUMNS = ("status", "progress", "created_at", "updated_at", "error")
+
+
+class TaskStore:
+    """Task metadata and results in SQLite (in memory by default, or a file to survive restarts).
+
+    Tasks in a terminal state expire ttl_seconds after their last update. Results larger than
+    spill_threshold bytes are written to spill_dir and only read back when a task is fetched
+    with its result, so listings never touch them. Layers (see put_layer) are always kept as files
+    in spill_dir, so exports can read one FeatureCollection without parsing the whole result.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, ttl_seconds: float = 24 * 3600,
+                 spill_dir: Optional[str] = None, spill_threshold: int = 256 * 1024,
+                 purge_interval: float = 60.0):
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = spill_dir or os.path.join(tempfile.gettempdir(), "terravigil-task-results")
+        self.spill_threshold = spill_threshold
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+        self._lock = Lock()
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._db = sqlite3.connect(db_path or ":memory:", check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    error TEXT,
+                    meta TEXT NOT NULL DEFAULT '{}',
+                    result BLOB,
+                    result_path TEXT,
+                    layers TEXT
+                )
+            """)
+            # Task databases written before layers existed
+            if "layers" not in {row["name"] for row in self._db.execute("PRAGMA table_info(tasks)")}:
+                self._db.execute("ALTER TABLE tasks ADD COLUMN layers TEXT")
+            self._db.execute("CREATE INDEX IF NOT EXISTS tasks_created ON tasks (created_at)")
+            # Jobs that were in flight when the previous process stopped will never report back
+            self._db.execute(
+                "UPDATE tasks SET status = 'failed', error = 'Interrupted by server restart', updated_at = ? "
+                "WHERE status IN ('queued', 'processing')", (time.time(),)
+            )
+
+    def create(self, task_id: str, info: Dict[str, Any]):
+        now = time.time()
+        info = dict(info)
+        result = info.pop("result", None)
+        row = {
+            "status": info.pop("status", "queued"),
+            "progress": int(info.pop("progress", 0)),
+            "created_at": info.pop("created_at", now),
+            "updated_at": info.pop("updated_at", now),
+            "error": info.pop("error", None),
+        }
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, status, progress, created_at, updated_at, error, meta) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (task_id, row["status"], row["progress"], row["created_at"], row["updated_at"], row["error"],
+                 json.dumps(info))
+            )
+        if result is not None:
+            self._store_result(task_id, result)
+        self.purge_expired()
+
+    def update(self, task_id: str, unless_status: Sequence[str] = (), **fields: Any) -> bool:
+        """Update columns/meta fields (and optionally 'result') of an existing task.
+
+        False if the task is unknown or its status is one of unless_status; the status check and
+        the write happen in one statement, so a concurrent cancel cannot be overwritten.
+        """
+        result = fields.pop("result", None)
+        with self._lock, self._db:
+            row = self._db.execute("SELECT meta FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return False
+            columns = {k: v for k, v in fields.items() if k in _COLUMNS}
+            extra = {k: v for k, v in fields.items() if k not in _COLUMNS}
+            columns.setdefault("updated_at", time.time())
+            if extra:
+                meta = json.loads(row["meta"])
+                meta.update(extra)
+                columns["meta"] = json.dumps(meta)
+            assignments = ", ".join(f"{k} = ?" for k in columns)
+            where = "task_id = ?"
+            if unless_status:
+                where += f" AND status NOT IN ({', '.join('?' * len(unless_status))})"
+            cursor = self._db.execute(f"UPDATE tasks SET {assignments} WHERE {where}",
+                                      (*columns.values(), task_id, *unless_status))
+            if cursor.rowcount == 0:
+                return False
+        if result is not None:
+            self._store_result(task_id, result)
+        return True
+
+    def _spill_path(self, task_id: str) -> str:
+        return os.path.join(self.spill_dir, f"{task_id}.json")
+
+    def _layer_path(self, task_id: str, name: str) -> str:
+        return os.path.join(self.spill_dir, f"{task_id}.{name}.geojson")
+
+    def put_layer(self, task_id: str, name: str, data: bytes, **meta: Any) -> bool:
+        """Keep a FeatureCollection of the task's result as its own file, plus small `meta` (e.g. the
+        mask grid) for readers of that layer; False if the task is unknown."""
+        path = self._layer_path(task_id, name)
+        with open(path, "wb") as out:
+            out.write(data)
+        with self._lock, self._db:
+            row = self._db.execute("SELECT layers FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is not None:
+                layers = json.loads(row["layers"] or "{}")
+                layers[name] = dict(meta, path=path)
+                self._db.execute("UPDATE tasks SET layers = ? WHERE task_id = ?", (json.dumps(layers), task_id))
+        if row is None:
+            os.remove(path)
+        return row is not None
+
+    def get_layer(self, task_id: str, name: str) -> Optional[Dict[str, Any]]:
+        """{'path': FeatureCollection file, **meta} of a layer stored with put_layer, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT layers FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        layer = json.loads(row["layers"] or "{}").get(name) if row is not None else None
+        return layer if layer is not None and os.path.exists(layer["path"]) else None
+
+    def _remove_files(self, row: sqlite3.Row):
+        paths = [row["result_path"]] + [layer["path"] for layer in json.loads(row["layers"] or "{}").values()]
+        for path in paths:
+            if path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _store_result(self, task_id: str, result: Any):
+        data = dumps(result)
+        blob, path = data, None
+        if len(data) > self.spill_threshold:
+            path = self._spill_path(task_id)
+            with open(path, "wb") as out:
+                out.write(data)
+            blob = None
+        with self._lock, self._db:
+            self._db.execute("UPDATE tasks SET result = ?, result_path = ? WHERE task_id = ?", (blob, path, task_id))
+
+    def _row_to_info(self, row: sqlite3.Row) -> Dict[str, Any]:
+        info = json.loads(row["meta"])
+        info.update({k: row[k] for k in ("status", "progress", "created_at", "updated_at")})
+        if row["error"] is not None:
+            info["error"] = row["error"]
+        return info
+
+    def _result_bytes(self, row: sqlite3.Row) -> Optional[bytes]:
+        data = row["result"]
+        if data is None and row["result_path"]:
+            try:
+                with open(row["result_path"], "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+        return data
+
+    def get(self, task_id: str, include_result: bool = True) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None:
+            return None
+        info = self._row_to_info(row)
+        if include_result:
+            data = self._result_bytes(row)
+            if data is not None:
+                info["result"] = loads(data)
+        return info
+
+    def get_bytes(self, task_id: str) -> Optional[bytes]:
+        """Task info with its result as JSON bytes; the stored result is copied in without being parsed."""
+        with self._lock:
+            row = self._db.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None:
+            return None
+        info = self._row_to_info(row)
+        data = self._result_bytes(row)
+        if data is not None:
+            info["result"] = RawJSON(bytes(data))
+        return dumps(info)
+
+    def status(self, task_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT status FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return row["status"] if row is not None else None
+
+    def list(self, offset: int = 0, limit: int = 50, status: Optional[str] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """Newest-first page of task metadata (never results) and the total matching count."""
+        self.purge_expired()
+        where, params = ("WHERE status = ?", (status,)) if status else ("", ())
+        with self._lock:
+            total = self._db.execute(f"SELECT COUNT(*) FROM tasks {where}", params).fetchone()[0]
+            rows = self._db.execute(
+                f"SELECT task_id, status, progress, created_at, updated_at, error, meta, "
+                f"result IS NOT NULL OR result_path IS NOT NULL AS has_result "
+                f"FROM tasks {where} ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (*params, int(limit), int(offset))
+            ).fetchall()
+        tasks = []
+        for row in rows:
+            info = self._row_to_info(row)
+            info["task_id"] = row["task_id"]
+            info["has_result"] = bool(row["has_result"])
+            tasks.append(info)
+        return tasks, total
+
+    def delete(self, task_id: str):
+        with self._lock, self._db:
+            row = self._db.execute("SELECT result_path, layers FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            self._db.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+        if row is not None:
+            self._remove_files(row)
+
+    def purge_expired(self, force: bool = False):
+        now = time.time()
+        if not force and now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        cutoff = now - self.ttl_seconds
+        placeholders = ", ".join("?" for _ in TERMINAL_STATUSES)
+        with self._lock, self._db:
+            rows = self._db.execute(
+                f"SELECT task_id, result_path, layers FROM tasks WHERE status IN ({placeholders}) AND updated_at < ?",
+                (*TERMINAL_STATUSES, cutoff)
+            ).fetchall()
+            self._db.executemany("DELETE FROM tasks WHERE task_id = ?", [(row["task_id"],) for row in rows])
+        for row in rows:
+            self._remove_files(row)
+
+
+def task_store_from_env() -> TaskStore:
+    """Store configured by TERRAVIGIL_TASK_DB (SQLite path; unset = in memory), TERRAVIGIL_TASK_TTL
+    (seconds, default 24h) and TERRAVIGIL_TASK_SPILL_DIR."""
+    return TaskStore(
+        db_path=os.environ.get("TERRAVIGIL_TASK_DB") or None,
+        ttl_seconds=float(os.environ.get("TERRAVIGIL_TASK_TTL", 24 * 3600)),
+        spill_dir=os.environ.get("TERRAVIGIL_TASK_SPILL_DIR") or None,
+    )
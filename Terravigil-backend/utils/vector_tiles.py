@@ -0,0 +1,243 @@
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import uuid
+from threading import Lock
+from typing import Any, Dict, Optional
+
+import pandas as pd
+import geopandas as gpd
+import pyogrio
+import shapely
+
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+DEFAULT_MIN_ZOOM = 0
+DEFAULT_MAX_ZOOM = 14
+# Most features of one layer encoded into a single tile; the largest are kept, so a low-zoom tile over
+# a dense layer costs a bounded amount of work and still shows what a client could draw at that scale
+DEFAULT_MAX_TILE_FEATURES = 50_000
+# Douglas-Peucker tolerance in tile units (4096 per tile side), so low zooms drop detail clients
+# could not draw anyway; the deepest zoom keeps full tile precision
+SIMPLIFICATION = 1.0
+SIMPLIFICATION_MAX_ZOOM = 0.0
+# GDAL's MVT defaults: 4096 units per tile side, features clipped 80 units outside the tile
+TILE_EXTENT = 4096
+TILE_BUFFER = 80
+# Half the side of the web mercator square
+MERCATOR_HALF_SIDE = 20037508.342789244
+# Generated tiles between two eviction passes; a pass walks the whole cache directory
+EVICT_EVERY = 256
+
+
+class VectorTileCache:
+    """On-disk Mapbox Vector Tiles of task results, one directory per key under `directory/<key>/`.
+
+    build() only stores each layer once in web mercator as an indexed FlatGeobuf, beside a TileJSON
+    document. A z/x/y tile is encoded on its first request from the features in its bbox (GDAL's MVT
+    driver clips and simplifies them for that zoom); the per-layer tiles are merged (concatenated
+    protobuf messages merge their layers), gzipped and kept as z/x/y.mvt. Keys are evicted least
+    recently used (by directory mtime) once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, directory: str, min_zoom: int = DEFAULT_MIN_ZOOM, max_zoom: int = DEFAULT_MAX_ZOOM,
+                 max_bytes: int = 2 * 1024 * 1024 * 1024, max_tile_features: int = DEFAULT_MAX_TILE_FEATURES):
+        self.directory = directory
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.max_bytes = max_bytes
+        self.max_tile_features = max_tile_features
+        self._locks: Dict[str, Lock] = {}
+        self._locks_guard = Lock()
+        self._generated = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _key_lock(self, key: str) -> Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(key, Lock())
+
+    def pyramid_path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def has(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.pyramid_path(key), "tilejson.json"))
+
+    def build(self, key: str, layers: Dict[str, gpd.GeoDataFrame]) -> Dict[str, Any]:
+        """Store `layers` (name -> polygons) for tiling unless they are stored; returns the TileJSON."""
+        with self._key_lock(key):
+            if not self.has(key):
+                tmp_dir = tempfile.mkdtemp(dir=self.directory, prefix=f".{key}-")
+                try:
+                    self._write_sources(tmp_dir, layers)
+                    try:
+                        os.rename(tmp_dir, self.pyramid_path(key))
+                    except OSError:
+                        # Another process finished the same key first
+                        if not self.has(key):
+                            raise
+                finally:
+                    if os.path.exists(tmp_dir):
+                        shutil.rmtree(tmp_dir, ignore_errors=True)
+                self.evict(keep={key})
+        return self.tilejson(key)
+
+    def _write_sources(self, out_dir: str, layers: Dict[str, gpd.GeoDataFrame]):
+        bounds = None
+        written = {}
+        os.makedirs(os.path.join(out_dir, "layers"))
+        for name, gdf in layers.items():
+            if gdf.empty:
+                continue
+            if gdf.crs is None:
+                gdf = gdf.set_crs(4326)
+            # Tile bboxes are web mercator squares, so the index is queried in that CRS
+            pyogrio.write_dataframe(gdf.to_crs(3857), os.path.join(out_dir, "layers", f"{name}.fgb"),
+                                   driver="FlatGeobuf", layer=name, promote_to_multi=True)
+            written[name] = {column: "Number" if pd.api.types.is_numeric_dtype(gdf[column]) else "String"
+                             for column in gdf.columns if column != gdf.geometry.name}
+            west, south, east, north = gdf.to_crs(4326).total_bounds
+            bounds = [west, south, east, north] if bounds is None else [
+                min(bounds[0], west), min(bounds[1], south), max(bounds[2], east), max(bounds[3], north)]
+
+        tilejson = {
+            "tilejson": "3.0.0",
+            "minzoom": self.min_zoom,
+            "maxzoom": self.max_zoom,
+            "bounds": [float(v) for v in bounds] if bounds is not None else None,
+            "vector_layers": [{"id": name, "minzoom": self.min_zoom, "maxzoom": self.max_zoom, "fields": fields}
+                              for name, fields in written.items()],
+        }
+        with open(os.path.join(out_dir, "tilejson.json"), "w", encoding="utf-8") as f:
+            json.dump(tilejson, f)
+
+    def tilejson(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.pyramid_path(key), "tilejson.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def tile(self, key: str, z: int, x: int, y: int) -> Optional[bytes]:
+        """Gzipped tile bytes, encoded on first request; None where the tile has no data."""
+        if not self.min_zoom <= z <= self.max_zoom or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return None
+        path = os.path.join(self.pyramid_path(key), str(z), str(x), f"{y}.mvt")
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            tilejson = self.tilejson(key)
+            if tilejson is None:
+                return None
+            data = self._encode_tile(key, [layer["id"] for layer in tilejson["vector_layers"]], z, x, y)
+            self._store_tile(key, path, data)
+        try:
+            # mtime of the key directory doubles as the LRU clock for eviction
+            os.utime(self.pyramid_path(key), None)
+        except OSError:
+            pass
+        return data or None
+
+    def _encode_tile(self, key: str, names, z: int, x: int, y: int) -> bytes:
+        side = 2 * MERCATOR_HALF_SIDE / 2 ** z
+        west, north = -MERCATOR_HALF_SIDE + x * side, MERCATOR_HALF_SIDE - y * side
+        margin = side * TILE_BUFFER / TILE_EXTENT
+        bbox = (west - margin, north - side - margin, west + side + margin, north + margin)
+        # Full precision only at the deepest zoom, as for a pyramid written in one go
+        simplification = SIMPLIFICATION_MAX_ZOOM if z == self.max_zoom else SIMPLIFICATION
+        chunks = []
+        tmp_dir = tempfile.mkdtemp(dir=self.directory, prefix=f".{key}-{z}-{x}-{y}-")
+        try:
+            for name in names:
+                gdf = pyogrio.read_dataframe(os.path.join(self.pyramid_path(key), "layers", f"{name}.fgb"),
+                                             bbox=bbox)
+                if gdf.empty:
+                    continue
+                if len(gdf) > self.max_tile_features:
+                    gdf = gdf.loc[gdf.area.nlargest(self.max_tile_features).index].sort_index()
+                # Pre-clipping to the buffered tile keeps GDAL from encoding the neighbours a large
+                # feature also covers; it clips to the same buffer itself
+                gdf = gdf.set_geometry(shapely.clip_by_rect(gdf.geometry.values, *bbox))
+                gdf = gdf[~gdf.geometry.is_empty]
+                if gdf.empty:
+                    continue
+                layer_dir = os.path.join(tmp_dir, name)
+                pyogrio.write_dataframe(
+                    gdf, layer_dir, driver="MVT", layer=name,
+                    dataset_options={"FORMAT": "DIRECTORY", "COMPRESS": "NO", "MINZOOM": z, "MAXZOOM": z,
+                                     "SIMPLIFICATION": simplification,
+                                     "SIMPLIFICATION_MAX_ZOOM": simplification}
+                )
+                try:
+                    with open(os.path.join(layer_dir, str(z), str(x), f"{y}.pbf"), "rb") as f:
+                        chunks.append(f.read())
+                except OSError:
+                    # Only buffer slivers fell in this tile, and GDAL dropped them
+                    continue
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return gzip.compress(b"".join(chunks), compresslevel=6) if chunks else b""
+
+    def _store_tile(self, key: str, path: str, data: bytes):
+        # An empty file records an empty tile, so it is not encoded again
+        with self._key_lock(key):
+            if not self.has(key):
+                # Deleted or evicted while the tile was encoded
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as out:
+                out.write(data)
+            os.replace(tmp_path, path)
+        with self._locks_guard:
+            self._generated += 1
+            evict = self._generated % EVICT_EVERY == 0
+        if evict:
+            self.evict(keep={key})
+
+    def delete(self, key: str):
+        with self._key_lock(key):
+            shutil.rmtree(self.pyramid_path(key), ignore_errors=True)
+
+    def evict(self, keep: Optional[set] = None):
+        keep = keep or set()
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            size = 0
+            for root, _, files in os.walk(path):
+                for filename in files:
+                    try:
+                        size += os.path.getsize(os.path.join(root, filename))
+                    except OSError:
+                        continue
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            entries.append((mtime, size, name))
+            total += size
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name in keep:
+                continue
+            self.delete(name)
+            total -= size
+
+
+def vector_tile_cache_from_env() -> VectorTileCache:
+    """Cache configured by TERRAVIGIL_TILE_DIR, TERRAVIGIL_TILE_MAX_BYTES, TERRAVIGIL_TILE_MAX_ZOOM and
+    TERRAVIGIL_TILE_MAX_FEATURES."""
+    directory = os.environ.get("TERRAVIGIL_TILE_DIR") or os.path.join(tempfile.gettempdir(), "terravigil-tiles")
+    return VectorTileCache(
+        directory,
+        max_zoom=int(os.environ.get("TERRAVIGIL_TILE_MAX_ZOOM", DEFAULT_MAX_ZOOM)),
+        max_bytes=int(os.environ.get("TERRAVIGIL_TILE_MAX_BYTES", 2 * 1024 * 1024 * 1024)),
+        max_tile_features=int(os.environ.get("TERRAVIGIL_TILE_MAX_FEATURES", DEFAULT_MAX_TILE_FEATURES)),
+    )
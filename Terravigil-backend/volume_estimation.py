@@ -1,103 +1,322 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Union
 import numpy as np
 import rasterio
-from rasterio.mask import mask as rio_mask
-import json
+from rasterio.features import geometry_mask, geometry_window, rasterize
+from rasterio.windows import Window
 
-from utils.geo_utils import load_raster, mask_raster_with_geojson
+from utils.geo_utils import load_raster, cluster_geometry_windows
+from utils.geojson_io import geojson_frame
+from utils.parallel import resolve_workers, get_process_pool, split_evenly
+from utils.job_queue import JobContext
+from utils.metrics import stage
 import geopandas as gpd
 
 
-def _simpsons_rule_column(values: np.ndarray, dx: float) -> float:
-    n = len(values)
+INTEGRATION_METHODS = ("simpson", "trapezoid", "sum")
+
+
+def _simpson_weights(n: int) -> np.ndarray:
+    # Simpson's 1/3 rule needs an odd number of points; with an even count the last row gets weight 0
+    coef = np.zeros(n)
+    m = n if n % 2 == 1 else n - 1
+    coef[:m] = 1
+    coef[1:m - 1:2] = 4
+    coef[2:m - 1:2] = 2
+    return coef
+
+
+def _row_weights(n: int, pixel_height: float, method: str) -> np.ndarray:
+    """Quadrature weights along a column of n rows, so a column integral is `weights @ column`."""
+    if method == "sum":
+        return np.full(n, pixel_height)
     if n < 2:
-        return 0.0
-    if n % 2 == 0:
-        # If even count, drop last to make odd (Simpson requires odd number of points)
-        n = n - 1
-        values = values[:n]
-    # Simpson's 1/3 rule
-    coef = np.ones(n)
-    coef[1:-1:2] = 4
-    coef[2:-1:2] = 2
-    return float((dx / 3.0) * np.sum(coef * values))
-
-
-def estimate_volume(dem_path: str, mask_geojson: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return np.zeros(n)
+    if method == "simpson":
+        return _simpson_weights(n) * (pixel_height / 3.0)
+    if method == "trapezoid":
+        weights = np.full(n, pixel_height)
+        weights[[0, -1]] *= 0.5
+        return weights
+    raise ValueError(f"Unknown integration method '{method}'; expected one of {', '.join(INTEGRATION_METHODS)}")
+
+
+def _row_weights_at(k: np.ndarray, n: np.ndarray, pixel_height: float, method: str) -> np.ndarray:
+    """_row_weights per pixel: the weight of row k of a column of n rows, for arrays of k and n."""
+    if method == "sum":
+        return np.full(k.shape, pixel_height)
+    if method == "simpson":
+        m = n - (n % 2 == 0)
+        coef = np.where((k == 0) | (k == m - 1), 1.0, np.where(k % 2 == 1, 4.0, 2.0))
+        weights = np.where(k < m, coef, 0.0) * (pixel_height / 3.0)
+    elif method == "trapezoid":
+        weights = np.where((k == 0) | (k == n - 1), 0.5, 1.0) * pixel_height
+    else:
+        raise ValueError(f"Unknown integration method '{method}'; expected one of {', '.join(INTEGRATION_METHODS)}")
+    return np.where(n < 2, 0.0, weights)
+
+
+def _integrate_columns(depth: np.ndarray, pixel_height: float, pixel_width: float,
+                       method: str = "simpson") -> np.ndarray:
+    """Per-column volumes of a 2D depth grid in one array operation.
+
+    Integrates along rows (dx = pixel_height) and multiplies by pixel_width; only positive depths contribute.
+    """
+    depth = np.where(depth > 0, depth, 0.0)
+    return (_row_weights(depth.shape[0], pixel_height, method) @ depth) * pixel_width
+
+
+def _volume_columns(depth: np.ndarray, pixel_height: float, pixel_width: float, method: str,
+                    workers: int) -> np.ndarray:
+    if workers <= 1 or depth.shape[1] < 2:
+        return _integrate_columns(depth, pixel_height, pixel_width, method)
+    # Columns integrate independently; split them into strips and concatenate in order
+    strips = [
+        depth[:, cols[0]:cols[-1] + 1]
+        for cols in split_evenly(range(depth.shape[1]), workers)
+    ]
+    pool = get_process_pool(workers)
+    return np.concatenate(list(pool.map(
+        _integrate_columns, strips,
+        [pixel_height] * len(strips), [pixel_width] * len(strips), [method] * len(strips)
+    )))
+
+
+def _unwrap_geojson(mask_geojson: Dict[str, Any]) -> Dict[str, Any]:
+    # Accept nested structures where the geojson is under 'geojson'
+    if 'type' not in mask_geojson and 'geojson' in mask_geojson:
+        return mask_geojson['geojson']
+    return mask_geojson
+
+
+def _mining_geometries(src: rasterio.io.DatasetReader, mask_geojson: Union[Dict[str, Any], gpd.GeoDataFrame]) -> List[Any]:
+    if isinstance(mask_geojson, gpd.GeoDataFrame):
+        # In-process callers (the pipeline) hand over polygons that already carry their CRS
+        gdf = mask_geojson
+    else:
+        with stage("geojson_parse") as counts:
+            # Detection output names its (often projected) CRS; plain GeoJSON is WGS84
+            gdf = geojson_frame(_unwrap_geojson(mask_geojson), (mask_geojson.get("grid") or {}).get("crs"))
+            counts["polygons"] = len(gdf)
+    if gdf.empty:
+        return []
+    # Reproject incoming GeoJSON to DEM CRS if needed
+    try:
+        if gdf.crs is None:
+            gdf = gdf.set_crs(4326, allow_override=True)
+        if src.crs is not None:
+            with stage("reproject") as counts:
+                counts["polygons"] = len(gdf)
+                gdf = gdf.to_crs(src.crs)
+    except Exception:
+        # Fall back to provided coordinates as-is
+        pass
+    return list(gdf.geometry)
+
+
+def _read_footprints(src: rasterio.io.DatasetReader, geometries: List[Any],
+                     context: Optional[JobContext] = None) -> List[np.ndarray]:
+    """Read the DEM only inside the mining footprint, one window per polygon cluster.
+
+    Pixels outside the polygons (centre not inside) and nodata pixels are NaN.
+    """
+    if not geometries:
+        clusters = [(Window(0, 0, src.width, src.height), None)]
+    else:
+        clusters = cluster_geometry_windows(src, geometries)
+
+    arrays = []
+    for done, (window, members) in enumerate(clusters):
+        if context is not None:
+            context.report(5 + 45 * done / len(clusters), "reading", windows_done=done, windows_total=len(clusters))
+        with stage("raster_read") as counts:
+            dem = src.read(1, window=window, masked=True)
+            counts["bytes_read"], counts["pixels"] = dem.data.nbytes, dem.size
+        dem = dem.astype(np.float32).filled(np.nan)
+        if members is not None:
+            with stage("footprint_mask") as counts:
+                inside = geometry_mask([geometries[i] for i in members], out_shape=dem.shape,
+                                       transform=src.window_transform(window), invert=True)
+                dem[~inside] = np.nan
+                counts["pixels"], counts["polygons"] = dem.size, len(members)
+        arrays.append(dem)
+    return arrays
+
+
+def estimate_volume(dem_path: str, mask_geojson: Optional[Union[Dict[str, Any], gpd.GeoDataFrame]] = None,
+                    workers: Optional[int] = None, method: str = "simpson",
+                    context: Optional[JobContext] = None) -> Dict[str, Any]:
+    if method not in INTEGRATION_METHODS:
+        raise ValueError(f"Unknown integration method '{method}'; expected one of {', '.join(INTEGRATION_METHODS)}")
+    workers = resolve_workers(workers)
     with load_raster(dem_path) as src:
-        dem = src.read(1).astype(np.float32)
         transform = src.transform
         pixel_width = abs(transform.a)
         pixel_height = abs(transform.e)
 
-        if mask_geojson is not None:
-            # Accept nested structures where the geojson is under 'geojson'
-            if 'type' not in mask_geojson and 'geojson' in mask_geojson:
-                mask_geojson = mask_geojson['geojson']
-
-            # Reproject incoming GeoJSON to DEM CRS if needed
-            try:
-                gdf = gpd.GeoDataFrame.from_features(mask_geojson.get('features', []))
-                if gdf.crs is None:
-                    gdf = gdf.set_crs(4326, allow_override=True)
-                dem_crs = src.crs
-                if dem_crs is not None:
-                    gdf = gdf.to_crs(dem_crs)
-                mask_geojson = {
-                    'type': 'FeatureCollection',
-                    'features': json.loads(gdf.to_json()).get('features', [])
-                }
-            except Exception:
-                # Fall back to provided coordinates as-is
-                pass
-
-            masked, _ = mask_raster_with_geojson(src, mask_geojson, crop=True)
-            # masked shape (bands, rows, cols)
-            dem_masked = masked[0]
-            mask_bool = np.where(np.isnan(dem_masked), False, True)
-            dem = np.where(mask_bool, dem_masked, np.nan)
-
-        valid = dem[~np.isnan(dem)]
-        if valid.size == 0:
-            return {
-                "baseline_reference_elevation": None,
-                "max_depth_m": 0.0,
-                "avg_depth_m": 0.0,
-                "volume_m3": 0.0
-            }
-
-        baseline = float(np.percentile(valid, 95))
-        depth = baseline - dem
-        depth[~np.isfinite(depth)] = 0.0
-        depth[depth < 0] = 0.0
-
-        # Downsample if still very large to speed integration
-        max_pixels = 10_000_000
-        if dem.size > max_pixels:
-            ds_factor = int(np.sqrt(dem.size / max_pixels)) + 1
-            dem = dem[::ds_factor, ::ds_factor]
-            pixel_width *= ds_factor
-            pixel_height *= ds_factor
-
-        # Integrate depth to volume: integrate along rows using Simpson per column, then multiply by pixel width
-        # dx along rows is pixel_height, and width accumulation multiplies by pixel_width
-        volume_columns = []
-        for col in range(depth.shape[1]):
-            col_values = depth[:, col]
-            # Only positive values contribute
-            col_values = np.where(col_values > 0, col_values, 0.0)
-            vol_col = _simpsons_rule_column(col_values, pixel_height) * pixel_width
-            volume_columns.append(vol_col)
-        volume_m3 = float(np.nansum(volume_columns))
-
-        max_depth = float(np.nanmax(depth)) if np.any(np.isfinite(depth)) else 0.0
-        avg_depth = float(np.nanmean(depth[depth > 0])) if np.any(depth > 0) else 0.0
+        geometries = _mining_geometries(src, mask_geojson) if mask_geojson is not None else []
+        # I/O and memory scale with the mined footprint rather than the DEM extent
+        dems = _read_footprints(src, geometries, context)
 
+    valid = np.concatenate([dem[~np.isnan(dem)] for dem in dems]) if dems else np.empty(0, dtype=np.float32)
+    if valid.size == 0:
         return {
-            "baseline_reference_elevation": baseline,
-            "max_depth_m": max_depth,
-            "avg_depth_m": avg_depth,
-            "volume_m3": volume_m3
+            "baseline_reference_elevation": None,
+            "max_depth_m": 0.0,
+            "avg_depth_m": 0.0,
+            "volume_m3": 0.0,
+            "integration_method": method
         }
 
+    with stage("baseline") as counts:
+        baseline = float(np.percentile(valid, 95))
+        counts["pixels"] = valid.size
+    del valid
+
+    volume_m3 = 0.0
+    max_depth = 0.0
+    depth_sum = 0.0
+    depth_count = 0
+    for done, dem in enumerate(dems):
+        if context is not None:
+            context.report(50 + 45 * done / len(dems), "integrating", windows_done=done, windows_total=len(dems))
+        with stage("integrate") as counts:
+            depth = baseline - dem
+            depth[~np.isfinite(depth)] = 0.0
+            depth[depth < 0] = 0.0
+
+            # Integration is a single matrix-vector product over the full-resolution grid, so no downsampling
+            volume_m3 += float(np.nansum(_volume_columns(depth, pixel_height, pixel_width, method, workers)))
+
+            positive = depth[depth > 0]
+            if positive.size:
+                max_depth = max(max_depth, float(positive.max()))
+                depth_sum += float(positive.sum(dtype=np.float64))
+                depth_count += int(positive.size)
+            counts["pixels"] = depth.size
+
+    avg_depth = depth_sum / depth_count if depth_count else 0.0
+
+    return {
+        "baseline_reference_elevation": baseline,
+        "max_depth_m": max_depth,
+        "avg_depth_m": avg_depth,
+        "volume_m3": volume_m3,
+        "integration_method": method
+    }
+
+
+def _feature_ids(mask_geojson: Dict[str, Any]) -> List[str]:
+    # Key zones by the feature id, then properties.id, falling back to the feature's position
+    ids = []
+    for i, feat in enumerate(_unwrap_geojson(mask_geojson).get('features', [])):
+        fid = feat.get('id')
+        if fid is None:
+            fid = (feat.get('properties') or {}).get('id')
+        ids.append(str(fid if fid is not None else i))
+    return ids
+
+
+def _grouped_percentile(labels: np.ndarray, values: np.ndarray, n_labels: int, q: float) -> np.ndarray:
+    """Per-label percentile (linear interpolation, as np.percentile) from one sort; NaN for empty labels."""
+    order = np.lexsort((values, labels))
+    sorted_values = values[order]
+    counts = np.bincount(labels, minlength=n_labels)
+    starts = np.cumsum(counts) - counts
+    result = np.full(n_labels, np.nan)
+    has = counts > 0
+    pos = (counts[has] - 1) * (q / 100.0)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.ceil(pos).astype(np.int64)
+    low_values = sorted_values[starts[has] + lo].astype(np.float64)
+    high_values = sorted_values[starts[has] + hi].astype(np.float64)
+    result[has] = low_values + (high_values - low_values) * (pos - lo)
+    return result
+
+
+def estimate_zonal_volumes(dem_path: str, mask_geojson: Dict[str, Any], method: str = "simpson",
+                           context: Optional[JobContext] = None) -> Dict[str, Any]:
+    """Baseline, volume, max and average depth for every feature of `mask_geojson` in one DEM pass.
+
+    Features are burned into a label grid per footprint window and every statistic is a grouped
+    reduction over that grid; where features overlap, the later feature owns the pixel. Columns are
+    integrated over each feature's own window, so a feature gets the volume estimate_volume gives it alone.
+    """
+    if method not in INTEGRATION_METHODS:
+        raise ValueError(f"Unknown integration method '{method}'; expected one of {', '.join(INTEGRATION_METHODS)}")
+    feature_ids = _feature_ids(mask_geojson)
+    n_labels = len(feature_ids) + 1  # label 0 is background
+
+    volume = np.zeros(n_labels)
+    max_depth = np.zeros(n_labels)
+    depth_sum = np.zeros(n_labels)
+    depth_count = np.zeros(n_labels, dtype=np.int64)
+    baseline = np.full(n_labels, np.nan)
+
+    with load_raster(dem_path) as src:
+        pixel_width = abs(src.transform.a)
+        pixel_height = abs(src.transform.e)
+        geometries = _mining_geometries(src, mask_geojson)
+
+        clusters = cluster_geometry_windows(src, geometries)
+        # First row and height of every feature's own window (the one it is read with on its own):
+        # Simpson weights depend on both, and a shared cluster window would shift them
+        feature_row = np.zeros(n_labels, dtype=np.int64)
+        feature_rows = np.zeros(n_labels, dtype=np.int64)
+        for _, members in clusters:
+            for i in members:
+                own = geometry_window(src, [geometries[i]])
+                feature_row[i + 1], feature_rows[i + 1] = int(own.row_off), int(own.height)
+        for done, (window, members) in enumerate(clusters):
+            if context is not None:
+                context.report(5 + 90 * done / len(clusters), "zonal", windows_done=done, windows_total=len(clusters))
+            with stage("raster_read") as counts:
+                dem = src.read(1, window=window, masked=True)
+                counts["bytes_read"], counts["pixels"] = dem.data.nbytes, dem.size
+            dem = dem.astype(np.float32).filled(np.nan)
+            with stage("rasterize") as counts:
+                labels = rasterize(
+                    [(geometries[i], i + 1) for i in members], out_shape=dem.shape,
+                    transform=src.window_transform(window), fill=0, dtype="int32"
+                )
+                counts["pixels"], counts["polygons"] = labels.size, len(members)
+            valid = (labels > 0) & ~np.isnan(dem)
+            if not valid.any():
+                continue
+            with stage("zonal_stats") as counts:
+                zone = labels[valid]
+                values = dem[valid]
+                counts["pixels"] = values.size
+
+                cluster_baseline = _grouped_percentile(zone, values, n_labels, 95)
+                present = ~np.isnan(cluster_baseline)
+                baseline[present] = cluster_baseline[present]
+
+                depth = cluster_baseline[zone] - values
+                depth[depth < 0] = 0.0
+
+                # Column quadrature is linear in depth, so per-pixel row weights let bincount split the volume by zone
+                rows = np.nonzero(valid)[0] + int(window.row_off) - feature_row[zone]
+                row_weights = _row_weights_at(rows, feature_rows[zone], pixel_height, method)
+                volume += np.bincount(zone, weights=row_weights * depth, minlength=n_labels) * pixel_width
+
+                np.maximum.at(max_depth, zone, depth)
+                positive = depth > 0
+                depth_sum += np.bincount(zone[positive], weights=depth[positive], minlength=n_labels)
+                depth_count += np.bincount(zone[positive], minlength=n_labels)
+
+    avg_depth = np.divide(depth_sum, depth_count, out=np.zeros(n_labels), where=depth_count > 0)
+    zones = {}
+    for label, fid in enumerate(feature_ids, start=1):
+        has_baseline = not np.isnan(baseline[label])
+        zones[fid] = {
+            "baseline_reference_elevation": float(baseline[label]) if has_baseline else None,
+            "max_depth_m": float(max_depth[label]),
+            "avg_depth_m": float(avg_depth[label]),
+            "volume_m3": float(volume[label])
+        }
 
+    return {
+        "zones": zones,
+        "volume_m3": float(volume[1:].sum()),
+        "integration_method": method
+    }